@@ -0,0 +1,592 @@
+"""
+An event-driven HTTP server for WSGI applications. A single thread
+multiplexes all of the connections, so that idle keep-alive connections
+and slow clients cost no more than a socket and a buffer each, while the
+application itself, which blocks on file I/O, is run on a fixed-size
+pool of threads. Responses are pulled from the application a chunk at a
+time, and only while the data waiting to be sent to the client is below
+a high-water mark, so that slow consumers hold back the application
+rather than causing responses to accumulate in memory.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import email.utils
+import errno
+import fcntl
+import io
+import logging
+import os
+import Queue
+import select
+import socket
+import sys
+import threading
+import time
+import urllib
+
+
+# The maximum number of bytes read from or written to a socket at once
+SOCKET_CHUNK_SIZE = 65536
+
+# Connection states
+READING = "reading"
+PROCESSING = "processing"
+CLOSING = "closing"
+
+_RESPONSE_START = "start"
+_RESPONSE_DATA = "data"
+_RESPONSE_END = "end"
+_RESPONSE_ERROR = "error"
+
+
+class ThreadPool(object):
+    """
+    A fixed number of threads running the functions submitted to the
+    pool, in the order they were submitted.
+    """
+    def __init__(self, numThreads):
+        self._queue = Queue.Queue()
+        self._threads = []
+        for _ in range(numThreads):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            function, args = task
+            try:
+                function(*args)
+            except Exception:
+                logging.getLogger(__name__).exception("Task failed")
+
+    def submit(self, function, *args):
+        """
+        Arranges for the specified function to be called with the
+        specified arguments on one of the pool's threads.
+        """
+        self._queue.put((function, args))
+
+    def getNumQueued(self):
+        """
+        Returns the number of submitted functions that have not yet
+        started to run.
+        """
+        return self._queue.qsize()
+
+    def shutdown(self):
+        """
+        Waits for the functions already submitted to complete, and stops
+        the threads.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class _Connection(object):
+    """
+    The state of a client connection, which is only modified on the
+    event loop thread.
+    """
+    def __init__(self, sock, address):
+        self.socket = sock
+        self.address = address
+        self.inBuffer = b""
+        self.outBuffer = bytearray()
+        self.state = READING
+        self.lastActivityTime = time.time()
+        # The response currently being sent
+        self.result = None
+        self.iterator = None
+        self.isHead = False
+        self.isChunked = False
+        self.keepAlive = False
+        # True while a task for this connection is running on the pool
+        self.busy = False
+        self.responseFinished = False
+        self.closed = False
+
+
+class AsyncServer(object):
+    """
+    Serves the specified WSGI application on the specified host and
+    port. At most numThreads requests are handled by the application at
+    once; if more than maxQueuedRequests further requests are waiting
+    for a thread, new requests are rejected with 503 Service
+    Unavailable. Request bodies are limited to maxRequestBytes, and
+    connections that have been idle between requests for
+    keepAliveTimeout seconds are closed. No more of a response is
+    obtained from the application while highWaterMark bytes of it are
+    waiting to be sent.
+    """
+    serverName = "ga4gh-asyncserver"
+    maxHeaderBytes = 65536
+
+    def __init__(
+            self, app, host, port, numThreads=8, maxQueuedRequests=100,
+            maxRequestBytes=2**20, keepAliveTimeout=60,
+            highWaterMark=2**20):
+        self._app = app
+        self._host = host
+        self._numThreads = numThreads
+        self._maxQueuedRequests = maxQueuedRequests
+        self._maxRequestBytes = maxRequestBytes
+        self._keepAliveTimeout = keepAliveTimeout
+        self._highWaterMark = highWaterMark
+        self._listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listenSocket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listenSocket.bind((host, port))
+        self._listenSocket.listen(socket.SOMAXCONN)
+        self._listenSocket.setblocking(0)
+        self._port = self._listenSocket.getsockname()[1]
+        # A pipe written to by other threads to wake the event loop. The
+        # lock prevents it being written to once it has been closed.
+        self._wakeReadFd, self._wakeWriteFd = os.pipe()
+        self._wakeLock = threading.Lock()
+        for fd in [self._wakeReadFd, self._wakeWriteFd]:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        # Results posted by the pool threads for the event loop
+        self._completions = collections.deque()
+        self._connections = {}
+        self._poll = None
+        self._pool = None
+        self._stopRequested = False
+        self._log = logging.getLogger(__name__)
+
+    def getPort(self):
+        """
+        Returns the port on which the server is listening.
+        """
+        return self._port
+
+    def getNumConnections(self):
+        """
+        Returns the number of open client connections.
+        """
+        return len(self._connections)
+
+    def getNumQueuedRequests(self):
+        """
+        Returns the number of requests waiting for a thread to become
+        free.
+        """
+        return self._pool.getNumQueued()
+
+    def stop(self):
+        """
+        Asks the server to stop. This may be called from any thread.
+        """
+        self._stopRequested = True
+        self._wake()
+
+    def _wake(self):
+        with self._wakeLock:
+            if self._wakeWriteFd is None:
+                return
+            try:
+                os.write(self._wakeWriteFd, b"x")
+            except OSError as error:
+                if error.errno != errno.EAGAIN:
+                    raise
+
+    def _post(self, connection, completion):
+        """
+        Passes the specified completion of a task for the specified
+        connection from a pool thread to the event loop.
+        """
+        self._completions.append((connection, completion))
+        self._wake()
+
+    def serve(self):
+        """
+        Runs the event loop until stop() is called.
+        """
+        self._pool = ThreadPool(self._numThreads)
+        self._poll = select.poll()
+        self._poll.register(self._listenSocket.fileno(), select.POLLIN)
+        self._poll.register(self._wakeReadFd, select.POLLIN)
+        self._log.info(
+            "Serving on %s:%d with %d threads", self._host, self._port,
+            self._numThreads)
+        try:
+            while not self._stopRequested:
+                try:
+                    events = self._poll.poll(1000)
+                except select.error as error:
+                    if error.args[0] != errno.EINTR:
+                        raise
+                    events = []
+                for fd, event in events:
+                    if fd == self._listenSocket.fileno():
+                        self._accept()
+                    elif fd == self._wakeReadFd:
+                        self._drainWakePipe()
+                    elif fd in self._connections:
+                        self._handleEvent(self._connections[fd], event)
+                self._handleCompletions()
+                self._closeIdleConnections()
+        finally:
+            for connection in list(self._connections.values()):
+                self._close(connection)
+            self._pool.shutdown()
+            self._listenSocket.close()
+            with self._wakeLock:
+                os.close(self._wakeReadFd)
+                os.close(self._wakeWriteFd)
+                self._wakeWriteFd = None
+
+    def _drainWakePipe(self):
+        try:
+            while os.read(self._wakeReadFd, 4096):
+                pass
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self._listenSocket.accept()
+            except socket.error as error:
+                if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                if error.args[0] in (errno.ECONNABORTED, errno.EINTR):
+                    continue
+                raise
+            sock.setblocking(0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = _Connection(sock, address)
+            self._connections[sock.fileno()] = connection
+            self._poll.register(sock.fileno(), select.POLLIN)
+
+    def _updatePoll(self, connection):
+        mask = 0
+        if connection.state == READING and not connection.busy:
+            mask |= select.POLLIN
+        if len(connection.outBuffer) > 0:
+            mask |= select.POLLOUT
+        self._poll.modify(connection.socket.fileno(), mask)
+
+    def _close(self, connection):
+        if connection.closed:
+            return
+        connection.closed = True
+        fd = connection.socket.fileno()
+        self._poll.unregister(fd)
+        del self._connections[fd]
+        connection.socket.close()
+        if not connection.busy:
+            self._closeResult(connection)
+
+    def _closeResult(self, connection):
+        result = connection.result
+        connection.result = None
+        connection.iterator = None
+        if result is not None and hasattr(result, "close"):
+            self._pool.submit(result.close)
+
+    def _closeIdleConnections(self):
+        oldestTime = time.time() - self._keepAliveTimeout
+        for connection in list(self._connections.values()):
+            if (connection.state == READING and not connection.busy and
+                    connection.lastActivityTime < oldestTime):
+                self._close(connection)
+
+    def _handleEvent(self, connection, event):
+        if event & select.POLLOUT:
+            self._send(connection)
+        if connection.closed:
+            return
+        if event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+            self._receive(connection)
+
+    def _receive(self, connection):
+        try:
+            data = connection.socket.recv(SOCKET_CHUNK_SIZE)
+        except socket.error as error:
+            if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b""
+        if len(data) == 0:
+            self._close(connection)
+            return
+        connection.lastActivityTime = time.time()
+        connection.inBuffer += data
+        self._startRequest(connection)
+
+    def _send(self, connection):
+        try:
+            sent = connection.socket.send(
+                connection.outBuffer[:SOCKET_CHUNK_SIZE])
+        except socket.error as error:
+            if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self._close(connection)
+            return
+        del connection.outBuffer[:sent]
+        connection.lastActivityTime = time.time()
+        self._continueResponse(connection)
+
+    def _continueResponse(self, connection):
+        """
+        Obtains more of the response for the specified connection if
+        there is room for it, or finishes with the response once it has
+        been sent.
+        """
+        if connection.closed or connection.busy:
+            return
+        if connection.state == PROCESSING:
+            if not connection.responseFinished:
+                if len(connection.outBuffer) < self._highWaterMark:
+                    connection.busy = True
+                    self._pool.submit(self._pullResponse, connection)
+            elif len(connection.outBuffer) == 0:
+                self._closeResult(connection)
+                if connection.keepAlive:
+                    connection.state = READING
+                    self._startRequest(connection)
+                else:
+                    self._close(connection)
+                    return
+        elif connection.state == CLOSING and len(connection.outBuffer) == 0:
+            self._close(connection)
+            return
+        self._updatePoll(connection)
+
+    def _sendError(self, connection, status):
+        """
+        Sends a response with the specified status without involving the
+        application, and closes the connection.
+        """
+        body = status.encode("ascii")
+        connection.outBuffer += (
+            b"HTTP/1.1 " + body + b"\r\n"
+            b"Content-Type: text/plain\r\n"
+            b"Content-Length: " + str(len(body)).encode("ascii") + b"\r\n"
+            b"Connection: close\r\n\r\n" + body)
+        connection.state = CLOSING
+        self._updatePoll(connection)
+
+    def _startRequest(self, connection):
+        """
+        Parses a request from the data received on the specified
+        connection, and if it is complete passes it to the application.
+        """
+        if connection.state != READING or connection.busy:
+            return
+        headerEnd = connection.inBuffer.find(b"\r\n\r\n")
+        if headerEnd == -1:
+            if len(connection.inBuffer) > self.maxHeaderBytes:
+                self._sendError(
+                    connection, "431 Request Header Fields Too Large")
+            else:
+                self._updatePoll(connection)
+            return
+        lines = connection.inBuffer[:headerEnd].split(b"\r\n")
+        try:
+            method, target, version = lines[0].split()
+            headers = []
+            for line in lines[1:]:
+                name, separator, value = line.partition(b":")
+                if separator == b"":
+                    raise ValueError()
+                headers.append((name.strip().lower(), value.strip()))
+            headerMap = dict(headers)
+            contentLength = int(headerMap.get(b"content-length", 0))
+        except ValueError:
+            self._sendError(connection, "400 Bad Request")
+            return
+        if b"transfer-encoding" in headerMap:
+            self._sendError(connection, "411 Length Required")
+            return
+        if contentLength > self._maxRequestBytes:
+            self._sendError(connection, "413 Request Entity Too Large")
+            return
+        bodyStart = headerEnd + 4
+        if len(connection.inBuffer) < bodyStart + contentLength:
+            self._updatePoll(connection)
+            return
+        body = connection.inBuffer[bodyStart:bodyStart + contentLength]
+        connection.inBuffer = connection.inBuffer[bodyStart + contentLength:]
+        if self._pool.getNumQueued() >= self._maxQueuedRequests:
+            self._sendError(connection, "503 Service Unavailable")
+            return
+        connectionHeader = headerMap.get(b"connection", b"").lower()
+        if version == b"HTTP/1.1":
+            connection.keepAlive = connectionHeader != b"close"
+        else:
+            connection.keepAlive = connectionHeader == b"keep-alive"
+        connection.isChunked = version == b"HTTP/1.1"
+        connection.isHead = method == b"HEAD"
+        connection.responseFinished = False
+        connection.state = PROCESSING
+        connection.busy = True
+        environ = self._getEnviron(
+            connection, method, target, version, headers, body)
+        self._pool.submit(self._runApplication, connection, environ)
+        self._updatePoll(connection)
+
+    def _getEnviron(self, connection, method, target, version, headers, body):
+        path, _, queryString = target.partition(b"?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": b"",
+            "PATH_INFO": urllib.unquote(path),
+            "QUERY_STRING": queryString,
+            "SERVER_NAME": self._host.encode("ascii"),
+            "SERVER_PORT": str(self._port),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": connection.address[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": str("http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers:
+            key = "HTTP_" + name.decode("ascii").upper().replace("-", "_")
+            if key in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+                key = key[len("HTTP_"):]
+            if key in environ:
+                value = environ[key] + b"," + value
+            environ[key] = value
+        return dict((str(key), value) for key, value in environ.items())
+
+    def _runApplication(self, connection, environ):
+        """
+        Calls the application for a request; run on a pool thread.
+        """
+        response = {}
+        writes = []
+
+        def startResponse(status, headers, excInfo=None):
+            if excInfo is not None and "sent" in response:
+                raise excInfo[0], excInfo[1], excInfo[2]
+            response["status"] = status
+            response["headers"] = headers
+            return writes.append
+
+        result = None
+        try:
+            result = self._app(environ, startResponse)
+            iterator = iter(result)
+            chunk = self._getNextChunk(iterator)
+            response["sent"] = True
+            chunk = b"".join(writes) + (chunk or b"")
+            self._post(connection, (
+                _RESPONSE_START, response["status"], response["headers"],
+                result, iterator, chunk))
+        except Exception:
+            self._log.exception("Error handling request")
+            self._post(connection, (_RESPONSE_ERROR, result))
+
+    def _getNextChunk(self, iterator):
+        """
+        Returns the next non-empty chunk of the specified response, or
+        None if it is exhausted.
+        """
+        for chunk in iterator:
+            if len(chunk) > 0:
+                return chunk
+        return None
+
+    def _pullResponse(self, connection):
+        """
+        Obtains the next chunk of a response; run on a pool thread.
+        """
+        try:
+            chunk = self._getNextChunk(connection.iterator)
+        except Exception:
+            self._log.exception("Error generating response")
+            self._post(connection, (_RESPONSE_ERROR, None))
+            return
+        if chunk is None:
+            self._post(connection, (_RESPONSE_END,))
+        else:
+            self._post(connection, (_RESPONSE_DATA, chunk))
+
+    def _handleCompletions(self):
+        while len(self._completions) > 0:
+            connection, completion = self._completions.popleft()
+            connection.busy = False
+            kind = completion[0]
+            if kind == _RESPONSE_START:
+                connection.result = completion[3]
+                connection.iterator = completion[4]
+            elif kind == _RESPONSE_ERROR and completion[1] is not None:
+                connection.result = completion[1]
+            if connection.closed:
+                self._closeResult(connection)
+                continue
+            connection.lastActivityTime = time.time()
+            if kind == _RESPONSE_START:
+                _, status, headers, _, _, chunk = completion
+                self._writeHeaders(connection, status, headers)
+                self._writeBody(connection, chunk)
+                if chunk is None:
+                    self._finishResponse(connection)
+            elif kind == _RESPONSE_DATA:
+                self._writeBody(connection, completion[1])
+            elif kind == _RESPONSE_END:
+                self._finishResponse(connection)
+            else:
+                started = connection.iterator is not None
+                self._closeResult(connection)
+                if started:
+                    # Part of the response has been sent, so the client
+                    # can only be told of the error by closing.
+                    connection.state = CLOSING
+                else:
+                    self._sendError(connection, "500 Internal Server Error")
+            self._continueResponse(connection)
+
+    def _writeHeaders(self, connection, status, headers):
+        headerNames = set(name.lower() for name, _ in headers)
+        headers = list(headers)
+        if "content-length" in headerNames:
+            connection.isChunked = False
+        elif connection.isHead:
+            connection.isChunked = False
+        elif connection.isChunked:
+            headers.append(("Transfer-Encoding", "chunked"))
+        else:
+            connection.keepAlive = False
+        if "date" not in headerNames:
+            headers.append(("Date", email.utils.formatdate(usegmt=True)))
+        if "server" not in headerNames:
+            headers.append(("Server", self.serverName))
+        if not connection.keepAlive:
+            headers.append(("Connection", "close"))
+        lines = ["HTTP/1.1 {}".format(status)]
+        lines.extend("{}: {}".format(name, value) for name, value in headers)
+        connection.outBuffer += (
+            "\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    def _writeBody(self, connection, chunk):
+        if chunk is None or connection.isHead:
+            return
+        if connection.isChunked:
+            connection.outBuffer += "{:x}\r\n".format(len(chunk)).encode(
+                "ascii")
+            connection.outBuffer += chunk
+            connection.outBuffer += b"\r\n"
+        else:
+            connection.outBuffer += chunk
+
+    def _finishResponse(self, connection):
+        if connection.isChunked and not connection.isHead:
+            connection.outBuffer += b"0\r\n\r\n"
+        connection.responseFinished = True
@@ -6,16 +6,34 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import functools
+import hashlib
 import json
 import os
+import uuid
 
+import ga4gh.cache as cache
 import ga4gh.datamodel as datamodel
 import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.reads as reads
 import ga4gh.datamodel.references as references
+import ga4gh.datamodel.variants as variants
 import ga4gh.exceptions as exceptions
+import ga4gh.metrics as metrics
 import ga4gh.protocol as protocol
 
 
+objectsPerPageHistogram = metrics.registry.register(metrics.Histogram(
+    "ga4gh_search_page_objects",
+    "Number of objects returned in each page of search results",
+    ["response"], metrics.COUNT_BUCKETS))
+pageResumeSkipsCounter = metrics.registry.register(metrics.Counter(
+    "ga4gh_page_resume_skipped_objects_total",
+    "Number of objects skipped to resume iteration from a page token",
+    ["iterator"]))
+
+
 def _parseIntegerArgument(args, key, defaultValue):
     """
     Attempts to parse the specified key in the specified argument
@@ -74,7 +92,8 @@ class IntervalIterator(object):
             # Set the search start point and the number of records to skip from
             # the page token.
             searchAnchor, objectsToSkip = _parsePageToken(request.pageToken, 2)
-            self._pickUpIteration(searchAnchor, objectsToSkip)
+            with metrics.timeStage("resume"):
+                self._pickUpIteration(searchAnchor, objectsToSkip)
 
     def _initialiseIteration(self):
         """
@@ -104,22 +123,27 @@ class IntervalIterator(object):
         self._distanceFromAnchor = objectsToSkip
         self._searchIterator = self._search(searchAnchor, self._request.end)
         obj = next(self._searchIterator)
+        numSkipped = 0
         if searchAnchor == self._request.start:
             # This is the initial set of intervals, we just skip forward
             # objectsToSkip positions
             for _ in range(objectsToSkip):
                 obj = next(self._searchIterator)
+            numSkipped = objectsToSkip
         else:
             # Now, we are past this initial set of intervals.
             # First, we need to skip forward over the intervals where
             # start < searchAnchor, as we've seen these already.
             while self._getStart(obj) < searchAnchor:
                 obj = next(self._searchIterator)
+                numSkipped += 1
             # Now, we skip over objectsToSkip objects such that
             # start == searchAnchor
             for _ in range(objectsToSkip):
                 assert self._getStart(obj) == searchAnchor
                 obj = next(self._searchIterator)
+                numSkipped += 1
+        pageResumeSkipsCounter.inc(numSkipped, (self.__class__.__name__,))
         self._currentObject = obj
         self._nextObject = next(self._searchIterator, None)
 
@@ -154,13 +178,14 @@ class ReadsIntervalIterator(IntervalIterator):
     """
     An interval iterator for reads
     """
-    def __init__(self, request, parentContainer, reference):
+    def __init__(self, request, parentContainer, reference, readFilter=None):
         self._reference = reference
+        self._readFilter = readFilter
         super(ReadsIntervalIterator, self).__init__(request, parentContainer)
 
     def _search(self, start, end):
         return self._parentContainer.getReadAlignments(
-            self._reference, start, end)
+            self._reference, start, end, self._readFilter)
 
     @classmethod
     def _getStart(cls, readAlignment):
@@ -177,11 +202,15 @@ class VariantsIntervalIterator(IntervalIterator):
     """
     An interval iterator for variants
     """
+    def __init__(self, request, parentContainer, variantFilter=None):
+        self._variantFilter = variantFilter
+        super(VariantsIntervalIterator, self).__init__(
+            request, parentContainer)
 
     def _search(self, start, end):
         return self._parentContainer.getVariants(
             self._request.referenceName, start, end,
-            self._request.callSetIds)
+            self._request.callSetIds, self._variantFilter)
 
     @classmethod
     def _getStart(cls, variant):
@@ -192,21 +221,101 @@ class VariantsIntervalIterator(IntervalIterator):
         return variant.end
 
 
+def _intersectObjectLists(allObjects, objectLists):
+    """
+    Returns the objects that appear in all of the specified lists, in
+    the order of the first list. If no lists are given, allObjects is
+    returned. Each list is typically the result of a lookup in a
+    secondary index, so this allows several filters to be combined
+    without scanning all objects.
+    """
+    if len(objectLists) == 0:
+        return allObjects
+    results = objectLists[0]
+    for objectList in objectLists[1:]:
+        objectIds = set(id(obj) for obj in objectList)
+        results = [obj for obj in results if id(obj) in objectIds]
+    return results
+
+
+class ReferenceSequenceStream(object):
+    """
+    A raw (non-JSON) representation of the bases of a reference in the
+    range [start, end), either as plain text with one byte per base or
+    packed four bases to a byte using the 2-bit encoding. The bytes are
+    produced lazily in chunks so that arbitrarily large ranges can be
+    streamed to the client without being held in memory.
+    """
+    def __init__(self, reference, start, end, twoBit, chunkSize):
+        self._reference = reference
+        self._start = start
+        self._end = end
+        self._twoBit = twoBit
+        self._basesPerByte = 1
+        if twoBit:
+            self._basesPerByte = 4
+        # Chunks must contain a whole number of bytes so that packed
+        # chunks can be concatenated.
+        self._chunkSize = max(
+            self._basesPerByte,
+            chunkSize - chunkSize % self._basesPerByte)
+
+    def isTwoBit(self):
+        """
+        Returns True if this stream is in the packed 2-bit encoding.
+        """
+        return self._twoBit
+
+    def getLength(self):
+        """
+        Returns the total length of this representation in bytes.
+        """
+        numBases = self._end - self._start
+        return (numBases + self._basesPerByte - 1) // self._basesPerByte
+
+    def generate(self, firstByte=0, lastByte=None):
+        """
+        Returns an iterator over the byte strings making up this
+        representation from firstByte (inclusive) to lastByte (exclusive).
+        """
+        if lastByte is None:
+            lastByte = self.getLength()
+        start = self._start + firstByte * self._basesPerByte
+        end = min(self._start + lastByte * self._basesPerByte, self._end)
+        chunks = self._reference.getBasesChunks(start, end, self._chunkSize)
+        for chunk in chunks:
+            if self._twoBit:
+                yield references.packTwoBit(chunk)
+            else:
+                yield chunk.encode("ascii")
+
+
 class AbstractBackend(object):
     """
     An abstract GA4GH backend.
     This class provides methods for all of the GA4GH protocol end points.
     """
+    # The number of pre-serialised values object generators yield at once,
+    # bounding how far a page can overshoot the maximum response length.
+    jsonChunkSize = 100
+
     def __init__(self):
         self._requestValidation = False
         self._responseValidation = False
         self._defaultPageSize = 100
         self._maxResponseLength = 2**20  # 1 MiB
+        self._referenceBasesPageLength = None
+        self._referenceSequenceChunkSize = 2**16
         self._datasetIdMap = {}
         self._datasetIds = []
         self._referenceSetIdMap = {}
         self._referenceSetNameMap = {}
         self._referenceSetIds = []
+        self._referenceSetMd5ChecksumMap = collections.defaultdict(list)
+        self._referenceSetAccessionMap = collections.defaultdict(list)
+        self._referenceSetAssemblyIdMap = collections.defaultdict(list)
+        self._dataVersion = uuid.uuid4().hex
+        self._responseCache = None
 
     def addDataset(self, dataset):
         """
@@ -218,12 +327,20 @@ class AbstractBackend(object):
 
     def addReferenceSet(self, referenceSet):
         """
-        Adds the specified reference set to this backend.
+        Adds the specified reference set to this backend. The reference
+        set must be fully populated, as it is indexed by its checksum,
+        accessions and assembly ID at this point.
         """
         id_ = referenceSet.getId()
         self._referenceSetIdMap[id_] = referenceSet
         self._referenceSetNameMap[referenceSet.getLocalId()] = referenceSet
         self._referenceSetIds.append(id_)
+        self._referenceSetMd5ChecksumMap[
+            referenceSet.getMd5Checksum()].append(referenceSet)
+        for accession in set(referenceSet.getSourceAccessions()):
+            self._referenceSetAccessionMap[accession].append(referenceSet)
+        self._referenceSetAssemblyIdMap[
+            referenceSet.getAssemblyId()].append(referenceSet)
 
     def setRequestValidation(self, requestValidation):
         """
@@ -250,6 +367,71 @@ class AbstractBackend(object):
         """
         self._maxResponseLength = maxResponseLength
 
+    def setReferenceBasesPageLength(self, referenceBasesPageLength):
+        """
+        Sets the maximum number of bases returned in a single page of a
+        listReferenceBases response. If this is None, the maximum
+        response length is used.
+        """
+        self._referenceBasesPageLength = referenceBasesPageLength
+
+    def setReferenceSequenceChunkSize(self, referenceSequenceChunkSize):
+        """
+        Sets the number of bases read from the reference at a time when
+        streaming raw reference sequences.
+        """
+        self._referenceSequenceChunkSize = referenceSequenceChunkSize
+
+    def setResponseCache(self, responseCache):
+        """
+        Sets the cache used to store the responses to search requests
+        to the specified instance of ga4gh.cache.AbstractCache. If this
+        is None, responses are not cached.
+        """
+        self._responseCache = responseCache
+
+    def getResponseCache(self):
+        """
+        Returns the cache used to store responses to search requests,
+        or None if responses are not cached.
+        """
+        return self._responseCache
+
+    def _getResponseCacheKey(
+            self, request, responseClass, avroBinary, filtersDict=None):
+        """
+        Returns the key used to cache the response to the specified
+        request object. This depends on the canonical JSON form of the
+        request and its filters, the response class and encoding, the
+        version of the data and the configuration that affects the
+        contents of a page.
+        """
+        requestDict = request.toJsonDict()
+        if filtersDict is not None:
+            requestDict[protocol.SEARCH_FILTERS_KEY] = filtersDict
+        requestStr = json.dumps(
+            requestDict, sort_keys=True, separators=(',', ':'))
+        return cache.getCacheKey(
+            requestStr, responseClass.__name__, str(avroBinary),
+            self.getDataVersion(), str(self._maxResponseLength))
+
+    def getDataVersion(self):
+        """
+        Returns a string that identifies the version of the data served
+        by this backend. Any change in the data results in a different
+        value, so this can be used to derive entity tags for responses.
+        By default this is unique to each backend instance.
+        """
+        return self._dataVersion
+
+    def hasDataChanged(self):
+        """
+        Returns True if the data served by this backend has changed
+        since it was loaded, so that a new backend should be created to
+        serve it. By default the data never changes.
+        """
+        return False
+
     def getDatasets(self):
         """
         Returns a list of datasets in this backend
@@ -361,7 +543,8 @@ class AbstractBackend(object):
         returned by call to the specified method, which must take a single
         integer as an argument. The returned generator yields a sequence of
         (object, nextPageToken) pairs, which allows this iteration to be picked
-        up at any point.
+        up at any point. The objects are the DatamodelObjects themselves,
+        so that their memoized JSON representations are used.
         """
         currentIndex = 0
         if request.pageToken is not None:
@@ -372,7 +555,7 @@ class AbstractBackend(object):
             nextPageToken = None
             if currentIndex < numObjects:
                 nextPageToken = str(currentIndex)
-            yield object_.toProtocolElement(), nextPageToken
+            yield object_, nextPageToken
 
     def _objectListGenerator(self, request, objectList):
         """
@@ -387,7 +570,7 @@ class AbstractBackend(object):
         Returns a generator suitable for a search method in which the
         result set is a single object.
         """
-        yield (datamodelObject.toProtocolElement(), None)
+        yield (datamodelObject, None)
 
     def _noObjectGenerator(self):
         """
@@ -425,20 +608,17 @@ class AbstractBackend(object):
         Returns a generator over the (referenceSet, nextPageToken) pairs
         defined by the specified request.
         """
-        results = []
-        for obj in self.getReferenceSets():
-            include = True
-            if request.md5checksum is not None:
-                if request.md5checksum != obj.getMd5Checksum():
-                    include = False
-            if request.accession is not None:
-                if request.accession not in obj.getSourceAccessions():
-                    include = False
-            if request.assemblyId is not None:
-                if request.assemblyId != obj.getAssemblyId():
-                    include = False
-            if include:
-                results.append(obj)
+        objectLists = []
+        if request.md5checksum is not None:
+            objectLists.append(self._referenceSetMd5ChecksumMap.get(
+                request.md5checksum, []))
+        if request.accession is not None:
+            objectLists.append(self._referenceSetAccessionMap.get(
+                request.accession, []))
+        if request.assemblyId is not None:
+            objectLists.append(self._referenceSetAssemblyIdMap.get(
+                request.assemblyId, []))
+        results = _intersectObjectLists(self.getReferenceSets(), objectLists)
         return self._objectListGenerator(request, results)
 
     def referencesGenerator(self, request):
@@ -447,17 +627,15 @@ class AbstractBackend(object):
         defined by the specified request.
         """
         referenceSet = self.getReferenceSet(request.referenceSetId)
-        results = []
-        for obj in referenceSet.getReferences():
-            include = True
-            if request.md5checksum is not None:
-                if request.md5checksum != obj.getMd5Checksum():
-                    include = False
-            if request.accession is not None:
-                if request.accession not in obj.getSourceAccessions():
-                    include = False
-            if include:
-                results.append(obj)
+        objectLists = []
+        if request.md5checksum is not None:
+            objectLists.append(referenceSet.getReferencesByMd5Checksum(
+                request.md5checksum))
+        if request.accession is not None:
+            objectLists.append(referenceSet.getReferencesByAccession(
+                request.accession))
+        results = _intersectObjectLists(
+            referenceSet.getReferences(), objectLists)
         return self._objectListGenerator(request, results)
 
     def variantSetsGenerator(self, request):
@@ -470,10 +648,11 @@ class AbstractBackend(object):
             request, dataset.getNumVariantSets(),
             dataset.getVariantSetByIndex)
 
-    def readsGenerator(self, request):
+    def readsGenerator(self, request, filters=None):
         """
         Returns a generator over the (read, nextPageToken) pairs defined
-        by the specified request
+        by the specified request, and meeting the conditions of the
+        specified ReadFilter if one is given.
         """
         if request.referenceId is None:
             raise exceptions.UnmappedReadsNotSupported()
@@ -488,20 +667,46 @@ class AbstractBackend(object):
         # Find the reference.
         referenceSet = readGroupSet.getReferenceSet()
         reference = referenceSet.getReference(request.referenceId)
-        intervalIterator = ReadsIntervalIterator(request, readGroup, reference)
+        intervalIterator = ReadsIntervalIterator(
+            request, readGroup, reference, filters)
         return intervalIterator
 
-    def variantsGenerator(self, request):
+    def variantsGenerator(self, request, filters=None):
         """
         Returns a generator over the (variant, nextPageToken) pairs defined
-        by the specified request.
+        by the specified request, and meeting the conditions of the
+        specified VariantFilter if one is given.
         """
         compoundId = datamodel.VariantSetCompoundId.parse(request.variantSetId)
         dataset = self.getDataset(compoundId.datasetId)
         variantSet = dataset.getVariantSet(compoundId.variantSetId)
-        intervalIterator = VariantsIntervalIterator(request, variantSet)
+        intervalIterator = VariantsIntervalIterator(
+            request, variantSet, filters)
         return intervalIterator
 
+    def _callSetJsonGenerator(self, request, variantSet):
+        """
+        Returns a generator over the call sets in the specified variant
+        set for the specified request, which takes the JSON strings for a
+        page as slices of the variant set's list. The generator yields
+        (jsonStrings, nextPageToken) pairs, where jsonStrings is a list
+        of at most jsonChunkSize strings, and the page tokens are those
+        of _topLevelObjectGenerator.
+        """
+        start = 0
+        if request.pageToken is not None:
+            start, = _parsePageToken(request.pageToken, 1)
+        numCallSets = variantSet.getNumCallSets()
+        end = min(start + request.pageSize, numCallSets)
+        while start < end:
+            chunkEnd = min(start + self.jsonChunkSize, end)
+            jsonStrings = variantSet.getCallSetJsonStrings(start, chunkEnd)
+            start = chunkEnd
+            nextPageToken = None
+            if start < numCallSets:
+                nextPageToken = str(start)
+            yield jsonStrings, nextPageToken
+
     def callSetsGenerator(self, request):
         """
         Returns a generator over the (callSet, nextPageToken) pairs defined
@@ -511,9 +716,7 @@ class AbstractBackend(object):
         dataset = self.getDataset(compoundId.datasetId)
         variantSet = dataset.getVariantSet(compoundId.variantSetId)
         if request.name is None:
-            return self._topLevelObjectGenerator(
-                request, variantSet.getNumCallSets(),
-                variantSet.getCallSetByIndex)
+            return self._callSetJsonGenerator(request, variantSet)
         else:
             try:
                 callSet = variantSet.getCallSetByName(request.name)
@@ -534,42 +737,95 @@ class AbstractBackend(object):
         Runs a get request by converting the specified datamodel
         object into its protocol representation.
         """
-        protocolElement = obj.toProtocolElement()
-        jsonString = protocolElement.toJsonString()
-        return jsonString
+        return obj.toJsonString()
 
     def runSearchRequest(
-            self, requestStr, requestClass, responseClass, objectGenerator):
+            self, requestStr, requestClass, responseClass, objectGenerator,
+            avroBinary=False, filterClass=None):
         """
         Runs the specified request. The request is a string containing
         a JSON representation of an instance of the specified requestClass.
         We return a string representation of an instance of the specified
-        responseClass in JSON format. Objects are filled into the page list
+        responseClass in JSON format, or in the Avro binary encoding if
+        avroBinary is True. Objects are filled into the page list
         using the specified object generator, which must return
         (object, nextPageToken) pairs, and be able to resume iteration from
         any point using the nextPageToken attribute of the request object.
+        The object may also be a list of the JSON strings of consecutive
+        values, in which case nextPageToken follows the last of them.
+        If a filterClass is given, the request may hold filter conditions,
+        which are parsed by its fromJsonDict method and passed to the
+        object generator as its filters argument.
         """
         self.startProfile()
-        try:
-            requestDict = json.loads(requestStr)
-        except ValueError:
-            raise exceptions.InvalidJsonException(requestStr)
-        self.validateRequest(requestDict, requestClass)
-        request = requestClass.fromJsonDict(requestDict)
+        with metrics.timeStage("json-parse"):
+            try:
+                requestDict = json.loads(requestStr)
+            except ValueError:
+                raise exceptions.InvalidJsonException(requestStr)
+        filtersDict = None
+        if isinstance(requestDict, dict):
+            filtersDict = requestDict.pop(protocol.SEARCH_FILTERS_KEY, None)
+        with metrics.timeStage("request-validation"):
+            self.validateRequest(requestDict, requestClass)
+            request = requestClass.fromJsonDict(requestDict)
         if request.pageSize is None:
             request.pageSize = self._defaultPageSize
         if request.pageSize <= 0:
             raise exceptions.BadPageSizeException(request.pageSize)
+        if filtersDict is not None:
+            if filterClass is None:
+                raise exceptions.InvalidSearchFilterException(
+                    "{} does not support filters".format(
+                        requestClass.__name__))
+            objectGenerator = functools.partial(
+                objectGenerator,
+                filters=filterClass.fromJsonDict(filtersDict))
+        cacheKey = None
+        if self._responseCache is not None:
+            cacheKey = self._getResponseCacheKey(
+                request, responseClass, avroBinary, filtersDict)
+            responseString = self._responseCache.get(cacheKey)
+            if responseString is not None:
+                self.endProfile()
+                return responseString
         responseBuilder = protocol.SearchResponseBuilder(
-            responseClass, request.pageSize, self._maxResponseLength)
+            responseClass, request.pageSize, self._maxResponseLength,
+            avroBinary)
+        addValue = responseBuilder.addValue
+        addJsonStrings = responseBuilder.addJsonStrings
+        timer = metrics.getStageTimer()
+        if timer is not None:
+            addValue = functools.partial(
+                timer.timeCall, "serialize", responseBuilder.addValue)
+            addJsonStrings = functools.partial(
+                timer.timeCall, "serialize", responseBuilder.addJsonStrings)
         nextPageToken = None
         for obj, nextPageToken in objectGenerator(request):
-            responseBuilder.addValue(obj)
+            if isinstance(obj, list):
+                addJsonStrings(obj)
+            else:
+                addValue(obj)
             if responseBuilder.isFull():
                 break
         responseBuilder.setNextPageToken(nextPageToken)
-        responseString = responseBuilder.getJsonString()
-        self.validateResponse(responseString, responseClass)
+        objectsPerPageHistogram.observe(
+            responseBuilder.getNumElements(), (responseClass.__name__,))
+        if avroBinary:
+            with metrics.timeStage("serialize"):
+                responseString = responseBuilder.getAvroBinary()
+            if self._responseValidation:
+                with metrics.timeStage("response-validation"):
+                    self.validateResponse(
+                        responseClass.fromAvroBinary(
+                            responseString).toJsonString(), responseClass)
+        else:
+            with metrics.timeStage("serialize"):
+                responseString = responseBuilder.getJsonString()
+            with metrics.timeStage("response-validation"):
+                self.validateResponse(responseString, responseClass)
+        if cacheKey is not None:
+            self._responseCache.set(cacheKey, responseString)
         self.endProfile()
         return responseString
 
@@ -587,7 +843,9 @@ class AbstractBackend(object):
             pageTokenStr = requestArgs['pageToken']
             start = _parsePageToken(pageTokenStr, 1)[0]
 
-        chunkSize = self._maxResponseLength
+        chunkSize = self._referenceBasesPageLength
+        if chunkSize is None:
+            chunkSize = self._maxResponseLength
         nextPageToken = None
         if start + chunkSize < end:
             end = start + chunkSize
@@ -601,6 +859,22 @@ class AbstractBackend(object):
         response.nextPageToken = nextPageToken
         return response.toJsonString()
 
+    def runGetReferenceSequence(self, id_, requestArgs, twoBit=False):
+        """
+        Runs a request for the raw sequence of the reference with the
+        specified ID, returning a ReferenceSequenceStream over the
+        range given by the 'start' and 'end' request arguments. If
+        twoBit is True the bases are packed using the 2-bit encoding.
+        """
+        compoundId = datamodel.ReferenceCompoundId.parse(id_)
+        referenceSet = self.getReferenceSet(compoundId.referenceSetId)
+        reference = referenceSet.getReference(id_)
+        start = _parseIntegerArgument(requestArgs, 'start', 0)
+        end = _parseIntegerArgument(requestArgs, 'end', reference.getLength())
+        reference.checkQueryRange(start, end)
+        return ReferenceSequenceStream(
+            reference, start, end, twoBit, self._referenceSequenceChunkSize)
+
     # Get requests.
 
     def runGetCallset(self, id_):
@@ -680,77 +954,77 @@ class AbstractBackend(object):
 
     # Search requests.
 
-    def runSearchReadGroupSets(self, request):
+    def runSearchReadGroupSets(self, request, avroBinary=False):
         """
         Runs the specified SearchReadGroupSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReadGroupSetsRequest,
             protocol.SearchReadGroupSetsResponse,
-            self.readGroupSetsGenerator)
+            self.readGroupSetsGenerator, avroBinary)
 
-    def runSearchReads(self, request):
+    def runSearchReads(self, request, avroBinary=False):
         """
         Runs the specified SearchReadsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReadsRequest,
             protocol.SearchReadsResponse,
-            self.readsGenerator)
+            self.readsGenerator, avroBinary, reads.ReadFilter)
 
-    def runSearchReferenceSets(self, request):
+    def runSearchReferenceSets(self, request, avroBinary=False):
         """
         Runs the specified SearchReferenceSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReferenceSetsRequest,
             protocol.SearchReferenceSetsResponse,
-            self.referenceSetsGenerator)
+            self.referenceSetsGenerator, avroBinary)
 
-    def runSearchReferences(self, request):
+    def runSearchReferences(self, request, avroBinary=False):
         """
         Runs the specified SearchReferenceRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchReferencesRequest,
             protocol.SearchReferencesResponse,
-            self.referencesGenerator)
+            self.referencesGenerator, avroBinary)
 
-    def runSearchVariantSets(self, request):
+    def runSearchVariantSets(self, request, avroBinary=False):
         """
         Runs the specified SearchVariantSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantSetsRequest,
             protocol.SearchVariantSetsResponse,
-            self.variantSetsGenerator)
+            self.variantSetsGenerator, avroBinary)
 
-    def runSearchVariants(self, request):
+    def runSearchVariants(self, request, avroBinary=False):
         """
         Runs the specified SearchVariantRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchVariantsRequest,
             protocol.SearchVariantsResponse,
-            self.variantsGenerator)
+            self.variantsGenerator, avroBinary, variants.VariantFilter)
 
-    def runSearchCallSets(self, request):
+    def runSearchCallSets(self, request, avroBinary=False):
         """
         Runs the specified SearchCallSetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchCallSetsRequest,
             protocol.SearchCallSetsResponse,
-            self.callSetsGenerator)
+            self.callSetsGenerator, avroBinary)
 
-    def runSearchDatasets(self, request):
+    def runSearchDatasets(self, request, avroBinary=False):
         """
         Runs the specified SearchDatasetsRequest.
         """
         return self.runSearchRequest(
             request, protocol.SearchDatasetsRequest,
             protocol.SearchDatasetsResponse,
-            self.datasetsGenerator)
+            self.datasetsGenerator, avroBinary)
 
 
 class EmptyBackend(AbstractBackend):
@@ -768,7 +1042,7 @@ class SimulatedBackend(AbstractBackend):
             numVariantSets=1, numCalls=1, variantDensity=0.5,
             numReferenceSets=1, numReferencesPerReferenceSet=1,
             numReadGroupSets=1, numReadGroupsPerReadGroupSet=1,
-            numAlignments=2):
+            numAlignments=2, readLength=100):
         super(SimulatedBackend, self).__init__()
 
         # References
@@ -790,7 +1064,7 @@ class SimulatedBackend(AbstractBackend):
                 numVariantSets=numVariantSets,
                 numReadGroupSets=numReadGroupSets,
                 numReadGroupsPerReadGroupSet=numReadGroupsPerReadGroupSet,
-                numAlignments=numAlignments)
+                numAlignments=numAlignments, readLength=readLength)
             self.addDataset(dataset)
 
 
@@ -812,3 +1086,26 @@ class FileSystemBackend(AbstractBackend):
                 relativePath = os.path.join(sourceDir, setName)
                 if os.path.isdir(relativePath):
                     objectAdder(constructor(setName, relativePath, self))
+        self._dataVersion = self._getFileSystemVersion()
+
+    def hasDataChanged(self):
+        return self._getFileSystemVersion() != self._dataVersion
+
+    def _getFileSystemVersion(self):
+        """
+        Returns a digest of the path, size and modification time of every
+        file in the data directory. Unlike the default data version, this
+        is the same for all backends serving the same files, and so can
+        be shared between server processes.
+        """
+        digest = hashlib.md5()
+        for dirPath, dirNames, fileNames in os.walk(
+                self._dataDir, followlinks=True):
+            dirNames.sort()
+            for fileName in sorted(fileNames):
+                path = os.path.join(dirPath, fileName)
+                stat = os.stat(path)
+                digest.update("{}\t{}\t{}\n".format(
+                    os.path.relpath(path, self._dataDir), stat.st_size,
+                    stat.st_mtime).encode("utf8"))
+        return digest.hexdigest()
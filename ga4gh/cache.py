@@ -0,0 +1,321 @@
+"""
+Bounded key-value caches used to store responses to protocol requests
+and the authentication tokens issued to clients. A number of storage
+implementations are provided: an in-process LRU cache, a cache stored
+in a directory that may be shared between processes, and a cache backed
+by a memcached-compatible client.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def getCacheKey(*values):
+    """
+    Returns a fixed length string key derived from the specified values,
+    suitable for use with any of the cache implementations.
+    """
+    digester = hashlib.md5()
+    for value in values:
+        digester.update(value.encode("utf-8"))
+        digester.update(b"\0")
+    return digester.hexdigest()
+
+
+def _encodeValue(value):
+    """
+    Returns the byte string stored for the specified value. Text is
+    encoded as UTF-8; a one byte prefix records whether the value was
+    text or binary so that _decodeValue can restore it.
+    """
+    if isinstance(value, unicode):
+        return b"t" + value.encode("utf-8")
+    return b"b" + value
+
+
+def _decodeValue(data):
+    """
+    Returns the value stored as the specified byte string by
+    _encodeValue.
+    """
+    if data[:1] == b"t":
+        return data[1:].decode("utf-8")
+    return data[1:]
+
+
+class CacheStatistics(object):
+    """
+    Counts the hits and misses for a cache, along with the number of
+    bytes that were served from the cache rather than being recomputed.
+    The counts may be updated by several threads at once.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytesSaved = 0
+        self._lock = threading.Lock()
+
+    def recordHit(self, numBytes):
+        """
+        Records a cache hit returning a value of the specified size.
+        """
+        with self._lock:
+            self.hits += 1
+            self.bytesSaved += numBytes
+
+    def recordMiss(self):
+        """
+        Records a cache miss.
+        """
+        with self._lock:
+            self.misses += 1
+
+    def getHitRatio(self):
+        """
+        Returns the fraction of lookups that were cache hits, or 0 if
+        there have been no lookups.
+        """
+        with self._lock:
+            hits = self.hits
+            lookups = hits + self.misses
+        if lookups == 0:
+            return 0
+        return hits / lookups
+
+
+class AbstractCache(object):
+    """
+    A cache mapping string keys to text or byte string values, such as
+    JSON or Avro binary encoded responses. Values expire after
+    the time to live (in seconds) has passed; a ttl of None means
+    values never expire. Subclasses implement the _get and _set methods,
+    which may be called by several threads at once.
+    """
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._statistics = CacheStatistics()
+
+    def getStatistics(self):
+        """
+        Returns the CacheStatistics for this cache.
+        """
+        return self._statistics
+
+    def get(self, key):
+        """
+        Returns the value stored for the specified key, or None if there
+        is no such value or it has expired.
+        """
+        value = self._get(key)
+        if value is None:
+            self._statistics.recordMiss()
+        else:
+            self._statistics.recordHit(len(value))
+        return value
+
+    def set(self, key, value):
+        """
+        Stores the specified value under the specified key.
+        """
+        self._set(key, value)
+
+    def _isExpired(self, storedTime):
+        return self._ttl is not None and time.time() - storedTime > self._ttl
+
+    def _get(self, key):
+        raise NotImplementedError()
+
+    def _set(self, key, value):
+        raise NotImplementedError()
+
+
+class LruCache(AbstractCache):
+    """
+    An in-process cache holding at most maxBytes of values. When this
+    size is exceeded, the least recently used values are evicted. The
+    cache may be used by several threads at once.
+    """
+    def __init__(self, maxBytes, ttl=None):
+        super(LruCache, self).__init__(ttl)
+        self._maxBytes = maxBytes
+        self._numBytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def getNumBytes(self):
+        """
+        Returns the total size of the values held in this cache.
+        """
+        return self._numBytes
+
+    def _remove(self, key):
+        storedTime, value = self._entries.pop(key)
+        self._numBytes -= len(value)
+
+    def _get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            storedTime, value = self._entries.pop(key)
+            if self._isExpired(storedTime):
+                self._numBytes -= len(value)
+                return None
+            self._entries[key] = storedTime, value
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if len(value) > self._maxBytes:
+                return
+            self._entries[key] = time.time(), value
+            self._numBytes += len(value)
+            while self._numBytes > self._maxBytes:
+                self._remove(next(iter(self._entries)))
+
+
+class FileSystemCache(AbstractCache):
+    """
+    A cache storing each value in a file within the specified directory,
+    so that it may be shared by several server processes. Writes are
+    atomic. The total size of the directory is kept below maxBytes by
+    removing the least recently written files; as this requires a scan
+    of the directory, it is done only after a tenth of maxBytes has been
+    written by this process since the last scan.
+    """
+    def __init__(self, directory, maxBytes, ttl=None):
+        super(FileSystemCache, self).__init__(ttl)
+        self._directory = directory
+        self._maxBytes = maxBytes
+        self._bytesSincePrune = 0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _getPath(self, key):
+        return os.path.join(self._directory, key)
+
+    def _get(self, key):
+        path = self._getPath(key)
+        try:
+            storedTime = os.path.getmtime(path)
+            with open(path, "rb") as cacheFile:
+                data = cacheFile.read()
+        except (IOError, OSError):
+            return None
+        if self._isExpired(storedTime):
+            return None
+        return _decodeValue(data)
+
+    def _set(self, key, value):
+        data = _encodeValue(value)
+        if len(data) > self._maxBytes:
+            return
+        fd, tempPath = tempfile.mkstemp(dir=self._directory, prefix=".")
+        with os.fdopen(fd, "wb") as tempFile:
+            tempFile.write(data)
+        os.rename(tempPath, self._getPath(key))
+        self._bytesSincePrune += len(data)
+        if self._bytesSincePrune * 10 > self._maxBytes:
+            self.prune()
+
+    def prune(self):
+        """
+        Removes expired files, and then the least recently written
+        files until the total size is within the cache's bound.
+        """
+        self._bytesSincePrune = 0
+        entries = []
+        for filename in os.listdir(self._directory):
+            if filename.startswith("."):
+                continue
+            path = os.path.join(self._directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(reverse=True)
+        numBytes = 0
+        for storedTime, size, path in entries:
+            numBytes += size
+            if numBytes > self._maxBytes or self._isExpired(storedTime):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+class MemcachedCache(AbstractCache):
+    """
+    A cache backed by a memcached-compatible client object, providing
+    get(key) and set(key, value, time) methods such as those of the
+    python-memcached package. Eviction is handled by the memcached
+    servers; expiry uses memcached's own time to live.
+    """
+    def __init__(self, client, ttl=None, keyPrefix="ga4gh:"):
+        super(MemcachedCache, self).__init__(ttl)
+        self._client = client
+        self._keyPrefix = keyPrefix
+
+    def _get(self, key):
+        data = self._client.get(str(self._keyPrefix + key))
+        if data is None:
+            return None
+        return _decodeValue(data)
+
+    def _set(self, key, value):
+        ttl = 0 if self._ttl is None else self._ttl
+        self._client.set(
+            str(self._keyPrefix + key), _encodeValue(value), time=ttl)
+
+
+class TokenStore(object):
+    """
+    Maps the authentication tokens issued by the server to the
+    authorization information obtained for them, which is stored as JSON
+    in the specified cache. The cache bounds the memory used by the
+    tokens and expires them once its time to live has passed; a cache
+    shared between processes allows a token issued by one server process
+    to be accepted by the others.
+    """
+    def __init__(self, tokenCache):
+        self._cache = tokenCache
+
+    def getCache(self):
+        """
+        Returns the cache holding the tokens.
+        """
+        return self._cache
+
+    def _getKey(self, token):
+        # Tokens come from clients, so must not be used as file names
+        return getCacheKey(token)
+
+    def add(self, token, authorization):
+        """
+        Stores the specified JSON serialisable authorization information
+        for the specified token.
+        """
+        value = json.dumps(authorization)
+        self._cache.set(self._getKey(token), value)
+
+    def get(self, token):
+        """
+        Returns the authorization information for the specified token,
+        or None if the token is unknown or has expired.
+        """
+        if token is None:
+            return None
+        value = self._cache.get(self._getKey(token))
+        if value is None:
+            return None
+        return json.loads(value)
@@ -8,18 +8,29 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+import fnmatch
+import heapq
 import logging
+import os
+import signal
+import sys
+import time
 import unittest
 import unittest.loader
 import unittest.suite
 
 import requests
 
+import ga4gh.asyncserver as asyncserver
 import ga4gh.client as client
 import ga4gh.converters as converters
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.stats as stats
 import ga4gh.frontend as frontend
 import ga4gh.configtest as configtest
 import ga4gh.exceptions as exceptions
+import ga4gh.prefork as prefork
+import ga4gh.profiling as profiling
 
 
 # the maximum value of a long type in avro = 2**63 - 1
@@ -56,6 +67,24 @@ def addServerOptions(parser):
     parser.add_argument(
         "--dont-use-reloader", default=False, action="store_true",
         help="Don't use the flask reloader")
+    parser.add_argument(
+        "--workers", "-w", default=0, type=int,
+        help="Serve from this number of worker processes forked from a "
+        "master process holding the data catalog, rather than running "
+        "the Flask development server. Send SIGHUP to the master to "
+        "reload the data.")
+    parser.add_argument(
+        "--data-check-interval", default=None, type=float,
+        help="With --workers, check the data directory for changes every "
+        "this number of seconds, and reload the data if it has changed")
+    parser.add_argument(
+        "--event-loop", default=False, action="store_true",
+        help="Serve connections from an event loop, handling requests on "
+        "a fixed number of threads, rather than running the Flask "
+        "development server")
+    parser.add_argument(
+        "--threads", default=8, type=int,
+        help="With --event-loop, the number of threads handling requests")
     addDisableUrllibWarningsArgument(parser)
 
 
@@ -72,6 +101,33 @@ def server_main(parser=None):
     sslContext = None
     if args.tls or ("OIDC_PROVIDER" in frontend.app.config):
         sslContext = "adhoc"
+    if args.event_loop:
+        if args.workers > 0 or sslContext is not None:
+            parser.error(
+                "--event-loop cannot be used with --workers or TLS")
+        server = asyncserver.AsyncServer(
+            frontend.app, args.host, args.port, numThreads=args.threads)
+        signal.signal(signal.SIGTERM, lambda *args: server.stop())
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.workers > 0:
+        if ("OIDC_PROVIDER" in frontend.app.config and
+                frontend.app.config["TOKEN_STORE"] == "memory"):
+            parser.error(
+                "--workers with OIDC requires a TOKEN_STORE shared between "
+                "processes ('filesystem' or 'memcached')")
+        server = prefork.PreforkServer(
+            frontend.app, args.host, args.port, args.workers,
+            initWorker=datamodel.fileHandleCache.clear,
+            reload=frontend.reloadBackend,
+            dataChanged=lambda: frontend.app.backend.hasDataChanged(),
+            checkInterval=args.data_check_interval,
+            sslContext=sslContext)
+        server.serve()
+        return
     frontend.app.run(
         host=args.host, port=args.port,
         use_reloader=not args.dont_use_reloader, ssl_context=sslContext)
@@ -405,11 +461,11 @@ class ListReferenceBasesRunner(AbstractQueryRunner):
         self._end = args.end
 
     def run(self):
-        iterator = self._httpClient.listReferenceBases(
+        iterator = self._httpClient.getReferenceSequence(
             self._referenceId, self._start, self._end)
         # TODO add support for FASTA output.
         for segment in iterator:
-            print(segment, end="")
+            sys.stdout.write(segment)
         print()
 
 
@@ -859,21 +915,89 @@ class Ga2VcfRunner(SearchVariantsRunner):
     """
     def __init__(self, args):
         super(Ga2VcfRunner, self).__init__(args)
+        self._baseUrl = args.baseUrl
+        self._logLevel = verbosityToLogLevel(args.verbose)
         self._outputFile = args.outputFile
+        self._numWorkers = args.workers
         self._binaryOutput = False
         if args.outputFormat == "bcf":
             self._binaryOutput = True
 
-    def run(self):
-        variantSet = self._httpClient.getVariantSet(self._variantSetId)
-        iterator = self._httpClient.searchVariants(
-            start=self._start, end=self._end,
+    def _getCallSets(self, variantSet):
+        if self._callSetIds is None:
+            return list(self._httpClient.searchCallSets(variantSet.id))
+        return [
+            self._httpClient.getCallSet(callSetId)
+            for callSetId in self._callSetIds]
+
+    def _getContigs(self, variantSet):
+        """
+        Returns the list of (name, length) pairs for the references of
+        the variant set's reference set, which must include the
+        reference being converted.
+        """
+        contigs = []
+        if variantSet.referenceSetId:
+            contigs = [
+                (reference.name, reference.length)
+                for reference in self._httpClient.searchReferences(
+                    variantSet.referenceSetId)]
+        if self._referenceName not in [name for name, _ in contigs]:
+            contigs.append((self._referenceName, None))
+        return contigs
+
+    def _searchShard(self, shardStart, shardEnd, first):
+        httpClient = client.HttpClient(
+            self._baseUrl, self._logLevel, self._key)
+        httpClient.setPageSize(self._pageSize)
+        iterator = httpClient.searchVariants(
+            start=shardStart, end=shardEnd,
             referenceName=self._referenceName,
             variantSetId=self._variantSetId,
             callSetIds=self._callSetIds)
+        for variant in iterator:
+            # Variants overlapping the boundary are returned by the
+            # searches on both sides of it; keep them in the first.
+            if first or variant.start >= shardStart:
+                yield variant
+
+    def _getShards(self, end):
+        """
+        Returns the list of iterators over the variants in contiguous
+        parts of the range being converted, one for each worker, or an
+        empty list if the range is empty.
+        """
+        if end <= self._start:
+            return []
+        numShards = max(1, min(self._numWorkers, end - self._start))
+        shardLength = -(-(end - self._start) // numShards)
+        shards = []
+        for shardStart in range(self._start, end, shardLength):
+            shards.append(self._searchShard(
+                shardStart, min(end, shardStart + shardLength),
+                shardStart == self._start))
+        return shards
+
+    def run(self):
+        variantSet = self._httpClient.getVariantSet(self._variantSetId)
+        callSets = self._getCallSets(variantSet)
+        contigs = self._getContigs(variantSet)
+        # The range can only be divided evenly between the workers if
+        # the length of the reference is known.
+        length = dict(contigs)[self._referenceName]
+        if self._numWorkers > 1 and length is not None:
+            iterator = converters.iterateShards(
+                self._getShards(min(self._end, length)))
+        else:
+            iterator = self._httpClient.searchVariants(
+                start=self._start, end=self._end,
+                referenceName=self._referenceName,
+                variantSetId=self._variantSetId,
+                callSetIds=self._callSetIds)
         # do conversion
         vcfConverter = converters.VcfConverter(
-            variantSet, iterator, self._outputFile, self._binaryOutput)
+            variantSet, iterator, self._outputFile, self._binaryOutput,
+            callSets, contigs)
         vcfConverter.convert()
 
 
@@ -903,6 +1027,10 @@ def getGa2VcfParser():
     addStartArgument(parser)
     addEndArgument(parser)
     addPageSizeArgument(parser)
+    parser.add_argument(
+        "--workers", "-w", default=1, type=int,
+        help="Split the region into this number of parts, which are "
+        "downloaded concurrently and merged into a single sorted output")
     return parser
 
 
@@ -923,25 +1051,85 @@ def ga2vcf_main():
 
 class Ga2SamRunner(SearchReadsRunner):
     """
-    Runner class for the ga2vcf
+    Runner class for the ga2sam
     """
     def __init__(self, args):
         args.readGroupIds = args.readGroupId
         super(Ga2SamRunner, self).__init__(args)
+        self._baseUrl = args.baseUrl
+        self._logLevel = verbosityToLogLevel(args.verbose)
+        self._verbose = args.verbose
         self._outputFile = args.outputFile
         self._binaryOutput = False
         if args.outputFormat == "bam":
             self._binaryOutput = True
 
-    def run(self):
-        readGroup = self._httpClient.getReadGroup(self._readGroupIds[0])
-        iterator = self._httpClient.searchReads(
-            readGroupIds=self._readGroupIds, referenceId=self._referenceId,
+    def _searchReads(self, readGroupId, referenceId, streamIndex):
+        httpClient = client.HttpClient(
+            self._baseUrl, self._logLevel, self._key)
+        httpClient.setPageSize(self._pageSize)
+        iterator = httpClient.searchReads(
+            readGroupIds=[readGroupId], referenceId=referenceId,
             start=self._start, end=self._end)
+        for index, read in enumerate(iterator):
+            yield (
+                read.alignment.position.position, streamIndex, index, read)
+
+    def _getReads(self, referenceIds):
+        """
+        Returns an iterator over the reads of all the read groups on
+        each of the specified references in turn. The reads of the
+        read groups on a reference are fetched concurrently and merged
+        into order of position.
+        """
+        for referenceId in referenceIds:
+            streams = [
+                converters.iterateInThread(
+                    self._searchReads(readGroupId, referenceId, streamIndex))
+                for streamIndex, readGroupId in enumerate(
+                    self._readGroupIds)]
+            for _, _, _, read in heapq.merge(*streams):
+                yield read
+
+    def run(self):
+        compoundId = datamodel.ReadGroupCompoundId.parse(
+            self._readGroupIds[0])
+        readGroupSet = self._httpClient.getReadGroupSet(
+            compoundId.readGroupSetId)
+        readGroups = dict(
+            (readGroup.id, readGroup)
+            for readGroup in readGroupSet.readGroups)
+        for readGroupId in self._readGroupIds:
+            if readGroupId not in readGroups:
+                raise converters.SamException(
+                    "Read group '{}' is not in read group set '{}'".format(
+                        readGroupId, readGroupSet.id))
+        referenceSetId = readGroups[self._readGroupIds[0]].referenceSetId
+        referenceSet = None
+        references = []
+        if referenceSetId is not None:
+            referenceSet = self._httpClient.getReferenceSet(referenceSetId)
+            references = list(
+                self._httpClient.searchReferences(referenceSetId))
+        if self._referenceId is None:
+            referenceIds = [reference.id for reference in references]
+        else:
+            referenceIds = [self._referenceId]
+            if self._referenceId not in [ref.id for ref in references]:
+                references.append(
+                    self._httpClient.getReference(self._referenceId))
         # do conversion
         samConverter = converters.SamConverter(
-            readGroup, iterator, self._outputFile, self._binaryOutput)
-        samConverter.convert()
+            readGroupSet, self._getReads(referenceIds), self._outputFile,
+            self._binaryOutput, references, referenceSet)
+        startTime = time.time()
+        numReads = samConverter.convert()
+        elapsedTime = time.time() - startTime
+        if self._verbose > 0:
+            print(
+                "Wrote {} reads in {:.2f} seconds ({:.0f} reads/s)".format(
+                    numReads, elapsedTime, numReads / elapsedTime),
+                file=sys.stderr)
 
 
 def getGa2SamParser():
@@ -951,13 +1139,16 @@ def getGa2SamParser():
     addUrlArgument(parser)
     parser.add_argument(
         "readGroupId",
-        help="The ReadGroup to convert to SAM/BAM format.")
+        help="The ReadGroup to convert to SAM/BAM format, or a "
+        "comma-separated list of ReadGroups from one ReadGroupSet to "
+        "merge into a single file")
     addPageSizeArgument(parser)
     addStartArgument(parser)
     addEndArgument(parser)
     parser.add_argument(
         "--referenceId", default=None,
-        help="The referenceId to search over")
+        help="The referenceId to search over. By default, the reads on "
+        "all references are converted")
     parser.add_argument(
         "--outputFormat", "-O", default="sam", choices=["sam", "bam"],
         help=(
@@ -1036,3 +1227,89 @@ def configtest_main(parser=None):
     for result in results.skipped:
         if result is not None:
             log.info('Skipped: {0}: {1}'.format(result[0].id(), result[1]))
+
+
+##############################################################################
+# Profile report
+##############################################################################
+
+
+def getProfileReportParser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Reports the functions in which the most time was spent across "
+            "the requests captured by the server's slow query profiler"))
+    parser.add_argument(
+        "directory",
+        help="The SLOW_QUERY_PROFILE_DIRECTORY holding the captured profiles")
+    parser.add_argument(
+        "--numEntries", "-n", default=20, type=int,
+        help="The number of functions and requests to report")
+    parser.add_argument(
+        "--sortKey", "-s", default="cumulative",
+        choices=["cumulative", "tottime", "ncalls"],
+        help="The statistic by which functions are ranked")
+    return parser
+
+
+def profilereport_main(parser=None):
+    if parser is None:
+        parser = getProfileReportParser()
+    args = parser.parse_args()
+    profilePaths = profiling.findProfiles(args.directory)
+    if len(profilePaths) == 0:
+        parser.error("No profiles found in '{}'".format(args.directory))
+    print(profiling.getHotspotReport(
+        profilePaths, args.numEntries, args.sortKey))
+
+
+##############################################################################
+# Statistics
+##############################################################################
+
+
+def getStatsParser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Computes the variant, call and read counts of indexed VCF, BCF "
+            "and BAM files, and stores them alongside the files for the "
+            "server to report"))
+    parser.add_argument(
+        "paths", nargs="+",
+        help="The data files, or directories to search for data files")
+    parser.add_argument(
+        "--force", "-f", action="store_true", default=False,
+        help="Recompute statistics that are already up to date")
+    return parser
+
+
+def findDataFiles(paths):
+    """
+    Returns the VCF, BCF and BAM files among the specified paths and
+    in the directories below them.
+    """
+    dataFiles = []
+    for path in paths:
+        if not os.path.isdir(path):
+            dataFiles.append(path)
+            continue
+        for dirPath, _, filenames in sorted(os.walk(path)):
+            for pattern in stats.DATA_FILE_PATTERNS:
+                for filename in sorted(fnmatch.filter(filenames, pattern)):
+                    dataFiles.append(os.path.join(dirPath, filename))
+    return dataFiles
+
+
+def stats_main(parser=None):
+    if parser is None:
+        parser = getStatsParser()
+    args = parser.parse_args()
+    dataFiles = findDataFiles(args.paths)
+    if len(dataFiles) == 0:
+        parser.error("No data files found in {}".format(args.paths))
+    for dataFile in dataFiles:
+        if not args.force and stats.readStatsFile(dataFile) is not None:
+            print("Up to date:", dataFile)
+            continue
+        stats.writeStatsFile(dataFile, stats.computeStats(dataFile))
+        print("Computed:", dataFile)
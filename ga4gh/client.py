@@ -5,6 +5,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import requests
 import posixpath
 import logging
@@ -35,16 +36,36 @@ class AbstractClient(object):
             jsonResponseString)
         return responseObject
 
+    def _deserializeAvroResponse(self, avroResponseString,
+                                 protocolResponseClass):
+        self._protocolBytesReceived += len(avroResponseString)
+        if avroResponseString == b'':
+            raise exceptions.EmptyResponseException()
+        return protocolResponseClass.fromAvroBinary(avroResponseString)
+
     def _runSearchPageRequest(
-            self, protocolRequest, objectName, protocolResponseClass):
+            self, protocolRequest, objectName, protocolResponseClass,
+            filters=None):
         """
         Runs a complete transaction with the server to obtain a single
         page of search results.
         """
         raise NotImplemented()
 
+    def _getSearchRequestString(self, protocolRequest, filters=None):
+        """
+        Returns the JSON string of the specified search request, including
+        the specified dictionary of filter conditions if it is not None.
+        """
+        if filters is None:
+            return protocolRequest.toJsonString()
+        requestDict = protocolRequest.toJsonDict()
+        requestDict[protocol.SEARCH_FILTERS_KEY] = filters
+        return json.dumps(requestDict)
+
     def _runSearchRequest(
-            self, protocolRequest, objectName, protocolResponseClass):
+            self, protocolRequest, objectName, protocolResponseClass,
+            filters=None):
         """
         Runs the specified request at the specified objectName and instantiates
         an object of the specified class. We yield each object in listAttr.
@@ -54,7 +75,7 @@ class AbstractClient(object):
         notDone = True
         while notDone:
             responseObject = self._runSearchPageRequest(
-                protocolRequest, objectName, protocolResponseClass)
+                protocolRequest, objectName, protocolResponseClass, filters)
             valueList = getattr(
                 responseObject, protocolResponseClass.getValueListName())
             for extract in valueList:
@@ -90,6 +111,36 @@ class AbstractClient(object):
             request.pageToken = response.nextPageToken
         return "".join(basesList)
 
+    def _runGetReferenceSequenceRequest(self, id_, start, end, twoBit):
+        """
+        Runs a request for the raw sequence of the specified reference,
+        returning an iterator over the byte strings received.
+        """
+        raise NotImplemented()
+
+    def getReferenceSequence(self, id_, start=0, end=None, twoBit=False):
+        """
+        Returns an iterator over the bases of the specified reference in
+        the range [start, end) as consecutive byte strings. Unlike
+        :meth:`listReferenceBases`, the sequence is streamed from the
+        server as it is read and is never held in memory in full.
+
+        :param str id_: The ID of the :class:`ga4gh.protocol.Reference`
+            of interest.
+        :param int start: The start of the range (inclusive).
+        :param int end: The end of the range (exclusive). If this is None
+            the sequence runs to the end of the reference.
+        :param bool twoBit: If True, the bases are packed four to a byte
+            using the UCSC 2-bit encoding rather than returned as text.
+        :return: An iterator over byte strings.
+        :rtype: iter
+        """
+        iterator = self._runGetReferenceSequenceRequest(
+            id_, start, end, twoBit)
+        for chunk in iterator:
+            self._protocolBytesReceived += len(chunk)
+            yield chunk
+
     def _runGetRequest(self, objectName, protocolResponseClass, id_):
         """
         Requests an object from the server and returns the object of
@@ -210,7 +261,7 @@ class AbstractClient(object):
 
     def searchVariants(
             self, variantSetId, start=None, end=None, referenceName=None,
-            callSetIds=None):
+            callSetIds=None, filters=None):
         """
         Returns an iterator over the Variants fulfilling the specified
         conditions from the specified VariantSet.
@@ -222,6 +273,8 @@ class AbstractClient(object):
         :param str referenceName: The name of the
             :class:`ga4gh.protocol.Reference` we wish to return variants from.
         :param list callSetIds: TODO
+        :param dict filters: The conditions the variants must meet, as
+            described in :class:`ga4gh.datamodel.variants.VariantFilter`.
         :return: An iterator over the :class:`ga4gh.protocol.Variant` objects
             defined by the query parameters.
         :rtype: iter
@@ -234,7 +287,7 @@ class AbstractClient(object):
         request.callSetIds = callSetIds
         request.pageSize = self._pageSize
         return self._runSearchRequest(
-            request, "variants", protocol.SearchVariantsResponse)
+            request, "variants", protocol.SearchVariantsResponse, filters)
 
     def searchDatasets(self):
         """
@@ -339,7 +392,8 @@ class AbstractClient(object):
             request, "readgroupsets", protocol.SearchReadGroupSetsResponse)
 
     def searchReads(
-            self, readGroupIds, referenceId=None, start=None, end=None):
+            self, readGroupIds, referenceId=None, start=None, end=None,
+            filters=None):
         """
         Returns an iterator over the Reads fulfilling the specified
         conditions from the specified ReadGroupIds.
@@ -351,6 +405,8 @@ class AbstractClient(object):
             mapped to.
         :param int start: TODO
         :param int end: TODO
+        :param dict filters: The conditions the reads must meet, as
+            described in :class:`ga4gh.datamodel.reads.ReadFilter`.
         :return: An iterator over the
             :class:`ga4gh.protocol.ReadAlignment` objects defined by
             the query parameters.
@@ -363,7 +419,7 @@ class AbstractClient(object):
         request.end = end
         request.pageSize = self._pageSize
         return self._runSearchRequest(
-            request, "reads", protocol.SearchReadsResponse)
+            request, "reads", protocol.SearchReadsResponse, filters)
 
 
 class HttpClient(AbstractClient):
@@ -380,13 +436,22 @@ class HttpClient(AbstractClient):
         the :mod:`logging` module. This is :data:`logging.WARNING` by default.
     :param str authenticationKey: The authentication key provided by the
         server after logging in.
+    :param bool compression: If True (the default), ask the server to
+        compress responses. Compressed responses are decompressed
+        incrementally as they are received.
+    :param bool avroBinary: If True, ask the server to return pages of
+        search results using the Avro binary encoding rather than JSON.
     """
 
     def __init__(
-            self, urlPrefix, logLevel=logging.WARNING, authenticationKey=None):
+            self, urlPrefix, logLevel=logging.WARNING, authenticationKey=None,
+            compression=True, avroBinary=False):
         super(HttpClient, self).__init__(logLevel)
         self._urlPrefix = urlPrefix
         self._authenticationKey = authenticationKey
+        self._compression = compression
+        self._avroBinary = avroBinary
+        self._sequenceChunkSize = 64 * 1024
         self._session = requests.Session()
         self._setupHttpSession()
         requestsLog = logging.getLogger("requests.packages.urllib3")
@@ -398,6 +463,10 @@ class HttpClient(AbstractClient):
         Sets up the common HTTP session parameters used by requests.
         """
         headers = {"Content-type": "application/json"}
+        if self._compression:
+            headers["Accept-Encoding"] = "gzip, deflate"
+        else:
+            headers["Accept-Encoding"] = "identity"
         self._session.headers.update(headers)
         # TODO is this unsafe????
         self._session.verify = False
@@ -421,10 +490,18 @@ class HttpClient(AbstractClient):
         return {'key': self._authenticationKey}
 
     def _runSearchPageRequest(
-            self, protocolRequest, objectName, protocolResponseClass):
+            self, protocolRequest, objectName, protocolResponseClass,
+            filters=None):
         url = posixpath.join(self._urlPrefix, objectName + '/search')
-        data = protocolRequest.toJsonString()
+        data = self._getSearchRequestString(protocolRequest, filters)
         self._logger.debug("request:{}".format(data))
+        if self._avroBinary:
+            response = self._session.post(
+                url, params=self._getHttpParameters(), data=data,
+                headers={"Accept": "avro/binary"})
+            self._checkResponseStatus(response)
+            return self._deserializeAvroResponse(
+                response.content, protocolResponseClass)
         response = self._session.post(
             url, params=self._getHttpParameters(), data=data)
         self._checkResponseStatus(response)
@@ -447,12 +524,28 @@ class HttpClient(AbstractClient):
         return self._deserializeResponse(
             response.text, protocol.ListReferenceBasesResponse)
 
+    def _runGetReferenceSequenceRequest(self, id_, start, end, twoBit):
+        urlSuffix = "references/{id}/sequence".format(id=id_)
+        url = posixpath.join(self._urlPrefix, urlSuffix)
+        params = self._getHttpParameters()
+        params['start'] = start
+        if end is not None:
+            params['end'] = end
+        accept = "text/plain"
+        if twoBit:
+            accept = "application/octet-stream"
+        response = self._session.get(
+            url, params=params, headers={"Accept": accept}, stream=True)
+        self._checkResponseStatus(response)
+        return response.iter_content(self._sequenceChunkSize)
+
 
 class LocalClient(AbstractClient):
 
-    def __init__(self, backend):
+    def __init__(self, backend, avroBinary=False):
         super(LocalClient, self).__init__()
         self._backend = backend
+        self._avroBinary = avroBinary
         self._getMethodMap = {
             "datasets": self._backend.runGetDataset,
             "referencesets": self._backend.runGetReferenceSet,
@@ -478,9 +571,15 @@ class LocalClient(AbstractClient):
         return self._deserializeResponse(responseJson, protocolResponseClass)
 
     def _runSearchPageRequest(
-            self, protocolRequest, objectName, protocolResponseClass):
+            self, protocolRequest, objectName, protocolResponseClass,
+            filters=None):
         searchMethod = self._searchMethodMap[objectName]
-        responseJson = searchMethod(protocolRequest.toJsonString())
+        requestString = self._getSearchRequestString(protocolRequest, filters)
+        if self._avroBinary:
+            responseAvro = searchMethod(requestString, avroBinary=True)
+            return self._deserializeAvroResponse(
+                responseAvro, protocolResponseClass)
+        responseJson = searchMethod(requestString)
         return self._deserializeResponse(responseJson, protocolResponseClass)
 
     def _runListReferenceBasesPageRequest(self, id_, request):
@@ -497,3 +596,11 @@ class LocalClient(AbstractClient):
         responseJson = self._backend.runListReferenceBases(id_, requestArgs)
         return self._deserializeResponse(
             responseJson, protocol.ListReferenceBasesResponse)
+
+    def _runGetReferenceSequenceRequest(self, id_, start, end, twoBit):
+        requestArgs = {"start": start}
+        if end is not None:
+            requestArgs["end"] = end
+        stream = self._backend.runGetReferenceSequence(
+            id_, requestArgs, twoBit)
+        return stream.generate()
@@ -7,6 +7,9 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import collections
+import os
+import Queue
+import threading
 
 import pysam
 
@@ -39,11 +42,36 @@ class SamException(Exception):
 
 class SamConverter(AbstractConverter):
     """
-    Converts a request to a SAM file
+    Converts the ReadAlignments from the specified iterator to a SAM or
+    BAM file. The header holds an RG line for each ReadGroup of the
+    specified ReadGroupSet, with PG lines for their programs, and an SQ
+    line for each of the specified References of the specified
+    ReferenceSet, in order; the reads must be on these references.
+
+    Fetching, conversion and writing overlap: the reads are taken from
+    the iterator on one thread and converted to AlignedSegments on
+    another, with at most bufferSize objects buffered between each
+    stage, while the calling thread writes them out.
     """
+    _encoding = 'utf8'
+
+    def __init__(
+            self, container, objectIterator, outputFile, binaryOutput,
+            references=None, referenceSet=None, bufferSize=1000):
+        super(SamConverter, self).__init__(
+            container, objectIterator, outputFile, binaryOutput)
+        self._references = [] if references is None else references
+        self._referenceSet = referenceSet
+        self._bufferSize = bufferSize
+
     def convert(self):
+        """
+        Run the conversion process, returning the number of reads
+        written.
+        """
         header = self._getHeader()
         targetIds = self._getTargetIds(header)
+        readGroupNames = self._getReadGroupNames()
         # pysam can't write to file streams (except for stdout)
         # http://pysam.readthedocs.org/en/latest/usage.html#using-streams
         if self._binaryOutput:
@@ -55,36 +83,92 @@ class SamConverter(AbstractConverter):
             fileString = self._outputFile
         alignmentFile = pysam.AlignmentFile(
             fileString, flags, header=header)
-        for read in self._objectIterator:
-            alignedSegment = SamLine.toAlignedSegment(read, targetIds)
-            alignmentFile.write(alignedSegment)
-        alignmentFile.close()
+        reads = iterateInThread(self._objectIterator, self._bufferSize)
+        alignedSegments = iterateInThread(
+            self._convertReads(reads, targetIds, readGroupNames),
+            self._bufferSize)
+        numReads = 0
+        try:
+            for alignedSegment in alignedSegments:
+                alignmentFile.write(alignedSegment)
+                numReads += 1
+        finally:
+            alignmentFile.close()
+        return numReads
+
+    def _convertReads(self, reads, targetIds, readGroupNames):
+        for read in reads:
+            yield SamLine.toAlignedSegment(read, targetIds, readGroupNames)
+
+    def _encode(self, value):
+        return unicode(value).encode(self._encoding)
+
+    def _getHeaderLine(self, *fields):
+        """
+        Returns the header line dictionary holding the specified (tag,
+        value) pairs that have values.
+        """
+        return dict(
+            (tag, self._encode(value)) for tag, value in fields
+            if value is not None)
 
     def _getHeader(self):
-        # TODO where to get actual values for header?
-        # need some kind of getReadGroup(readGroupId) method in protocol
-        # just add these dummy lines for now
-        header = {
-            'HD': {'VN': '1.0'},
-            'SQ': [
-                {'LN': 1575, 'SN': 'chr1'},
-                {'LN': 1584, 'SN': 'chr2'},
-            ],
-        }
+        header = {'HD': {'VN': '1.5'}}
+        assemblyId = None
+        if self._referenceSet is not None:
+            assemblyId = self._referenceSet.assemblyId
+        header['SQ'] = []
+        for reference in self._references:
+            headerLine = self._getHeaderLine(
+                ('SN', reference.name), ('AS', assemblyId),
+                ('M5', reference.md5checksum), ('UR', reference.sourceURI))
+            headerLine['LN'] = reference.length
+            header['SQ'].append(headerLine)
+        if self._container is not None:
+            programs = collections.OrderedDict()
+            header['RG'] = []
+            for readGroup in self._container.readGroups:
+                fields = [
+                    ('ID', readGroup.name), ('SM', readGroup.sampleId),
+                    ('DS', readGroup.description),
+                    ('PI', readGroup.predictedInsertSize)]
+                experiment = readGroup.experiment
+                if experiment is not None:
+                    fields.extend([
+                        ('LB', experiment.library),
+                        ('PU', experiment.platformUnit),
+                        ('CN', experiment.sequencingCenter),
+                        ('PL', experiment.instrumentModel)])
+                header['RG'].append(self._getHeaderLine(*fields))
+                for program in readGroup.programs:
+                    programs[program.id] = self._getHeaderLine(
+                        ('ID', program.id), ('PN', program.name),
+                        ('VN', program.version),
+                        ('CL', program.commandLine),
+                        ('PP', program.prevProgramId))
+            if len(programs) > 0:
+                header['PG'] = list(programs.values())
         return header
 
     def _getTargetIds(self, header):
-        # this seems to be how pysam sets the target ids
-        targetIds = collections.defaultdict(int)
-        targetId = 0
-        if 'SQ' in header:
-            headerLines = header['SQ']
-            for headerLine in headerLines:
-                refName = headerLine['SN']
-                targetIds[refName] = targetId
-                targetId += 1
+        # pysam numbers the references in the order of the SQ lines
+        targetIds = {}
+        for targetId, headerLine in enumerate(header['SQ']):
+            targetIds[headerLine['SN'].decode(self._encoding)] = targetId
         return targetIds
 
+    def _getReadGroupNames(self):
+        """
+        Returns a map from the IDs of the read groups to the names used
+        as their IDs in the header.
+        """
+        readGroupNames = {}
+        if self._container is not None:
+            for readGroup in self._container.readGroups:
+                readGroupNames[readGroup.id] = readGroup.name.encode(
+                    self._encoding)
+        return readGroupNames
+
 
 class SamLine(object):
     """
@@ -102,12 +186,21 @@ class SamLine(object):
         "MD", "OQ", "OC", "PG", "PT", "PU", "QT", "Q2", "R2", "RG", "RT",
         "SA", "U2", ])
     _tagIntegerArrayFields = set(["FZ", ])
+    _cigarOperations = dict(
+        (operation, i)
+        for i, operation in enumerate(reads.SamCigar.cigarStrings))
 
     def __init__(self):
         raise SamException("SamLine can't be instantiated")
 
     @classmethod
-    def toAlignedSegment(cls, read, targetIds):
+    def toAlignedSegment(cls, read, targetIds, readGroupNames=None):
+        """
+        Returns a pysam AlignedSegment for the specified ReadAlignment,
+        using the specified map of reference names to target IDs. If
+        the read has no RG tag, the name of its read group given by the
+        specified map from read group IDs to names is used.
+        """
         ret = pysam.AlignedSegment()
         # QNAME
         ret.query_name = read.fragmentName.encode(cls._encoding)
@@ -116,69 +209,79 @@ class SamLine(object):
         # FLAG
         ret.flag = cls.toSamFlag(read)
         # RNAME
-        refName = read.alignment.position.referenceName
-        ret.reference_id = targetIds[refName]
+        position = read.alignment.position
+        ret.reference_id = cls._getTargetId(
+            targetIds, position.referenceName)
         # POS
-        ret.reference_start = int(read.alignment.position.position)
+        ret.reference_start = int(position.position)
         # MAPQ
         ret.mapping_quality = read.alignment.mappingQuality
         # CIGAR
         ret.cigar = cls.toCigar(read)
-        # RNEXT
-        nextRefName = read.nextMatePosition.referenceName
-        ret.next_reference_id = targetIds[nextRefName]
-        # PNEXT
-        ret.next_reference_start = int(read.nextMatePosition.position)
+        # RNEXT and PNEXT; the mate's position is given as unavailable
+        # if it is on a reference that is not in the header
+        nextMatePosition = read.nextMatePosition
+        if (nextMatePosition is None or
+                nextMatePosition.referenceName not in targetIds):
+            ret.next_reference_id = -1
+            ret.next_reference_start = -1
+        else:
+            ret.next_reference_id = targetIds[
+                nextMatePosition.referenceName]
+            ret.next_reference_start = int(nextMatePosition.position)
         # TLEN
         ret.template_length = read.fragmentLength
         # QUAL
         ret.query_qualities = read.alignedQuality
-        ret.tags = cls.toTags(read)
+        tags = cls.toTags(read)
+        if readGroupNames is None:
+            readGroupNames = {}
+        if "RG" not in read.info and read.readGroupId in readGroupNames:
+            tags += (("RG", readGroupNames[read.readGroupId]),)
+        ret.tags = tags
         return ret
 
+    @classmethod
+    def _getTargetId(cls, targetIds, referenceName):
+        try:
+            return targetIds[referenceName]
+        except KeyError:
+            raise SamException(
+                "Read on reference '{}', which is not in the "
+                "header".format(referenceName))
+
     @classmethod
     def toSamFlag(cls, read):
         flag = 0
-        if read.numberReads:
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.NUMBER_READS)
+        if read.numberReads == 2:
+            flag |= reads.SamFlags.NUMBER_READS
+            if read.readNumber == 0:
+                flag |= reads.SamFlags.READ_NUMBER_ONE
+            elif read.readNumber == 1:
+                flag |= reads.SamFlags.READ_NUMBER_TWO
         if read.properPlacement:
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.PROPER_PLACEMENT)
+            flag |= reads.SamFlags.PROPER_PLACEMENT
         if read.alignment.position.strand == protocol.Strand.NEG_STRAND:
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.REVERSED)
-        if read.nextMatePosition.strand == protocol.Strand.NEG_STRAND:
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.NEXT_MATE_REVERSED)
-        if read.readNumber:
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.READ_NUMBER_ONE)
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.READ_NUMBER_TWO)
+            flag |= reads.SamFlags.REVERSED
+        if (read.nextMatePosition is not None and
+                read.nextMatePosition.strand == protocol.Strand.NEG_STRAND):
+            flag |= reads.SamFlags.NEXT_MATE_REVERSED
         if read.secondaryAlignment:
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.SECONDARY_ALIGNMENT)
+            flag |= reads.SamFlags.SECONDARY_ALIGNMENT
         if read.failedVendorQualityChecks:
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.FAILED_VENDOR_QUALITY_CHECKS)
+            flag |= reads.SamFlags.FAILED_VENDOR_QUALITY_CHECKS
         if read.duplicateFragment:
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.DUPLICATE_FRAGMENT)
+            flag |= reads.SamFlags.DUPLICATE_FRAGMENT
         if read.supplementaryAlignment:
-            reads.SamFlags.setFlag(
-                flag, reads.SamFlags.SUPPLEMENTARY_ALIGNMENT)
+            flag |= reads.SamFlags.SUPPLEMENTARY_ALIGNMENT
         return flag
 
     @classmethod
     def toCigar(cls, read):
-        cigarTuples = []
-        for gaCigarUnit in read.alignment.cigar:
-            operation = reads.SamCigar.ga2int(gaCigarUnit.operation)
-            length = int(gaCigarUnit.operationLength)
-            cigarTuple = (operation, length)
-            cigarTuples.append(cigarTuple)
-        return tuple(cigarTuples)
+        return tuple(
+            (cls._cigarOperations[gaCigarUnit.operation],
+             int(gaCigarUnit.operationLength))
+            for gaCigarUnit in read.alignment.cigar)
 
     @classmethod
     def _parseTagValue(cls, tag, value):
@@ -217,31 +320,270 @@ class VcfException(Exception):
 class VcfConverter(AbstractConverter):
     """
     Converts the Variants represented by a SearchVariantsRequest into
-    VCF format using pysam.
+    VCF or BCF format using pysam. The header is built from the
+    metadata of the VariantSet, the specified CallSets, which give the
+    sample columns in order, and the specified list of (name, length)
+    pairs describing the contigs; length may be None.
+
+    The variants are formatted as VCF text in a child process and
+    passed through a pipe to this process, where htslib parses them and
+    a pysam.VariantFile writes them out as they arrive, so that memory
+    use does not depend on the number of variants. The producer must be
+    a separate process rather than a thread, as pysam does not release
+    the GIL while it waits for input.
     """
-    def _writeHeader(self):
-        variantSet = self._container
-        # TODO convert this into pysam types and write to the output file.
-        # For now, just print out some stuff to demonstrate how to get the
-        # attributes we have.
-        print("ID = ", variantSet.id)
-        print("Dataset ID = ", variantSet.datasetId)
-        print("Metadata = ")
-        for metadata in variantSet.metadata:
-            print("\t", metadata)
-
-    def _writeBody(self):
+    _defaultVersion = "VCFv4.1"
+    _defaultFormats = [
+        ("GT", "1", "String", "Genotype"),
+        ("GL", "G", "Float", "Genotype likelihoods"),
+    ]
+    _escapes = [
+        ("%", "%25"), (";", "%3B"), ("=", "%3D"), (",", "%2C"),
+        (" ", "%20"), ("\t", "%09"), ("\n", "%0A")]
+
+    def __init__(
+            self, container, objectIterator, outputFile, binaryOutput,
+            callSets=None, contigs=None):
+        super(VcfConverter, self).__init__(
+            container, objectIterator, outputFile, binaryOutput)
+        if callSets is None:
+            callSets = []
+        if contigs is None:
+            contigs = []
+        self._callSetIds = [callSet.id for callSet in callSets]
+        self._sampleNames = [callSet.name for callSet in callSets]
+        self._contigs = contigs
+        self._contigNames = set(name for name, _ in contigs)
+        self._version = self._defaultVersion
+        self._infoTypes = {}
+        self._formats = collections.OrderedDict()
+        for metadata in container.metadata:
+            if metadata.key == "version" and metadata.value:
+                self._version = metadata.value
+            prefix, _, key = metadata.key.partition(".")
+            if prefix == "INFO":
+                self._infoTypes[key] = metadata
+            elif prefix == "FORMAT":
+                self._formats[key] = metadata
+
+    def getHeaderLines(self):
+        """
+        Returns the lines of the VCF header, without line terminators.
+        """
+        lines = ["##fileformat={}".format(self._version)]
+        for name, length in self._contigs:
+            if length is None:
+                lines.append("##contig=<ID={}>".format(name))
+            else:
+                lines.append("##contig=<ID={},length={}>".format(
+                    name, length))
+        for key, metadata in sorted(self._infoTypes.items()):
+            lines.append(self._getDefinitionLine(
+                "INFO", key, metadata.number, metadata.type,
+                metadata.description))
+        for key, number, type_, description in self._defaultFormats:
+            if key not in self._formats:
+                lines.append(self._getDefinitionLine(
+                    "FORMAT", key, number, type_, description))
+        for key, metadata in self._formats.items():
+            lines.append(self._getDefinitionLine(
+                "FORMAT", key, metadata.number, metadata.type,
+                metadata.description))
+        lines.append("\t".join([
+            "#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+            "FORMAT"] + self._sampleNames))
+        return lines
+
+    def _getDefinitionLine(self, prefix, key, number, type_, description):
+        description = (description or "").replace(
+            "\\", "\\\\").replace('"', '\\"')
+        return '##{}=<ID={},Number={},Type={},Description="{}">'.format(
+            prefix, key, number, type_, description)
+
+    def _escape(self, value):
+        for character, escape in self._escapes:
+            value = value.replace(character, escape)
+        return value
+
+    def getVariantLine(self, variant):
+        """
+        Returns the VCF line for the specified Variant, without a line
+        terminator. INFO and FORMAT fields that are not described by the
+        VariantSet's metadata are omitted, as they must be declared in
+        the header before the first variant is written.
+        """
+        if variant.referenceName not in self._contigNames:
+            raise VcfException(
+                "Variant on reference '{}', which is not in the "
+                "header".format(variant.referenceName))
+        info = []
+        for key, values in sorted(variant.info.items()):
+            metadata = self._infoTypes.get(key)
+            if metadata is None:
+                continue
+            if metadata.type == "Flag":
+                if values != ["False"]:
+                    info.append(key)
+            else:
+                info.append("{}={}".format(
+                    key, ",".join(self._escape(value) for value in values)))
+        fields = [
+            variant.referenceName, str(variant.start + 1),
+            ";".join(variant.names) or ".", variant.referenceBases,
+            ",".join(variant.alternateBases) or ".", ".", ".",
+            ";".join(info) or "."]
+        if len(self._callSetIds) > 0:
+            calls = dict((call.callSetId, call) for call in variant.calls)
+            keys = ["GT"]
+            if any(len(call.genotypeLikelihood) > 0
+                   for call in calls.values()):
+                keys.append("GL")
+            keys.extend(
+                key for key in self._formats
+                if key not in ("GT", "GL") and
+                any(key in call.info for call in calls.values()))
+            fields.append(":".join(keys))
+            for callSetId in self._callSetIds:
+                call = calls.get(callSetId)
+                if call is None:
+                    fields.append(".")
+                else:
+                    fields.append(":".join(
+                        self._getCallValue(call, key) for key in keys))
+        return "\t".join(fields)
+
+    def _getCallValue(self, call, key):
+        if key == "GT":
+            separator = "/" if call.phaseset is None else "|"
+            return separator.join(
+                "." if allele < 0 else str(allele)
+                for allele in call.genotype) or "."
+        elif key == "GL":
+            return ",".join(
+                str(value) for value in call.genotypeLikelihood) or "."
+        else:
+            values = call.info.get(key, [])
+            return ",".join(self._escape(value) for value in values) or "."
+
+    def _writeText(self, outputFile):
+        """
+        Writes the variants to the specified file as VCF text.
+        """
+        for line in self.getHeaderLines():
+            outputFile.write(line.encode("utf-8") + b"\n")
         for variant in self._objectIterator:
-            # TODO convert each variant object into pysam objects and write to
-            # the output file. For now, just print the first variant and break.
-            print(variant)
-            break
+            outputFile.write(
+                self.getVariantLine(variant).encode("utf-8") + b"\n")
 
     def convert(self):
         """
         Run the conversion process.
         """
-        # TODO allocate the pysam VCF object which can be used for the
-        # conversion process. See the convert method for ga2sam above.
-        self._writeHeader()
-        self._writeBody()
+        readFd, writeFd = os.pipe()
+        errorReadFd, errorWriteFd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(readFd)
+            os.close(errorReadFd)
+            exitStatus = 0
+            try:
+                with os.fdopen(writeFd, "wb") as outputFile:
+                    self._writeText(outputFile)
+            except Exception as exception:
+                os.write(errorWriteFd, "{}: {}".format(
+                    type(exception).__name__, exception).encode("utf-8"))
+                exitStatus = 1
+            finally:
+                os._exit(exitStatus)
+        os.close(writeFd)
+        os.close(errorWriteFd)
+        try:
+            self._writeVariantFile(readFd)
+        finally:
+            os.close(readFd)
+            _, status = os.waitpid(pid, 0)
+            with os.fdopen(errorReadFd, "rb") as errorFile:
+                error = errorFile.read().decode("utf-8")
+        if status != 0:
+            raise VcfException("Conversion failed: {}".format(error))
+
+    def _writeVariantFile(self, readFd):
+        # pysam can't read from or write to file streams (except for
+        # stdin and stdout)
+        inputFile = pysam.VariantFile("/dev/fd/{}".format(readFd), "r")
+        mode = "wb" if self._binaryOutput else "w"
+        fileString = "-"
+        if self._outputFile is not None:
+            fileString = self._outputFile
+        outputFile = pysam.VariantFile(
+            fileString, mode, header=inputFile.header)
+        try:
+            for record in inputFile:
+                outputFile.write(record)
+        finally:
+            outputFile.close()
+            inputFile.close()
+
+
+##############################################################################
+# Sharding
+##############################################################################
+
+
+_SHARD_OBJECTS = "objects"
+_SHARD_END = "end"
+_SHARD_ERROR = "error"
+
+
+def _consumeShard(iterable, queue, batchSize):
+    try:
+        batch = []
+        for obj in iterable:
+            batch.append(obj)
+            if len(batch) == batchSize:
+                queue.put((_SHARD_OBJECTS, batch))
+                batch = []
+        queue.put((_SHARD_OBJECTS, batch))
+        queue.put((_SHARD_END, None))
+    except Exception as exception:
+        queue.put((_SHARD_ERROR, exception))
+
+
+def iterateInThread(iterable, bufferSize=1000, batchSize=100):
+    """
+    Returns an iterator over the objects of the specified iterable,
+    which is consumed by a separate thread holding up to bufferSize
+    objects ahead of the caller.
+    """
+    return iterateShards([iterable], bufferSize, batchSize)
+
+
+def iterateShards(shardIterables, bufferSize=1000, batchSize=100):
+    """
+    Returns an iterator over the objects of each of the specified
+    iterables in turn, which are consumed concurrently by a thread
+    each. Objects from shards after the one currently being returned
+    are held in a buffer of at most bufferSize objects per shard, so
+    that the shards of a range of sorted objects can be fetched in
+    parallel and merged into sorted order using bounded memory. The
+    objects are passed between threads in lists of batchSize, as
+    synchronising on each object costs more than producing it.
+    """
+    batchSize = max(1, min(batchSize, bufferSize))
+    queues = []
+    for iterable in shardIterables:
+        queue = Queue.Queue(max(1, bufferSize // batchSize))
+        thread = threading.Thread(
+            target=_consumeShard, args=(iterable, queue, batchSize))
+        thread.daemon = True
+        thread.start()
+        queues.append(queue)
+    for queue in queues:
+        while True:
+            kind, value = queue.get()
+            if kind == _SHARD_END:
+                break
+            elif kind == _SHARD_ERROR:
+                raise value
+            for obj in value:
+                yield obj
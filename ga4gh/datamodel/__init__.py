@@ -10,8 +10,10 @@ import base64
 import collections
 import glob
 import os
+import threading
 
 import ga4gh.exceptions as exceptions
+import ga4gh.metrics as metrics
 
 
 class PysamFileHandleCache(object):
@@ -21,13 +23,45 @@ class PysamFileHandleCache(object):
     elements on the left of the deque and pop elements from the right.
     When a file is accessed via getFileHandle, its priority gets
     updated, it is put at the "top" of the deque.
+
+    A pysam file handle keeps the position it is reading from, so it
+    cannot be used by several threads at once. Each thread therefore
+    has its own deque of handles, and the maximum size of the cache
+    applies to each thread separately.
     """
 
     def __init__(self):
-        self._cache = collections.deque()
-        self._memoTable = dict()
+        self._threadState = threading.local()
+        # Incremented to make every thread close its handles
+        self._generation = 0
+        self._lock = threading.Lock()
         # Initialize the value even if it will be set up by the config
         self._maxCacheSize = 50
+        self._numHits = 0
+        self._numMisses = 0
+        self._numEvictions = 0
+
+    def _getThreadState(self):
+        """
+        Returns the handles of the calling thread, closing them first if
+        the cache has been cleared since they were opened.
+        """
+        state = self._threadState
+        if getattr(state, "generation", None) != self._generation:
+            for _, handle in getattr(state, "cache", []):
+                handle.close()
+            state.cache = collections.deque()
+            state.memoTable = dict()
+            state.generation = self._generation
+        return state
+
+    @property
+    def _cache(self):
+        return self._getThreadState().cache
+
+    @property
+    def _memoTable(self):
+        return self._getThreadState().memoTable
 
     def setMaxCacheSize(self, size):
         """
@@ -62,9 +96,46 @@ class PysamFileHandleCache(object):
         handle.close()
         return dataFile
 
+    def _count(self, counterName):
+        with self._lock:
+            setattr(self, counterName, getattr(self, counterName) + 1)
+
+    def getNumHits(self):
+        """
+        Returns the number of requests for a file handle that were served
+        from the cache.
+        """
+        return self._numHits
+
+    def getNumMisses(self):
+        """
+        Returns the number of requests for a file handle that required
+        the file to be opened.
+        """
+        return self._numMisses
+
+    def getNumEvictions(self):
+        """
+        Returns the number of file handles closed to keep the cache
+        within its maximum size.
+        """
+        return self._numEvictions
+
+    def clear(self):
+        """
+        Closes all of the file handles in the cache. A process forked
+        from one holding open files must call this before using the
+        cache, as the handles share their file offsets with the parent.
+        The calling thread's handles are closed at once, and those of
+        other threads when they next use the cache.
+        """
+        with self._lock:
+            self._generation += 1
+        self._getThreadState()
+
     def getCachedFiles(self):
         """
-        Returns all file names stored in the cache.
+        Returns all file names stored in the calling thread's cache.
         """
         return self._memoTable.keys()
 
@@ -75,27 +146,59 @@ class PysamFileHandleCache(object):
         its handle. Otherwise, open the file using openMethod, store
         it in the cache and return the corresponding handle.
         """
-        if dataFile in self._memoTable:
-            handle = self._memoTable[dataFile]
+        memoTable = self._memoTable
+        if dataFile in memoTable:
+            self._count("_numHits")
+            handle = memoTable[dataFile]
             self._update(dataFile, handle)
             return handle
         else:
+            self._count("_numMisses")
             try:
                 handle = openMethod(dataFile)
             except ValueError:
                 raise exceptions.FileOpenFailedException(dataFile)
 
-            self._memoTable[dataFile] = handle
+            memoTable[dataFile] = handle
             self._add(dataFile, handle)
-            if len(self._memoTable) > self._maxCacheSize:
+            if len(memoTable) > self._maxCacheSize:
+                self._count("_numEvictions")
                 dataFile = self._removeLru()
-                del self._memoTable[dataFile]
+                del memoTable[dataFile]
             return handle
 
 
-# LRU cache of open file handles
+# LRU cache of open file handles, for each thread
 fileHandleCache = PysamFileHandleCache()
 
+# The shared instances of the local IDs of the objects in the data
+# hierarchy, in a table for each string type: byte and unicode strings
+# with the same ASCII value compare equal, but are not interchangeable.
+_localIdTables = {}
+
+
+def internLocalId(localId):
+    """
+    Returns the shared instance of the specified local ID string. The
+    same local IDs recur throughout the data hierarchy (every variant
+    set in a VCF directory has call sets for the same samples), so the
+    objects holding them refer to a single copy of each. The table is
+    never pruned, so only the local IDs of the objects loaded from the
+    data may be interned, and not those of variants or reads, or of IDs
+    sent by clients.
+    """
+    table = _localIdTables.setdefault(type(localId), {})
+    return table.setdefault(localId, localId)
+
+
+def clearInternedLocalIds():
+    """
+    Discards the shared instances of local IDs, so that those of objects
+    no longer being served can be freed. Objects already holding them are
+    unaffected.
+    """
+    _localIdTables.clear()
+
 
 class CompoundId(object):
     """
@@ -107,6 +210,7 @@ class CompoundId(object):
     of the containing objects can be obtained using the corresponding
     like cid.datasetId and cid.variantSetId.
     """
+    __slots__ = ("_values",)
     separator = ':'
     fields = []
     """
@@ -129,26 +233,27 @@ class CompoundId(object):
         corresponding to its fields. If no parent id is present,
         parentCompoundId should be set to None.
         """
-        index = 0
+        values = ()
         if parentCompoundId is not None:
-            for field in parentCompoundId.fields:
-                setattr(self, field, getattr(parentCompoundId, field))
-                index += 1
-        for field, localId in zip(self.fields[index:], localIds):
-            setattr(self, field, str(localId))
-        if len(localIds) != len(self.fields) - index:
+            values = parentCompoundId._values
+        if len(localIds) != len(self.fields) - len(values):
             raise ValueError(
                 "Incorrect number of fields provided to instantiate ID")
+        self._values = values + tuple(str(localId) for localId in localIds)
+
+    def __getattr__(self, name):
+        # The fields and container IDs are derived from the values when
+        # they are asked for, rather than stored on every instance.
+        if name in self.fields:
+            return self._values[self.fields.index(name)]
         for idFieldName, prefix in self.containerIds:
-            values = [getattr(self, f) for f in self.fields[:prefix + 1]]
-            containerId = self.separator.join(values)
-            obfuscated = self.obfuscate(containerId)
-            setattr(self, idFieldName, obfuscated)
+            if idFieldName == name:
+                return self.obfuscate(
+                    self.separator.join(self._values[:prefix + 1]))
+        raise AttributeError(name)
 
     def __str__(self):
-        values = [getattr(self, f) for f in self.fields]
-        compoundIdStr = self.separator.join(values)
-        return self.obfuscate(compoundIdStr)
+        return self.obfuscate(self.separator.join(self._values))
 
     @classmethod
     def parse(cls, compoundIdStr):
@@ -161,6 +266,11 @@ class CompoundId(object):
         identifier (under our internal rules) is provided, the response should
         be that the identifier does not exist.
         """
+        with metrics.timeStage("id-parse"):
+            return cls._parse(compoundIdStr)
+
+    @classmethod
+    def _parse(cls, compoundIdStr):
         if not isinstance(compoundIdStr, basestring):
             raise exceptions.BadIdentifierException(compoundIdStr)
         try:
@@ -201,6 +311,7 @@ class ReferenceSetCompoundId(CompoundId):
     """
     The compound ID for reference sets.
     """
+    __slots__ = ()
     fields = ['referenceSet']
     containerIds = [('referenceSetId', 0)]
 
@@ -209,6 +320,7 @@ class ReferenceCompoundId(ReferenceSetCompoundId):
     """
     The compound id for a reference
     """
+    __slots__ = ()
     fields = ReferenceSetCompoundId.fields + ['reference']
 
 
@@ -216,6 +328,7 @@ class DatasetCompoundId(CompoundId):
     """
     The compound id for a data set
     """
+    __slots__ = ()
     fields = ['dataset']
     containerIds = [('datasetId', 0)]
 
@@ -224,6 +337,7 @@ class VariantSetCompoundId(DatasetCompoundId):
     """
     The compound id for a variant set
     """
+    __slots__ = ()
     fields = DatasetCompoundId.fields + ['variantSet']
     containerIds = DatasetCompoundId.containerIds + [('variantSetId', 1)]
 
@@ -232,6 +346,7 @@ class VariantCompoundId(VariantSetCompoundId):
     """
     The compound id for a variant
     """
+    __slots__ = ()
     fields = VariantSetCompoundId.fields + ['referenceName', 'start', 'md5']
 
 
@@ -239,6 +354,7 @@ class CallSetCompoundId(VariantSetCompoundId):
     """
     The compound id for a callset
     """
+    __slots__ = ()
     fields = VariantSetCompoundId.fields + ['name']
 
 
@@ -246,6 +362,7 @@ class ReadGroupSetCompoundId(DatasetCompoundId):
     """
     The compound id for a read group set
     """
+    __slots__ = ()
     fields = DatasetCompoundId.fields + ['readGroupSet']
     containerIds = DatasetCompoundId.containerIds + [('readGroupSetId', 1)]
 
@@ -254,6 +371,7 @@ class ReadGroupCompoundId(ReadGroupSetCompoundId):
     """
     The compound id for a read group
     """
+    __slots__ = ()
     fields = ReadGroupSetCompoundId.fields + ['readGroup']
     containerIds = ReadGroupSetCompoundId.containerIds + [('readGroupId', 2)]
 
@@ -262,6 +380,7 @@ class ExperimentCompoundId(ReadGroupCompoundId):
     """
     The compound id for an experiment
     """
+    __slots__ = ()
     fields = ReadGroupCompoundId.fields + ['experiment']
     containerIds = ReadGroupCompoundId.containerIds + [('experimentId', 3)]
 
@@ -270,6 +389,7 @@ class ReadAlignmentCompoundId(ReadGroupCompoundId):
     """
     The compound id for a read alignment
     """
+    __slots__ = ()
     fields = ReadGroupCompoundId.fields + ['readAlignment']
 
 
@@ -282,18 +402,28 @@ class DatamodelObject(object):
     which uniquely idenfifies the object within a server instance. The
     localId is a name that identifies the object with a given its
     parent container.
+
+    Catalogs can hold very many of these objects, so the base classes
+    declare their attributes in __slots__; subclasses that are
+    instantiated in large numbers should do the same.
     """
+    __slots__ = (
+        "_parentContainer", "_localId", "_compoundId", "_jsonString")
 
     compoundIdClass = None
     """ The class for compoundIds. Must be set in concrete subclasses.  """
 
     def __init__(self, parentContainer, localId):
         self._parentContainer = parentContainer
-        self._localId = localId
+        self._localId = internLocalId(localId)
+        self._jsonString = None
         parentId = None
         if parentContainer is not None:
             parentId = parentContainer.getCompoundId()
-        self._compoundId = self.compoundIdClass(parentId, localId)
+        # The compound IDs of the objects in the data hierarchy share
+        # their values, unlike those made for each variant or read.
+        self._compoundId = self.compoundIdClass(
+            parentId, internLocalId(str(localId)))
 
     def getId(self):
         """
@@ -326,6 +456,46 @@ class DatamodelObject(object):
         """
         return self._parentContainer
 
+    def toJsonString(self):
+        """
+        Returns the JSON representation of the protocol element for this
+        DatamodelObject.
+        """
+        return self.toProtocolElement().toJsonString()
+
+    def toJsonDict(self):
+        """
+        Returns the JSON dictionary representation of the protocol element
+        for this DatamodelObject.
+        """
+        return self.toProtocolElement().toJsonDict()
+
+
+class ImmutableContainerMixin(object):
+    """
+    A mixin for container DatamodelObjects, such as datasets and read
+    group sets, whose protocol representations do not change once they
+    have been loaded. The JSON representation is built the first time it
+    is needed and reused, so that gets and searches over these objects
+    only copy strings. Methods changing the representation while the
+    container is being loaded must call invalidateJsonString.
+    """
+    __slots__ = ()
+
+    def toJsonString(self):
+        jsonString = self._jsonString
+        if jsonString is None:
+            jsonString = super(ImmutableContainerMixin, self).toJsonString()
+            self._jsonString = jsonString
+        return jsonString
+
+    def invalidateJsonString(self):
+        """
+        Discards the JSON representation of this object, so that it is
+        rebuilt when next needed.
+        """
+        self._jsonString = None
+
 
 class PysamDatamodelMixin(object):
     """
@@ -333,6 +503,8 @@ class PysamDatamodelMixin(object):
     directories of files interpreted using pysam. This mixin is designed
     to work within the DatamodelObject hierarchy.
     """
+    __slots__ = ()
+
     samMin = 0
     samMaxStart = 2**30 - 1
     samMaxEnd = 2**30
@@ -419,7 +591,7 @@ class PysamDatamodelMixin(object):
         """
         Sets the creationTime and accessTime for this file system based
         DatamodelObject. This is derived from the ctime of the specified
-        directoryPath.
+        directoryPath (which may also be the path of a file).
         """
         ctimeInMillis = int(os.path.getctime(directoryPath) * 1000)
         self._creationTime = ctimeInMillis
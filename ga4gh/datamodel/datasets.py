@@ -15,7 +15,8 @@ import ga4gh.exceptions as exceptions
 import ga4gh.protocol as protocol
 
 
-class AbstractDataset(datamodel.DatamodelObject):
+class AbstractDataset(
+        datamodel.ImmutableContainerMixin, datamodel.DatamodelObject):
     """
     The base class of datasets containing variants and reads
     """
@@ -124,7 +125,7 @@ class SimulatedDataset(AbstractDataset):
             self, localId, referenceSet, randomSeed=0,
             numVariantSets=1, numCalls=1, variantDensity=0.5,
             numReadGroupSets=1, numReadGroupsPerReadGroupSet=1,
-            numAlignments=1):
+            numAlignments=1, readLength=100):
         super(SimulatedDataset, self).__init__(localId)
         # Variants
         for i in range(numVariantSets):
@@ -139,7 +140,7 @@ class SimulatedDataset(AbstractDataset):
             seed = randomSeed + i
             readGroupSet = reads.SimulatedReadGroupSet(
                 self, localId, referenceSet, seed,
-                numReadGroupsPerReadGroupSet, numAlignments)
+                numReadGroupsPerReadGroupSet, numAlignments, readLength)
             self.addReadGroupSet(readGroupSet)
 
 
@@ -7,12 +7,20 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import functools
+import hashlib
+import heapq
+import itertools
+import random
+import time
 
 import pysam
 
 import ga4gh.datamodel as datamodel
 import ga4gh.datamodel.references as references
+import ga4gh.datamodel.stats as stats
 import ga4gh.exceptions as exceptions
+import ga4gh.metrics as metrics
 import ga4gh.protocol as protocol
 
 
@@ -85,7 +93,65 @@ class SamFlags(object):
         flagAttr |= flag
 
 
-class AbstractReadGroupSet(datamodel.DatamodelObject):
+class ReadFilter(object):
+    """
+    Conditions on reads given by the "filters" object of a search reads
+    request, which are tested on the pysam AlignedSegments before they
+    are converted, so that only matching reads are converted, counted in
+    pages and returned. A read must meet all of the conditions, which
+    are those of the -q, -f and -F options of samtools view:
+
+    minMappingQuality: its MAPQ is at least this value.
+    requiredFlags: all of the bits of this mask are set in its SAM flag.
+    excludedFlags: none of the bits of this mask are set in its SAM flag;
+        for example, 0x700 excludes secondary alignments, reads failing
+        quality checks and duplicates.
+    """
+    def __init__(self, minMappingQuality=0, requiredFlags=0, excludedFlags=0):
+        self.minMappingQuality = minMappingQuality
+        self.requiredFlags = requiredFlags
+        self.excludedFlags = excludedFlags
+
+    @classmethod
+    def fromJsonDict(cls, jsonDict):
+        """
+        Returns the ReadFilter for the specified "filters" object of a
+        request, raising an InvalidSearchFilterException if it is invalid.
+        """
+        if not isinstance(jsonDict, dict):
+            raise exceptions.InvalidSearchFilterException(
+                "filters must be an object")
+        keys = ["minMappingQuality", "requiredFlags", "excludedFlags"]
+        unknownKeys = set(jsonDict) - set(keys)
+        if len(unknownKeys) > 0:
+            raise exceptions.InvalidSearchFilterException(
+                "unknown filters {}".format(sorted(unknownKeys)))
+        values = []
+        for key in keys:
+            value = jsonDict.get(key)
+            if value is None:
+                value = 0
+            if (not isinstance(value, (int, long)) or
+                    isinstance(value, bool) or value < 0):
+                raise exceptions.InvalidSearchFilterException(
+                    "{} must be a non-negative integer".format(key))
+            values.append(value)
+        return cls(*values)
+
+    def isMatch(self, read):
+        """
+        Returns True if the specified pysam AlignedSegment meets these
+        conditions.
+        """
+        flag = read.flag
+        return (
+            flag & self.requiredFlags == self.requiredFlags and
+            flag & self.excludedFlags == 0 and
+            read.mapping_quality >= self.minMappingQuality)
+
+
+class AbstractReadGroupSet(
+        datamodel.ImmutableContainerMixin, datamodel.DatamodelObject):
     """
     The base class of a read group set
     """
@@ -104,6 +170,7 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
         id_ = readGroup.getId()
         self._readGroupIdMap[id_] = readGroup
         self._readGroupIds.append(id_)
+        self.invalidateJsonString()
 
     def getReadGroups(self):
         """
@@ -137,10 +204,11 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
             for readGroup in self.getReadGroups()]
         readGroupSet.name = self.getLocalId()
         readGroupSet.datasetId = self.getParentContainer().getId()
-        stats = protocol.ReadStats()
-        stats.alignedReadCount = self.getNumAlignedReads()
-        stats.unalignedReadCount = self.getNumUnalignedReads()
-        readGroupSet.stats = stats
+        readStats = protocol.ReadStats()
+        readStats.alignedReadCount = self.getNumAlignedReads()
+        readStats.unalignedReadCount = self.getNumUnalignedReads()
+        readStats.baseCount = self.getBaseCount()
+        readGroupSet.stats = readStats
         return readGroupSet
 
     def getNumAlignedReads(self):
@@ -155,6 +223,13 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
         """
         raise NotImplementedError()
 
+    def getBaseCount(self):
+        """
+        Return the number of bases in this read group set, or None if
+        it is not known
+        """
+        raise NotImplementedError()
+
     def getPrograms(self):
         """
         Returns an array of Programs used to generate this read group set
@@ -168,7 +243,7 @@ class SimulatedReadGroupSet(AbstractReadGroupSet):
     """
     def __init__(
             self, parentContainer, localId, referenceSet, randomSeed=1,
-            numReadGroups=1, numAlignments=2):
+            numReadGroups=1, numAlignments=2, readLength=100):
         super(SimulatedReadGroupSet, self).__init__(
             parentContainer, localId)
         self._referenceSet = referenceSet
@@ -176,15 +251,20 @@ class SimulatedReadGroupSet(AbstractReadGroupSet):
         for i in range(numReadGroups):
             localId = "rg{}".format(i)
             readGroup = SimulatedReadGroup(
-                self, localId, randomSeed + i, numAlignments)
+                self, localId, randomSeed + i, numAlignments, readLength)
             self.addReadGroup(readGroup)
 
     def getNumAlignedReads(self):
-        return self._numAlignments
+        return sum(
+            readGroup.getNumAlignedReads()
+            for readGroup in self.getReadGroups())
 
     def getNumUnalignedReads(self):
         return 0
 
+    def getBaseCount(self):
+        return None
+
     def getPrograms(self):
         return []
 
@@ -193,10 +273,19 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
     """
     Class representing a logical collection ReadGroups.
     """
+    statsFileCheckInterval = 1
+    """
+    The minimum number of seconds between checks for a change to the
+    statistics file.
+    """
+
     def __init__(
             self, parentContainer, localId, samFilePath, backend):
         super(HtslibReadGroupSet, self).__init__(parentContainer, localId)
         self._samFilePath = samFilePath
+        self._stats = None
+        self._statsFileVersion = None
+        self._statsFileCheckTime = 0
         samFile = self.getFileHandle(self._samFilePath)
         self._setHeaderFields(samFile)
         if 'RG' not in samFile.header or len(samFile.header['RG']) == 0:
@@ -268,16 +357,82 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
         samFile = self.getFileHandle(self._samFilePath)
         return samFile.unmapped
 
+    def _getStats(self):
+        """
+        Returns the statistics computed for the BAM file by the
+        ga4gh_stats command, which are read when first needed and again
+        whenever the statistics file changes, or an empty dictionary if
+        there are none.
+        """
+        self.checkStatsFile()
+        if self._stats is None:
+            self._statsFileCheckTime = time.time()
+            self._statsFileVersion = stats.getStatsFileVersion(
+                self._samFilePath)
+            self._stats = stats.readStatsFile(self._samFilePath) or {}
+        return self._stats
+
+    def checkStatsFile(self):
+        """
+        Discards the statistics read for the BAM file, along with the
+        JSON representations of this read group set and its read groups
+        that include them, if the statistics file has been written or
+        removed since it was read; ga4gh_stats may be run while the
+        server is serving the file. The file is looked at no more than
+        once every statsFileCheckInterval seconds, so that serving the
+        memoized JSON does not cost a system call.
+        """
+        if self._stats is None:
+            return
+        now = time.time()
+        if now - self._statsFileCheckTime < self.statsFileCheckInterval:
+            return
+        self._statsFileCheckTime = now
+        if (stats.getStatsFileVersion(self._samFilePath) !=
+                self._statsFileVersion):
+            self._stats = None
+            self.invalidateJsonString()
+            for readGroup in self.getReadGroups():
+                readGroup.invalidateJsonString()
+
+    def toJsonString(self):
+        self.checkStatsFile()
+        return super(HtslibReadGroupSet, self).toJsonString()
+
+    def getReadCounts(self, readGroupName=None):
+        """
+        Returns the dictionary of read and base counts for the specified
+        read group, or for the whole file if it is None, or None if they
+        have not been computed.
+        """
+        fileStats = self._getStats()
+        if not fileStats:
+            return None
+        if readGroupName is None or self._defaultReadGroup:
+            return fileStats["totals"]
+        # Read groups without any reads in the file are not recorded
+        return fileStats["readGroups"].get(
+            readGroupName, stats.newReadCounts())
+
+    def getBaseCount(self):
+        readCounts = self.getReadCounts()
+        if readCounts is None:
+            return None
+        return readCounts["baseCount"]
+
     def getPrograms(self):
         return self._programs
 
 
-class AbstractReadGroup(datamodel.DatamodelObject):
+class AbstractReadGroup(
+        datamodel.ImmutableContainerMixin, datamodel.DatamodelObject):
     """
     Class representing a ReadGroup. A ReadGroup is all the data that's
     processed the same way by the sequencer.  There are typically 1-10
     ReadGroups in a ReadGroupSet.
     """
+    __slots__ = ("_iso8601", "_creationTime", "_updatedTime")
+
     compoundIdClass = datamodel.ReadGroupCompoundId
 
     def __init__(self, parentContainer, localId):
@@ -286,7 +441,7 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         now = protocol.convertDatetime(datetimeNow)
         self._iso8601 = datetimeNow.strftime("%Y-%m-%dT%H:%M:%SZ")
         self._creationTime = now
-        self._updateTime = now
+        self._updatedTime = now
 
     def toProtocolElement(self):
         """
@@ -297,7 +452,7 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         readGroup = protocol.ReadGroup()
         readGroup.id = self.getId()
         readGroup.created = self._creationTime
-        readGroup.updated = self._updateTime
+        readGroup.updated = self._updatedTime
         dataset = self.getParentContainer().getParentContainer()
         readGroup.datasetId = dataset.getId()
         readGroup.description = None
@@ -310,11 +465,11 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         readGroup.sampleId = self.getSampleId()
         if referenceSet is not None:
             readGroup.referenceSetId = referenceSet.getId()
-        stats = protocol.ReadStats()
-        stats.alignedReadCount = self.getNumAlignedReads()
-        stats.unalignedReadCount = self.getNumUnalignedReads()
-        stats.baseCount = None  # TODO requires iterating through all reads
-        readGroup.stats = stats
+        readStats = protocol.ReadStats()
+        readStats.alignedReadCount = self.getNumAlignedReads()
+        readStats.unalignedReadCount = self.getNumUnalignedReads()
+        readStats.baseCount = self.getBaseCount()
+        readGroup.stats = readStats
         readGroup.programs = self.getPrograms()
         readGroup.description = self.getDescription()
         experiment = protocol.Experiment()
@@ -358,6 +513,13 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         """
         raise NotImplementedError()
 
+    def getBaseCount(self):
+        """
+        Return the number of bases in the read group, or None if it is
+        not known
+        """
+        raise NotImplementedError()
+
     def getPrograms(self):
         """
         Returns an array of Programs used to generate this read group
@@ -428,49 +590,243 @@ class AbstractReadGroup(datamodel.DatamodelObject):
 
 class SimulatedReadGroup(AbstractReadGroup):
     """
-    A simulated readgroup
+    A simulated readgroup with numAlignments reads on each reference.
+    The reads are in pairs from fragments of INSERT_SIZE bases, and the
+    leftmost read of each fragment starts at a random position within
+    an equal share of the reference, so the coverage is about
+    numAlignments * readLength / referenceLength. Each fragment is
+    generated deterministically from the random seed and its index, so
+    a search costs time proportional to the number of reads returned,
+    wherever its interval lies. If numAlignments is odd, the last
+    fragment has a single, unpaired read.
     """
-    def __init__(self, parentContainer, localId, randomSeed, numAlignments=2):
+    INSERT_SIZE = 300
+    MAX_DELETION_LENGTH = 3
+
+    def __init__(
+            self, parentContainer, localId, randomSeed, numAlignments=2,
+            readLength=100):
         super(SimulatedReadGroup, self).__init__(parentContainer, localId)
+        self._randomSeed = randomSeed
+        self._numAlignments = numAlignments
+        self._readLength = readLength
+
+    def getReadAlignments(
+            self, reference, start=None, end=None, readFilter=None):
+        if readFilter is not None:
+            raise exceptions.NotImplementedException(
+                "Read filters are not supported by simulated read groups")
+        length = reference.getLength()
+        readLength = min(self._readLength, length)
+        if start is None:
+            start = 0
+        if end is None:
+            end = length
+        numFragments = (self._numAlignments + 1) // 2
+        if numFragments <= 0 or start >= end:
+            return
+        # Reads starting up to the longest possible span before the
+        # search start may overlap it, and the mate of a read may start
+        # up to mateOffset after it.
+        maxSpan = readLength + self.MAX_DELETION_LENGTH
+        mateOffset = max(0, self.INSERT_SIZE - readLength)
+        spacing = (length - readLength + 1) / numFragments
+        firstIndex = max(0, int((start - maxSpan - mateOffset) / spacing))
+        readStarts = heapq.merge(*[
+            self._getFragmentReadStarts(
+                reference, firstIndex, numFragments, spacing, readLength,
+                mateOffset, mateIndex)
+            for mateIndex in [0, 1]])
+        for position, fragmentIndex, mateIndex, fragment in readStarts:
+            if position >= end:
+                return
+            if position + maxSpan <= start:
+                continue
+            alignment = self._createReadAlignment(
+                reference, readLength, fragmentIndex, mateIndex, fragment)
+            if position + self._getReferenceSpan(alignment) > start:
+                yield alignment
+
+    def _getFragmentReadStarts(
+            self, reference, firstIndex, numFragments, spacing, readLength,
+            mateOffset, mateIndex):
+        """
+        Generates (position, fragmentIndex, mateIndex, fragment) tuples
+        for the leftmost reads of the fragments from firstIndex onwards
+        if mateIndex is 0, or the rightmost if it is 1, in order of
+        position. A fragment is the pair of leftmost and rightmost read
+        positions, and the random seed of its reads.
+        """
+        maxStart = reference.getLength() - readLength
+        isLastUnpaired = self._numAlignments % 2 == 1
+        for fragmentIndex in range(firstIndex, numFragments):
+            if (mateIndex == 1 and isLastUnpaired and
+                    fragmentIndex == numFragments - 1):
+                return
+            digest = hashlib.md5("{}:{}:{}".format(
+                self._randomSeed, reference.getId(),
+                fragmentIndex).encode("utf-8"))
+            seed = int(digest.hexdigest(), 16)
+            leftStart = int(
+                (fragmentIndex + random.Random(seed).random()) * spacing)
+            rightStart = min(leftStart + mateOffset, maxStart)
+            fragment = leftStart, rightStart, seed
+            yield fragment[mateIndex], fragmentIndex, mateIndex, fragment
 
-    def getReadAlignments(self, referenceId=None, start=None, end=None):
-        for i in range(self.getNumAlignedReads()):
-            yield self._createReadAlignment(i)
+    @staticmethod
+    def _getReferenceSpan(alignment):
+        return sum(
+            unit.operationLength for unit in alignment.alignment.cigar
+            if unit.operation in (
+                protocol.CigarOperation.ALIGNMENT_MATCH,
+                protocol.CigarOperation.DELETE))
+
+    def _getCigar(self, randomNumberGenerator, readLength, maxSpan):
+        """
+        Returns a list of (operation, length) pairs, in the integer
+        encoding used by pysam, for a read of the specified length
+        spanning at most maxSpan bases of the reference. Most reads
+        are a single match; some are soft clipped, or have a short
+        insertion or deletion.
+        """
+        choice = randomNumberGenerator.random()
+        if readLength < 10 or choice >= 0.15:
+            return [(0, readLength)]
+        left = randomNumberGenerator.randint(1, readLength // 2)
+        if choice < 0.05:
+            return [(4, left), (0, readLength - left)]
+        if choice < 0.1:
+            insertLength = randomNumberGenerator.randint(1, 3)
+            return [
+                (0, left), (1, insertLength),
+                (0, readLength - left - insertLength)]
+        deleteLength = min(
+            randomNumberGenerator.randint(1, self.MAX_DELETION_LENGTH),
+            maxSpan - readLength)
+        if deleteLength <= 0:
+            return [(0, readLength)]
+        return [(0, left), (2, deleteLength), (0, readLength - left)]
+
+    def _createReadAlignment(
+            self, reference, readLength, fragmentIndex, mateIndex, fragment):
+        leftStart, rightStart, seed = fragment
+        position = fragment[mateIndex]
+        # Both reads share the fragment's choices, and each has its own
+        # bases and qualities.
+        fragmentRandom = random.Random(seed + 1)
+        leftReadNumber = fragmentRandom.randint(0, 1)
+        isDuplicate = fragmentRandom.random() < 0.01
+        randomNumberGenerator = random.Random(seed + mateIndex + 2)
+        rand = randomNumberGenerator.random
+        length = reference.getLength()
+        cigar = self._getCigar(
+            randomNumberGenerator, readLength,
+            min(readLength + self.MAX_DELETION_LENGTH, length - position))
+        # Build the sequence from the reference bases, with a few
+        # random mismatches and random inserted or clipped bases.
+        referenceBases = reference.getBases(
+            position, min(length, position + readLength +
+                          self.MAX_DELETION_LENGTH))
+        sequence = []
+        offset = 0
+        numEdits = 0
+        for operation, operationLength in cigar:
+            if operation == 0:
+                sequence.append(
+                    referenceBases[offset:offset + operationLength])
+                offset += operationLength
+            elif operation == 2:
+                offset += operationLength
+                numEdits += operationLength
+            else:
+                sequence.append("".join(
+                    randomNumberGenerator.choice("ACGT")
+                    for _ in range(operationLength)))
+                if operation == 1:
+                    numEdits += operationLength
+        sequence = list("".join(sequence))
+        for _ in range(randomNumberGenerator.randint(0, 2)):
+            index = randomNumberGenerator.randrange(len(sequence))
+            sequence[index] = randomNumberGenerator.choice(
+                "ACGT".replace(sequence[index], ""))
+            numEdits += 1
 
-    def _createReadAlignment(self, i):
-        # TODO fill out a bit more
         alignment = protocol.ReadAlignment()
-        alignment.alignedQuality = [1, 2, 3]
-        alignment.alignedSequence = "ACT"
-        alignment.fragmentId = 'TODO'
-        gaPosition = protocol.Position()
-        gaPosition.position = 0
-        gaPosition.referenceName = "NotImplemented"
-        gaPosition.strand = protocol.Strand.POS_STRAND
+        alignment.alignedSequence = "".join(sequence)
+        alignment.alignedQuality = [
+            int(rand() * 21) + 20 for _ in range(readLength)]
+        fragmentName = "{}_{}".format(reference.getLocalId(), fragmentIndex)
+        alignment.fragmentName = fragmentName
+        alignment.fragmentId = str(datamodel.ReadAlignmentCompoundId(
+            self.getCompoundId(), fragmentName))
         gaLinearAlignment = protocol.LinearAlignment()
+        gaLinearAlignment.mappingQuality = randomNumberGenerator.choice(
+            [0, 20, 40, 60, 60, 60])
+        gaPosition = protocol.Position()
+        gaPosition.position = position
+        gaPosition.referenceName = reference.getLocalId()
         gaLinearAlignment.position = gaPosition
+        gaLinearAlignment.cigar = []
+        for operation, operationLength in cigar:
+            gaCigarUnit = protocol.CigarUnit()
+            gaCigarUnit.operation = SamCigar.int2ga(operation)
+            gaCigarUnit.operationLength = operationLength
+            gaCigarUnit.referenceSequence = None
+            gaLinearAlignment.cigar.append(gaCigarUnit)
         alignment.alignment = gaLinearAlignment
-        alignment.duplicateFragment = False
+        # The leftmost read of each pair is on the forward strand and the
+        # rightmost on the reverse strand; either may be the first read.
+        mateIsUnpaired = (
+            self._numAlignments % 2 == 1 and
+            fragmentIndex == (self._numAlignments + 1) // 2 - 1)
+        if mateIsUnpaired:
+            gaPosition.strand = protocol.Strand.POS_STRAND
+            alignment.nextMatePosition = None
+            alignment.fragmentLength = 0
+            alignment.numberReads = 1
+            alignment.readNumber = 0
+            alignment.properPlacement = False
+        else:
+            mate = protocol.Position()
+            mate.referenceName = reference.getLocalId()
+            mate.position = fragment[1 - mateIndex]
+            fragmentLength = rightStart + readLength - leftStart
+            if mateIndex == 0:
+                gaPosition.strand = protocol.Strand.POS_STRAND
+                mate.strand = protocol.Strand.NEG_STRAND
+                alignment.fragmentLength = fragmentLength
+            else:
+                gaPosition.strand = protocol.Strand.NEG_STRAND
+                mate.strand = protocol.Strand.POS_STRAND
+                alignment.fragmentLength = -fragmentLength
+            alignment.nextMatePosition = mate
+            alignment.numberReads = 2
+            alignment.readNumber = (leftReadNumber + mateIndex) % 2
+            alignment.properPlacement = True
+        alignment.duplicateFragment = isDuplicate
         alignment.failedVendorQualityChecks = False
-        alignment.fragmentLength = 3
-        alignment.fragmentName = "simulated{}".format(i)
-        alignment.info = {}
-        alignment.nextMatePosition = None
-        alignment.numberReads = None
-        alignment.properPlacement = False
-        alignment.readGroupId = self.getId()
-        alignment.readNumber = None
         alignment.secondaryAlignment = False
         alignment.supplementaryAlignment = False
-        alignment.id = self.getReadAlignmentId(alignment)
+        alignment.readGroupId = self.getId()
+        alignment.info = {
+            "RG": [self.getLocalId()], "NM": [str(numEdits)]}
+        # The mates share their fragment name, so the read number is
+        # needed to make the ID unique.
+        alignment.id = str(datamodel.ReadAlignmentCompoundId(
+            self.getCompoundId(), "{}/{}".format(
+                fragmentName, alignment.readNumber + 1)))
         return alignment
 
     def getNumAlignedReads(self):
-        return self._parentContainer.getNumAlignedReads()
+        referenceSet = self._parentContainer.getReferenceSet()
+        return self._numAlignments * len(referenceSet.getReferences())
 
     def getNumUnalignedReads(self):
         return 0
 
+    def getBaseCount(self):
+        return None
+
     def getPrograms(self):
         return []
 
@@ -481,7 +837,7 @@ class SimulatedReadGroup(AbstractReadGroup):
         return 'sampleId'
 
     def getPredictedInsertSize(self):
-        return 0
+        return self.INSERT_SIZE
 
     def getInstrumentModel(self):
         return None
@@ -506,9 +862,20 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
     """
     A readgroup based on htslib's reading of a given file
     """
+    __slots__ = (
+        "_parentSamFilePath", "_filterReads", "_sampleId", "_description",
+        "_predictedInsertSize", "_instrumentModel", "_sequencingCenter",
+        "_experimentDescription", "_library", "_platformUnit", "_runTime")
+
     def __init__(self, parentContainer, localId, readGroupHeader=None):
         super(HtslibReadGroup, self).__init__(parentContainer, localId)
         self._parentSamFilePath = parentContainer.getSamFilePath()
+        # Take the timestamps from the BAM file rather than the time
+        # the server started, so that every server process returns
+        # identical representations of this read group.
+        self._setAccessTimes(self._parentSamFilePath)
+        self._iso8601 = datetime.datetime.utcfromtimestamp(
+            self._creationTime // 1000).strftime("%Y-%m-%dT%H:%M:%SZ")
         self._filterReads = not parentContainer.isUsingDefaultReadGroup()
         self._sampleId = None
         self._description = None
@@ -534,9 +901,11 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
     def getSamFilePath(self):
         return self._parentSamFilePath
 
-    def getReadAlignments(self, reference, start=None, end=None):
+    def getReadAlignments(
+            self, reference, start=None, end=None, readFilter=None):
         """
-        Returns an iterator over the specified reads
+        Returns an iterator over the specified reads. If a ReadFilter is
+        given, only the reads meeting its conditions are returned.
         """
         # TODO If reference is None, return against all references,
         # including unmapped reads.
@@ -545,14 +914,25 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
         # TODO deal with errors from htslib
         start, end = self.sanitizeAlignmentFileFetch(start, end)
         readAlignments = samFile.fetch(referenceName, start, end)
+        if readFilter is not None:
+            # Reads are filtered before they are converted, and the time
+            # taken is included in the fetch stage.
+            readAlignments = itertools.ifilter(
+                readFilter.isMatch, readAlignments)
+        convertReadAlignment = self.convertReadAlignment
+        timer = metrics.getStageTimer()
+        if timer is not None:
+            readAlignments = timer.timeIterator("fetch", readAlignments)
+            convertReadAlignment = functools.partial(
+                timer.timeCall, "convert", self.convertReadAlignment)
         if self._filterReads:
             for readAlignment in readAlignments:
                 tags = dict(readAlignment.tags)
                 if 'RG' in tags and tags['RG'] == self._localId:
-                    yield self.convertReadAlignment(readAlignment)
+                    yield convertReadAlignment(readAlignment)
         else:
             for readAlignment in readAlignments:
-                yield self.convertReadAlignment(readAlignment)
+                yield convertReadAlignment(readAlignment)
 
     def convertReadAlignment(self, read):
         """
@@ -622,15 +1002,40 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
         ret.id = self.getReadAlignmentId(ret)
         return ret
 
+    def _getReadCount(self, key):
+        """
+        Returns the specified count from the statistics computed for the
+        BAM file. Without them, a default read group holds every read in
+        the file, which the index counts; otherwise the count is unknown.
+        """
+        readCounts = self._parentContainer.getReadCounts(self.getLocalId())
+        if readCounts is not None:
+            return readCounts[key]
+        if not self._filterReads:
+            if key == "alignedReadCount":
+                return self._parentContainer.getNumAlignedReads()
+            return self._parentContainer.getNumUnalignedReads()
+        return -1
+
     def getNumAlignedReads(self):
-        return -1  # TODO populate with metadata
+        return self._getReadCount("alignedReadCount")
 
     def getNumUnalignedReads(self):
-        return -1  # TODO populate with metadata
+        return self._getReadCount("unalignedReadCount")
+
+    def getBaseCount(self):
+        readCounts = self._parentContainer.getReadCounts(self.getLocalId())
+        if readCounts is None:
+            return None
+        return readCounts["baseCount"]
 
     def getPrograms(self):
         return self._parentContainer.getPrograms()
 
+    def toJsonString(self):
+        self._parentContainer.checkStatsFile()
+        return super(HtslibReadGroup, self).toJsonString()
+
     def getDescription(self):
         return self._description
 
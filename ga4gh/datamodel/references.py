@@ -6,6 +6,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import binascii
+import collections
 import hashlib
 import json
 import os
@@ -24,8 +26,65 @@ This is the name used for any reference set referred to in a BAM
 file that does not provide the 'AS' tag in the @SQ header.
 """
 
+TWO_BIT_BASES = "TCAG"
+"""
+The bases in the order of their 2-bit codes, following the UCSC 2bit
+convention (T=0, C=1, A=2, G=3). Any other base (including N) is
+packed as T.
+"""
+
+
+def _makeTwoBitDigitTable():
+    """
+    Returns a 256 character translation table mapping each base to the
+    base-4 digit of its 2-bit code.
+    """
+    digits = bytearray(b"0" * 256)
+    for code, base in enumerate(TWO_BIT_BASES):
+        digit = ord(str(code))
+        digits[ord(base)] = digit
+        digits[ord(base.lower())] = digit
+    return bytes(digits)
+
+
+_twoBitDigitTable = _makeTwoBitDigitTable()
+
+
+def packTwoBit(bases):
+    """
+    Returns the specified string of bases packed four to a byte, with
+    the first base in the two most significant bits. The final byte is
+    padded with T (zero) codes if the number of bases is not a multiple
+    of four.
+    """
+    if isinstance(bases, unicode):
+        bases = bases.encode("ascii")
+    numBytes = (len(bases) + 3) // 4
+    if numBytes == 0:
+        return b""
+    # Each base becomes a base-4 digit, so the whole sequence can be
+    # converted to an integer and back out to hex in linear time,
+    # without a Python-level loop over the bases.
+    digits = bases.translate(_twoBitDigitTable)
+    digits += b"0" * (numBytes * 4 - len(bases))
+    hexString = "{0:0{1}x}".format(int(digits, 4), numBytes * 2)
+    return binascii.unhexlify(hexString)
+
+
+def unpackTwoBit(packed, numBases):
+    """
+    Reverses :func:`packTwoBit`, returning the first numBases bases
+    encoded in the specified packed string.
+    """
+    bases = []
+    for byte in bytearray(packed):
+        for shift in (6, 4, 2, 0):
+            bases.append(TWO_BIT_BASES[(byte >> shift) & 3])
+    return "".join(bases[:numBases])
+
 
-class AbstractReferenceSet(datamodel.DatamodelObject):
+class AbstractReferenceSet(
+        datamodel.ImmutableContainerMixin, datamodel.DatamodelObject):
     """
     Class representing ReferenceSets. A ReferenceSet is a set of
     References which typically comprise a reference assembly, such as
@@ -38,6 +97,9 @@ class AbstractReferenceSet(datamodel.DatamodelObject):
         self._referenceIdMap = {}
         self._referenceNameMap = {}
         self._referenceIds = []
+        self._referenceMd5ChecksumMap = collections.defaultdict(list)
+        self._referenceAccessionMap = collections.defaultdict(list)
+        self._md5checksum = None
         self._assemblyId = None
         self._description = None
         self._isDerived = False
@@ -53,6 +115,13 @@ class AbstractReferenceSet(datamodel.DatamodelObject):
         self._referenceIdMap[id_] = reference
         self._referenceNameMap[reference.getLocalId()] = reference
         self._referenceIds.append(id_)
+        self._referenceMd5ChecksumMap[reference.getMd5Checksum()].append(
+            reference)
+        for accession in set(reference.getSourceAccessions()):
+            self._referenceAccessionMap[accession].append(reference)
+        # The checksum of the set depends on all of its references.
+        self._md5checksum = None
+        self.invalidateJsonString()
 
     def getReferences(self):
         """
@@ -89,19 +158,33 @@ class AbstractReferenceSet(datamodel.DatamodelObject):
             raise exceptions.ReferenceNotFoundException(id_)
         return self._referenceIdMap[id_]
 
+    def getReferencesByMd5Checksum(self, md5checksum):
+        """
+        Returns the list of References in this ReferenceSet with the
+        specified MD5 checksum, in the order they were added.
+        """
+        return self._referenceMd5ChecksumMap.get(md5checksum, [])
+
+    def getReferencesByAccession(self, accession):
+        """
+        Returns the list of References in this ReferenceSet that have
+        the specified source accession, in the order they were added.
+        """
+        return self._referenceAccessionMap.get(accession, [])
+
     def getMd5Checksum(self):
         """
         Returns the MD5 checksum for this reference set. This checksum is
         calculated by making a list of `Reference.md5checksum` for all
         `Reference`s in this set. We then sort this list, and take the
-        MD5 hash of all the strings concatenated together.
+        MD5 hash of all the strings concatenated together. The value is
+        computed once and cached until a reference is added to the set.
         """
-        references = sorted(
-            self.getReferences(),
-            key=lambda ref: ref.getMd5Checksum())
-        checksums = ''.join([ref.getMd5Checksum() for ref in references])
-        md5checksum = hashlib.md5(checksums).hexdigest()
-        return md5checksum
+        if self._md5checksum is None:
+            checksums = sorted(
+                ref.getMd5Checksum() for ref in self.getReferences())
+            self._md5checksum = hashlib.md5(''.join(checksums)).hexdigest()
+        return self._md5checksum
 
     def getAssemblyId(self):
         """
@@ -167,7 +250,8 @@ class AbstractReferenceSet(datamodel.DatamodelObject):
         return ret
 
 
-class AbstractReference(datamodel.DatamodelObject):
+class AbstractReference(
+        datamodel.ImmutableContainerMixin, datamodel.DatamodelObject):
     """
     Class representing References. A Reference is a canonical
     assembled contig, intended to act as a reference coordinate space
@@ -287,6 +371,17 @@ class AbstractReference(datamodel.DatamodelObject):
         """
         raise NotImplemented()
 
+    def getBasesChunks(self, start, end, chunkSize):
+        """
+        Returns an iterator over consecutive strings of at most chunkSize
+        bases which together make up the bases of this reference from
+        start (inclusive) to end (exclusive). Only one chunk is held in
+        memory at a time.
+        """
+        self.checkQueryRange(start, end)
+        for chunkStart in range(start, end, chunkSize):
+            yield self.getBases(chunkStart, min(chunkStart + chunkSize, end))
+
 ##################################################################
 #
 # Simulated references
@@ -0,0 +1,262 @@
+"""
+Statistics about the records in indexed VCF, BCF and BAM files, such as
+the number of variants on each reference or of reads in each read group.
+Those that are recorded in the file's index are read from it directly.
+The rest require a scan of the whole file, which the ga4gh_stats command
+does once, storing the results in a statistics file alongside the data
+file so that the server can answer them without reading the data.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import gzip
+import json
+import logging
+import os
+import struct
+
+import pysam
+
+
+STATS_FILE_SUFFIX = ".stats.json"
+STATS_FILE_VERSION = 1
+
+DATA_FILE_PATTERNS = ["*.vcf.gz", "*.bcf", "*.bam"]
+
+INDEX_FILE_SUFFIXES = [".tbi", ".csi", ".bai"]
+
+# The bin holding the record counts of a reference in BAI and tabix indexes
+BAI_PSEUDO_BIN = 37450
+
+log = logging.getLogger(__name__)
+
+
+def getStatsFilePath(dataFile):
+    """
+    Returns the path of the statistics file for the specified data file.
+    """
+    return dataFile + STATS_FILE_SUFFIX
+
+
+def _getDataFileVersion(dataFile):
+    """
+    Returns the size and modification time of the specified data file,
+    which identify the version of it a statistics file describes.
+    """
+    status = os.stat(dataFile)
+    return [status.st_size, int(status.st_mtime)]
+
+
+def getStatsFileVersion(dataFile):
+    """
+    Returns a value that changes whenever the statistics file for the
+    specified data file is written or removed, or None if there is none.
+    """
+    try:
+        status = os.stat(getStatsFilePath(dataFile))
+    except OSError:
+        return None
+    return status.st_ino, status.st_size, status.st_mtime
+
+
+def readStatsFile(dataFile):
+    """
+    Returns the dictionary of statistics stored for the specified data
+    file, or None if there is no statistics file for it or the file
+    has changed since the statistics were computed.
+    """
+    statsFile = getStatsFilePath(dataFile)
+    if not os.path.exists(statsFile):
+        return None
+    try:
+        with open(statsFile) as statsFileHandle:
+            stats = json.load(statsFileHandle)
+    except (IOError, ValueError):
+        log.warning("Cannot read statistics file '%s'", statsFile)
+        return None
+    if (stats.get("version") != STATS_FILE_VERSION or
+            stats.get("dataFileVersion") != _getDataFileVersion(dataFile)):
+        log.warning("Ignoring out of date statistics file '%s'", statsFile)
+        return None
+    return stats
+
+
+def writeStatsFile(dataFile, stats):
+    """
+    Writes the specified dictionary of statistics to the statistics file
+    for the specified data file. The file is replaced atomically, so
+    that a server reading it never sees a partial file.
+    """
+    stats = dict(stats)
+    stats["version"] = STATS_FILE_VERSION
+    stats["dataFileVersion"] = _getDataFileVersion(dataFile)
+    statsFile = getStatsFilePath(dataFile)
+    temporaryFile = statsFile + ".tmp"
+    with open(temporaryFile, "w") as statsFileHandle:
+        json.dump(stats, statsFileHandle, indent=1, sort_keys=True)
+    os.rename(temporaryFile, statsFile)
+
+
+def getIndexFilePath(dataFile):
+    """
+    Returns the path of the index of the specified data file, or None if
+    it cannot be found.
+    """
+    base, _ = os.path.splitext(dataFile)
+    for suffix in INDEX_FILE_SUFFIXES:
+        for indexFile in [dataFile + suffix, base + suffix]:
+            if os.path.exists(indexFile):
+                return indexFile
+    return None
+
+
+class _IndexReader(object):
+    """
+    Reads the little-endian binary fields of an index file.
+    """
+    def __init__(self, data):
+        self._data = data
+        self._offset = 0
+
+    def read(self, format_):
+        format_ = str("<" + format_)
+        values = struct.unpack_from(format_, self._data, self._offset)
+        self._offset += struct.calcsize(format_)
+        return values
+
+    def readBytes(self, length):
+        data = self._data[self._offset:self._offset + length]
+        self._offset += length
+        return data
+
+    def skip(self, length):
+        self._offset += length
+
+
+def readIndexRecordCounts(indexFile, referenceNames=None):
+    """
+    Returns a dictionary mapping reference names to the number of records
+    on them recorded in the specified BAI, tabix or CSI index. Indexes
+    written by htslib record these counts in a pseudo-bin for each
+    reference; references without one are left out of the dictionary,
+    and references without any bins have no records. Tabix indexes hold
+    the reference names; for the others, the names in the order of the
+    references in the data file's header must be given.
+    """
+    if indexFile.endswith(".bai"):
+        with open(indexFile, "rb") as indexFileHandle:
+            data = indexFileHandle.read()
+    else:
+        data = gzip.open(indexFile, "rb").read()
+    reader = _IndexReader(data)
+    magic = reader.readBytes(4)
+    isCsi = magic == b"CSI\1"
+    pseudoBin = BAI_PSEUDO_BIN
+    if isCsi:
+        minShift, depth, auxLength = reader.read("iii")
+        reader.skip(auxLength)
+        pseudoBin = ((1 << ((depth + 1) * 3)) - 1) // 7 + 1
+    elif magic not in (b"BAI\1", b"TBI\1"):
+        raise ValueError("Unknown index format in '{}'".format(indexFile))
+    numReferences, = reader.read("i")
+    if magic == b"TBI\1":
+        namesLength, = reader.read("24xi")
+        names = reader.readBytes(namesLength).split(b"\0")[:-1]
+        referenceNames = [name.decode("utf-8") for name in names]
+    counts = {}
+    for index in range(numReferences):
+        numBins, = reader.read("i")
+        count = None
+        if numBins == 0:
+            count = 0
+        for _ in range(numBins):
+            if isCsi:
+                binNumber, _, numChunks = reader.read("IQi")
+            else:
+                binNumber, numChunks = reader.read("Ii")
+            chunks = reader.read("QQ" * numChunks)
+            if binNumber == pseudoBin and numChunks == 2:
+                count = chunks[2] + chunks[3]
+        if not isCsi:
+            numIntervals, = reader.read("i")
+            reader.skip(8 * numIntervals)
+        if count is not None and index < len(referenceNames):
+            counts[referenceNames[index]] = count
+    return counts
+
+
+def computeVariantFileStats(dataFile):
+    """
+    Scans the specified VCF or BCF file and returns a dictionary of its
+    statistics: the number of variants on each reference, and the number
+    of them at which each sample has a called genotype.
+    """
+    variantFile = pysam.VariantFile(dataFile)
+    try:
+        samples = list(variantFile.header.samples)
+        variantCounts = collections.Counter()
+        callCounts = [0] * len(samples)
+        for record in variantFile:
+            variantCounts[record.contig] += 1
+            # The genotypes are parsed from the text of the record, as in
+            # HtslibVariantSet.convertVariant, as pysam cannot be relied
+            # upon to return them.
+            columns = str(record).rstrip("\n").split("\t")
+            if len(columns) <= 9 or not columns[8].startswith("GT"):
+                continue
+            # As in convertVCFGenotype, a genotype with any missing
+            # alleles is not called.
+            for index, sampleData in enumerate(columns[9:]):
+                if "." not in sampleData.split(":", 1)[0]:
+                    callCounts[index] += 1
+    finally:
+        variantFile.close()
+    return {
+        "variantCounts": dict(variantCounts),
+        "callCounts": dict(zip(samples, callCounts)),
+    }
+
+
+def newReadCounts():
+    """
+    Returns a dictionary of read and base counts of zero.
+    """
+    return {"alignedReadCount": 0, "unalignedReadCount": 0, "baseCount": 0}
+
+
+def computeAlignmentFileStats(dataFile):
+    """
+    Scans the specified BAM file and returns a dictionary of its
+    statistics: the number of aligned and unaligned reads and of bases,
+    for the whole file and for each read group. As for the counts in
+    the index, every record is counted, including secondary alignments.
+    """
+    samFile = pysam.AlignmentFile(dataFile)
+    try:
+        totals = newReadCounts()
+        readGroups = collections.defaultdict(newReadCounts)
+        for read in samFile.fetch(until_eof=True):
+            countKey = "alignedReadCount"
+            if read.is_unmapped:
+                countKey = "unalignedReadCount"
+            counts = [totals]
+            tags = dict(read.tags)
+            if "RG" in tags:
+                counts.append(readGroups[tags["RG"]])
+            for count in counts:
+                count[countKey] += 1
+                count["baseCount"] += read.query_length
+    finally:
+        samFile.close()
+    return {"totals": totals, "readGroups": dict(readGroups)}
+
+
+def computeStats(dataFile):
+    """
+    Returns the statistics for the specified VCF, BCF or BAM file.
+    """
+    if dataFile.endswith(".bam"):
+        return computeAlignmentFileStats(dataFile)
+    return computeVariantFileStats(dataFile)
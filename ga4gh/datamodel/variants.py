@@ -7,14 +7,20 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import functools
+import itertools
 import random
 import hashlib
+import math
+import operator
 
 import pysam
 
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.stats as stats
+import ga4gh.metrics as metrics
 
 
 def convertVCFPhaseset(vcfPhaseset):
@@ -50,10 +56,19 @@ def convertVCFGenotype(vcfGenotype, vcfPhaseset):
 class CallSet(datamodel.DatamodelObject):
     """
     Class representing a CallSet. A CallSet basically represents the
-    metadata associated with a single VCF sample column.
+    metadata associated with a single VCF sample column. The variant set
+    holds the data for its call sets in arrays, and CallSet objects are
+    made from them when needed.
     """
+    __slots__ = ()
+
     compoundIdClass = datamodel.CallSetCompoundId
 
+    def toJsonString(self):
+        variantSet = self.getParentContainer()
+        index = variantSet.getCallSetIndex(self.getLocalId())
+        return variantSet.getCallSetJsonStrings(index, index + 1)[0]
+
     def toProtocolElement(self):
         """
         Returns the representation of this CallSet as the corresponding
@@ -76,17 +91,24 @@ class CallSet(datamodel.DatamodelObject):
         return self.getLocalId()
 
 
-class AbstractVariantSet(datamodel.DatamodelObject):
+class AbstractVariantSet(
+        datamodel.ImmutableContainerMixin, datamodel.DatamodelObject):
     """
-    An abstract base class of a variant set
+    An abstract base class of a variant set. The call sets are stored
+    as parallel lists of their names, IDs and JSON representations, so
+    that a page of call sets is a slice of the JSON strings.
     """
     compoundIdClass = datamodel.VariantSetCompoundId
 
     def __init__(self, parentContainer, localId):
         super(AbstractVariantSet, self).__init__(parentContainer, localId)
-        self._callSetIdMap = {}
-        self._callSetNameMap = {}
+        self._callSetNames = []
         self._callSetIds = []
+        # The JSON strings are built when first needed, as they include
+        # the times of the variant set, which are set after the call sets
+        # are added.
+        self._callSetJsonStrings = []
+        self._callSetIndexes = {}
         self._creationTime = None
         self._updatedTime = None
         self._referenceSetId = ""
@@ -107,17 +129,17 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         """
         Adds a CallSet for the specified sample name.
         """
-        callSet = CallSet(self, sampleName)
-        callSetId = callSet.getId()
-        self._callSetIdMap[callSetId] = callSet
-        self._callSetNameMap[sampleName] = callSet
-        self._callSetIds.append(callSetId)
+        sampleName = datamodel.internLocalId(sampleName)
+        self._callSetIndexes[sampleName] = len(self._callSetNames)
+        self._callSetNames.append(sampleName)
+        self._callSetIds.append(self.getCallSetId(sampleName))
+        self._callSetJsonStrings.append(None)
 
     def getCallSets(self):
         """
         Returns the list of CallSets in this VariantSet.
         """
-        return [self._callSetIdMap[id_] for id_ in self._callSetIds]
+        return [CallSet(self, name) for name in self._callSetNames]
 
     def getNumCallSets(self):
         """
@@ -125,29 +147,53 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         """
         return len(self._callSetIds)
 
+    def getCallSetIndex(self, name):
+        """
+        Returns the index of the CallSet with the specified name, or
+        raises a CallSetNameNotFoundException if it does not exist.
+        """
+        if name not in self._callSetIndexes:
+            raise exceptions.CallSetNameNotFoundException(name)
+        return self._callSetIndexes[name]
+
     def getCallSetByName(self, name):
         """
         Returns a CallSet with the specified name, or raises a
         CallSetNameNotFoundException if it does not exist.
         """
-        if name not in self._callSetNameMap:
-            raise exceptions.CallSetNameNotFoundException(name)
-        return self._callSetNameMap[name]
+        return self.getCallSetByIndex(self.getCallSetIndex(name))
 
     def getCallSetByIndex(self, index):
         """
         Returns the CallSet at the specfied index in this VariantSet.
         """
-        return self._callSetIdMap[self._callSetIds[index]]
+        return CallSet(self, self._callSetNames[index])
 
     def getCallSet(self, id_):
         """
         Returns a CallSet with the specified id, or raises a
         CallSetNotFoundException if it does not exist.
         """
-        if id_ not in self._callSetIdMap:
+        try:
+            name = datamodel.CallSetCompoundId.parse(id_).name
+        except exceptions.ObjectWithIdNotFoundException:
+            raise exceptions.CallSetNotFoundException(id_)
+        index = self._callSetIndexes.get(name)
+        if index is None or self._callSetIds[index] != id_:
             raise exceptions.CallSetNotFoundException(id_)
-        return self._callSetIdMap[id_]
+        return self.getCallSetByIndex(index)
+
+    def getCallSetJsonStrings(self, start, end):
+        """
+        Returns the list of the JSON representations of the CallSets
+        with indexes in the range [start, end).
+        """
+        jsonStrings = self._callSetJsonStrings
+        for index in range(start, min(end, len(jsonStrings))):
+            if jsonStrings[index] is None:
+                callSet = self.getCallSetByIndex(index)
+                jsonStrings[index] = callSet.toProtocolElement().toJsonString()
+        return jsonStrings[start:end]
 
     def toProtocolElement(self):
         """
@@ -167,6 +213,13 @@ class AbstractVariantSet(datamodel.DatamodelObject):
         """
         raise NotImplementedError()
 
+    def getNumCalls(self, callSetName):
+        """
+        Returns the number of variants at which the specified call set
+        has a called genotype, or -1 if it is not known.
+        """
+        raise NotImplementedError()
+
     def _createGaVariant(self):
         """
         Convenience method to set the common fields in a GA Variant
@@ -214,6 +267,12 @@ class SimulatedVariantSet(AbstractVariantSet):
     A variant set that doesn't derive from a data store.
     Used mostly for testing.
     """
+    # The average number of variants in each block of positions
+    VARIANTS_PER_BLOCK = 1024
+    MIN_BLOCK_SIZE = 4096
+    # Separates the seeds for the blocks of different random seeds
+    SEED_STRIDE = 2**32
+
     def __init__(
             self, parentContainer, localId, randomSeed=1, numCalls=1,
             variantDensity=1):
@@ -230,6 +289,9 @@ class SimulatedVariantSet(AbstractVariantSet):
     def getNumVariants(self):
         return 0
 
+    def getNumCalls(self, callSetName):
+        return -1
+
     def getMetadata(self):
         ret = []
         # TODO Add simulated metadata.
@@ -243,17 +305,66 @@ class SimulatedVariantSet(AbstractVariantSet):
             compoundId.referenceName, start, randomNumberGenerator)
         return variant
 
+    def _getBlockSize(self):
+        """
+        Returns the number of positions in each of the blocks for which
+        variant positions are generated together. Blocks are large
+        enough to hold VARIANTS_PER_BLOCK variants on average, so that
+        generating the positions before the start of a search in its
+        first block costs little compared with the search itself.
+        """
+        return max(
+            self.MIN_BLOCK_SIZE,
+            int(self.VARIANTS_PER_BLOCK / self._variantDensity))
+
+    def _getBlockPositions(self, blockIndex, blockSize):
+        """
+        Generates the variant positions within the specified block. Each
+        position holds a variant with probability variantDensity; the
+        gaps between variants are drawn from the corresponding geometric
+        distribution, so the work done is proportional to the number of
+        variants rather than the number of positions. The generator is
+        seeded from the block index, so the positions do not depend on
+        the range searched.
+        """
+        randomNumberGenerator = random.Random()
+        randomNumberGenerator.seed(
+            self._randomSeed * self.SEED_STRIDE + blockIndex)
+        position = blockIndex * blockSize
+        end = position + blockSize
+        if self._variantDensity >= 1:
+            for position in range(position, end):
+                yield position
+            return
+        logFailureProbability = math.log(1 - self._variantDensity)
+        while True:
+            position += int(math.log(
+                1 - randomNumberGenerator.random()) / logFailureProbability)
+            if position >= end:
+                return
+            yield position
+            position += 1
+
     def getVariants(self, referenceName, startPosition, endPosition,
-                    callSetIds=None):
+                    callSetIds=None, variantFilter=None):
+        if variantFilter is not None:
+            raise exceptions.NotImplementedException(
+                "Variant filters are not supported by simulated variant sets")
+        if (self._variantDensity <= 0 or startPosition is None or
+                endPosition is None):
+            return
+        blockSize = self._getBlockSize()
         randomNumberGenerator = random.Random()
-        randomNumberGenerator.seed(self._randomSeed)
-        i = startPosition
-        while i < endPosition:
-            if randomNumberGenerator.random() < self._variantDensity:
-                randomNumberGenerator.seed(self._randomSeed + i)
-                yield self.generateVariant(
-                    referenceName, i, randomNumberGenerator)
-            i += 1
+        blockIndex = startPosition // blockSize
+        while blockIndex * blockSize < endPosition:
+            for position in self._getBlockPositions(blockIndex, blockSize):
+                if position >= endPosition:
+                    return
+                if position >= startPosition:
+                    randomNumberGenerator.seed(self._randomSeed + position)
+                    yield self.generateVariant(
+                        referenceName, position, randomNumberGenerator)
+            blockIndex += 1
 
     def generateVariant(self, referenceName, position, randomNumberGenerator):
         """
@@ -274,9 +385,9 @@ class SimulatedVariantSet(AbstractVariantSet):
             [base for base in bases if base != ref])
         variant.alternateBases = [alt]
         variant.calls = []
-        for callSet in self.getCallSets():
+        for callSetId in self._callSetIds:
             call = protocol.Call()
-            call.callSetId = callSet.getId()
+            call.callSetId = callSetId
             # for now, the genotype is either [0,1], [1,1] or [1,0] with equal
             # probability; probably will want to do something more
             # sophisticated later.
@@ -298,6 +409,164 @@ def _encodeValue(value):
         return [str(value)]
 
 
+def getZygosity(vcfGenotype):
+    """
+    Returns the zygosity of the specified VCF genotype string, one of
+    those in VariantFilter.ZYGOSITIES. As in convertVCFGenotype, a
+    genotype with any missing alleles is not called.
+    """
+    if vcfGenotype == "" or "." in vcfGenotype:
+        return "NO_CALL"
+    alleles = vcfGenotype.replace("|", "/").split("/")
+    if any(allele != alleles[0] for allele in alleles):
+        return "HET"
+    if alleles[0] == "0":
+        return "HOM_REF"
+    return "HOM_ALT"
+
+
+class VariantFilter(object):
+    """
+    Conditions on variants given by the "filters" object of a search
+    variants request, which are tested on the pysam records before they
+    are converted, so that only matching variants are converted, counted
+    in pages and returned. A variant must meet all of the conditions:
+
+    minQuality: its QUAL is at least this value.
+    filterNames: its FILTER column holds one of these names, where
+        "PASS" selects passing variants and "." unfiltered ones.
+    info: a list of {"key", "operator", "value"} conditions. Without an
+        operator, the INFO field must be present; otherwise one of its
+        values must compare with the value by the operator, which is one
+        of the keys of OPERATORS.
+    genotypes: a list of {"callSetId", "zygosities"} conditions, where
+        the genotype of the call set must have one of the zygosities.
+    """
+    OPERATORS = {
+        "==": operator.eq, "!=": operator.ne, "<": operator.lt,
+        "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    }
+    ZYGOSITIES = frozenset(["HOM_REF", "HET", "HOM_ALT", "NO_CALL"])
+
+    def __init__(
+            self, minQuality=None, filterNames=None, info=None,
+            genotypes=None):
+        self.minQuality = minQuality
+        self.filterNames = filterNames
+        self.info = info or []
+        self.genotypes = genotypes or []
+
+    @classmethod
+    def fromJsonDict(cls, jsonDict):
+        """
+        Returns the VariantFilter for the specified "filters" object of a
+        request, raising an InvalidSearchFilterException if it is invalid.
+        """
+        def fail(reason):
+            raise exceptions.InvalidSearchFilterException(reason)
+
+        def isNumber(value):
+            return (isinstance(value, (int, long, float)) and
+                    not isinstance(value, bool))
+
+        if not isinstance(jsonDict, dict):
+            fail("filters must be an object")
+        unknownKeys = set(jsonDict) - set(
+            ["minQuality", "filterNames", "info", "genotypes"])
+        if len(unknownKeys) > 0:
+            fail("unknown filters {}".format(sorted(unknownKeys)))
+        minQuality = jsonDict.get("minQuality")
+        if minQuality is not None and not isNumber(minQuality):
+            fail("minQuality must be a number")
+        filterNames = jsonDict.get("filterNames")
+        if filterNames is not None:
+            if not isinstance(filterNames, list):
+                fail("filterNames must be a list")
+            filterNames = frozenset(filterNames)
+        info = []
+        for condition in jsonDict.get("info") or []:
+            if not isinstance(condition, dict) or "key" not in condition:
+                fail("info conditions must be objects with a key")
+            comparison = None
+            if condition.get("operator") is not None:
+                if condition["operator"] not in cls.OPERATORS:
+                    fail("unknown operator '{}'".format(
+                        condition["operator"]))
+                value = condition.get("value")
+                if not isNumber(value) and not isinstance(value, basestring):
+                    fail("info values must be numbers or strings")
+                comparison = (cls.OPERATORS[condition["operator"]], value)
+            info.append((condition["key"], comparison))
+        genotypes = []
+        for condition in jsonDict.get("genotypes") or []:
+            if (not isinstance(condition, dict) or
+                    "callSetId" not in condition or
+                    not isinstance(condition.get("zygosities"), list)):
+                fail("genotype conditions must be objects with a "
+                     "callSetId and a list of zygosities")
+            zygosities = frozenset(condition["zygosities"])
+            if not zygosities <= cls.ZYGOSITIES:
+                fail("unknown zygosities {}".format(
+                    sorted(zygosities - cls.ZYGOSITIES)))
+            genotypes.append((condition["callSetId"], zygosities))
+        return cls(minQuality, filterNames, info, genotypes)
+
+    @classmethod
+    def _isInfoMatch(cls, value, comparison):
+        # Flags are False when absent from a record
+        if value is None or value is False:
+            return False
+        if comparison is None:
+            return True
+        compare, expected = comparison
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        for element in value:
+            if isinstance(expected, basestring):
+                element = str(element)
+            elif not isinstance(element, (int, long, float)):
+                continue
+            if compare(element, expected):
+                return True
+        return False
+
+    def getRecordPredicate(self, sampleColumns):
+        """
+        Returns a function of a pysam variant record returning True if it
+        meets these conditions. The sampleColumns map the call set IDs of
+        the genotype conditions to the columns of their samples in the
+        tab-separated text of the records.
+        """
+        genotypes = [
+            (sampleColumns[callSetId], zygosities)
+            for callSetId, zygosities in self.genotypes]
+
+        def isMatch(record):
+            if self.minQuality is not None and (
+                    record.qual is None or record.qual < self.minQuality):
+                return False
+            if self.filterNames is not None:
+                recordFilterNames = record.filter.keys() or ["."]
+                if self.filterNames.isdisjoint(recordFilterNames):
+                    return False
+            for key, comparison in self.info:
+                if not self._isInfoMatch(record.info.get(key), comparison):
+                    return False
+            if len(genotypes) > 0:
+                # The genotypes are parsed from the text of the record, as
+                # in convertVariant.
+                columns = str(record).rstrip("\n").split("\t")
+                hasGenotypes = columns[8].startswith("GT")
+                for column, zygosities in genotypes:
+                    vcfGenotype = ""
+                    if hasGenotypes:
+                        vcfGenotype = columns[column].split(":", 1)[0]
+                    if getZygosity(vcfGenotype) not in zygosities:
+                        return False
+            return True
+        return isMatch
+
+
 _nothing = object()
 
 
@@ -317,6 +586,8 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         self._setAccessTimes(dataDir)
         self._chromFileMap = {}
         self._metadata = None
+        self._fileStats = None
+        self._variantCounts = _nothing
         self._scanDataFiles(dataDir, ['*.bcf', '*.vcf.gz'])
 
     def _updateMetadata(self, variantFile):
@@ -333,12 +604,74 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
                 raise exceptions.InconsistentMetaDataException(
                     variantFile.filename)
 
+    def _getFileStats(self):
+        """
+        Returns a dictionary mapping the data files of this variant set
+        to the statistics computed for them by the ga4gh_stats command,
+        or None for files without them. They are read when first needed.
+        """
+        if self._fileStats is None:
+            self._fileStats = dict(
+                (filename, stats.readStatsFile(filename))
+                for filename in set(self._chromFileMap.values()))
+        return self._fileStats
+
+    def _getIndexRecordCounts(self, filename):
+        """
+        Returns the numbers of records on each chromosome recorded in the
+        index of the specified data file.
+        """
+        indexFile = stats.getIndexFilePath(filename)
+        if indexFile is None:
+            return {}
+        varFile = self.openFile(filename)
+        try:
+            return stats.readIndexRecordCounts(
+                indexFile, list(varFile.header.contigs))
+        finally:
+            varFile.close()
+
+    def getVariantCounts(self):
+        """
+        Returns a dictionary mapping the chromosomes in this variant set
+        to the number of variants on them, or None if they are not known.
+        The counts are taken from the statistics files, or failing that,
+        from the indexes of the data files, which tabix and bcftools
+        write them to.
+        """
+        if self._variantCounts is _nothing:
+            variantCounts = {}
+            for filename, fileStats in self._getFileStats().items():
+                if fileStats is not None:
+                    fileCounts = fileStats["variantCounts"]
+                else:
+                    fileCounts = self._getIndexRecordCounts(filename)
+                for chrom, chromFilename in self._chromFileMap.items():
+                    if chromFilename == filename:
+                        variantCounts[chrom] = fileCounts.get(chrom)
+            if None in variantCounts.values():
+                variantCounts = None
+            self._variantCounts = variantCounts
+        return self._variantCounts
+
     def getNumVariants(self):
         """
-        Returns the total number of variants in this VariantSet.
+        Returns the total number of variants in this VariantSet, or -1
+        if it is not known.
         """
-        # TODO How do we get the number of records in a VariantFile?
-        return 0
+        variantCounts = self.getVariantCounts()
+        if variantCounts is None:
+            return -1
+        return sum(variantCounts.values())
+
+    def getNumCalls(self, callSetName):
+        self.getCallSetIndex(callSetName)
+        numCalls = 0
+        for fileStats in self._getFileStats().values():
+            if fileStats is None:
+                return -1
+            numCalls += fileStats["callCounts"][callSetName]
+        return numCalls
 
     def _updateCallSetIds(self, variantFile):
         """
@@ -346,14 +679,14 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         """
         # If this is the first file, we add in the samples. If not, we check
         # for consistency.
-        if len(self._callSetIdMap) == 0:
+        if len(self._callSetIds) == 0:
             for sample in variantFile.header.samples:
                 self.addCallSet(sample)
         else:
             callSetIds = set([
                 self.getCallSetId(sample)
                 for sample in variantFile.header.samples])
-            if callSetIds != set(self._callSetIdMap.keys()):
+            if callSetIds != set(self._callSetIds):
                 raise exceptions.InconsistentCallSetIdException(
                     variantFile.filename)
 
@@ -379,12 +712,10 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         varFile.close()
 
     def _convertGaCall(self, recordId, name, pysamCall, genotypeData):
-        compoundId = self.getCallSetId(name)
-        callSet = self.getCallSet(compoundId)
         call = protocol.Call()
-        call.callSetId = callSet.getId()
-        call.callSetName = callSet.getSampleName()
-        call.sampleId = callSet.getSampleName()
+        call.callSetId = self._callSetIds[self._callSetIndexes[name]]
+        call.callSetName = name
+        call.sampleId = name
         # TODO:
         # NOTE: THE FOLLOWING TWO LINES IS NOT THE INTENDED IMPLEMENTATION,
         ###########################################
@@ -438,7 +769,7 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         variant.calls = []
         sampleIterator = 0  # REMOVAL
         for name, call in record.samples.iteritems():
-            if self.getCallSetId(name) in callSetIds:
+            if self._callSetIds[self._callSetIndexes[name]] in callSetIds:
                 genotypeData = sampleData[sampleIterator].split(
                     ":")[0]  # REMOVAL
                 variant.calls.append(self._convertGaCall(
@@ -468,10 +799,12 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         raise exceptions.ObjectNotFoundException(compoundId)
 
     def getVariants(self, referenceName, startPosition, endPosition,
-                    callSetIds=None):
+                    callSetIds=None, variantFilter=None):
         """
         Returns an iterator over the specified variants. The parameters
         correspond to the attributes of a GASearchVariantsRequest object.
+        If a VariantFilter is given, only the variants meeting its
+        conditions are returned.
         """
         if callSetIds is None:
             callSetIds = self._callSetIds
@@ -485,10 +818,34 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
             referenceName, startPosition, endPosition = \
                 self.sanitizeVariantFileFetch(
                     referenceName, startPosition, endPosition)
-            cursor = self.getFileHandle(varFileName).fetch(
-                referenceName, startPosition, endPosition)
+            varFile = self.getFileHandle(varFileName)
+            cursor = varFile.fetch(referenceName, startPosition, endPosition)
+            if variantFilter is not None:
+                # Records are filtered before they are converted, and the
+                # time taken is included in the fetch stage.
+                cursor = itertools.ifilter(
+                    self._getRecordPredicate(variantFilter, varFile), cursor)
+            convertVariant = self.convertVariant
+            timer = metrics.getStageTimer()
+            if timer is not None:
+                cursor = timer.timeIterator("fetch", cursor)
+                convertVariant = functools.partial(
+                    timer.timeCall, "convert", self.convertVariant)
             for record in cursor:
-                yield self.convertVariant(record, callSetIds)
+                yield convertVariant(record, callSetIds)
+
+    def _getRecordPredicate(self, variantFilter, varFile):
+        """
+        Returns the predicate on the records of the specified variant file
+        for the specified VariantFilter.
+        """
+        samples = list(varFile.header.samples)
+        sampleColumns = {}
+        for callSetId, _ in variantFilter.genotypes:
+            callSet = self.getCallSet(callSetId)
+            sampleColumns[callSetId] = 9 + samples.index(
+                callSet.getSampleName())
+        return variantFilter.getRecordPredicate(sampleColumns)
 
     def getMetadata(self):
         return self._metadata
@@ -151,6 +151,11 @@ class RequestValidationFailureException(BadRequestException):
             jsonDict, requestClass, validator.getInvalidFields(jsonDict))
 
 
+class InvalidSearchFilterException(BadRequestException):
+    def __init__(self, reason):
+        self.message = "Invalid search filters: {}".format(reason)
+
+
 class BadReadsSearchRequestBothRefs(BadRequestException):
     message = "only one of referenceId and referenceName can be specified"
 
@@ -252,6 +257,17 @@ class ReferenceRangeErrorException(RangeErrorException):
                 start, end, referenceId))
 
 
+class ByteRangeNotSatisfiableException(RangeErrorException):
+    """
+    Exception raised when the HTTP Range header of a request does not
+    overlap the representation being requested.
+    """
+    def __init__(self, length):
+        self.message = (
+            "Requested byte range not satisfiable; length is {}".format(
+                length))
+
+
 class VersionNotSupportedException(NotFoundException):
     message = "API version not supported"
 
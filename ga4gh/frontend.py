@@ -8,13 +8,20 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import collections
 import datetime
+import hashlib
+import json
+import logging
 import socket
+import time
 import urlparse
 import functools
+import zlib
 
 import flask
 import flask.ext.cors as cors
+import flask.sessions
 import humanize
 import werkzeug
 import oic
@@ -24,16 +31,125 @@ import requests
 
 import ga4gh
 import ga4gh.backend as backend
+import ga4gh.cache as cache
 import ga4gh.datamodel as datamodel
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
+import ga4gh.metrics as metrics
+import ga4gh.profiling as profiling
 
 
 MIMETYPE = "application/json"
+AVRO_BINARY_MIMETYPE = "avro/binary"
+SEQUENCE_TEXT_MIMETYPE = "text/plain"
+SEQUENCE_TWO_BIT_MIMETYPE = "application/octet-stream"
 SEARCH_ENDPOINT_METHODS = ['POST', 'OPTIONS']
+# The supported content codings, in order of preference, mapped to the
+# zlib window bits parameter producing the corresponding format.
+COMPRESSION_WINDOW_BITS = collections.OrderedDict([
+    ("gzip", 16 + zlib.MAX_WBITS),
+    ("deflate", zlib.MAX_WBITS),
+])
+COMPRESSION_CODINGS = list(COMPRESSION_WINDOW_BITS.keys())
 SECRET_KEY_LENGTH = 24
 
+
+class DirectRouteMap(werkzeug.routing.Map):
+    """
+    A URL map that matches requests for single objects, such as
+    GET /callsets/<id>, directly against the one rule that can handle
+    them, found from the method and the first segment of the path,
+    instead of trying every rule in turn. Other requests, and requests
+    the direct rule does not match, are matched in the usual way.
+    """
+    def __init__(self, *args, **kwargs):
+        super(DirectRouteMap, self).__init__(*args, **kwargs)
+        self._directRules = None
+
+    def add(self, ruleFactory):
+        super(DirectRouteMap, self).add(ruleFactory)
+        self._directRules = None
+
+    def bind(self, *args, **kwargs):
+        return self._wrapAdapter(
+            super(DirectRouteMap, self).bind(*args, **kwargs))
+
+    def bind_to_environ(self, *args, **kwargs):
+        return self._wrapAdapter(
+            super(DirectRouteMap, self).bind_to_environ(*args, **kwargs))
+
+    def _wrapAdapter(self, adapter):
+        # Depending on the version of werkzeug, bind_to_environ may or may
+        # not call bind to create the adapter
+        if isinstance(adapter, DirectRouteMapAdapter):
+            return adapter
+        return DirectRouteMapAdapter(adapter)
+
+    def _getDirectRules(self):
+        """
+        Returns a dictionary mapping (method, collection) pairs to the
+        rule handling requests with that method for paths of the form
+        /<collection>/<id>. Pairs for which more than one rule could
+        match such a path are left out.
+        """
+        candidates = collections.defaultdict(list)
+        for rule in self.iter_rules():
+            segments = rule.rule.split("/")
+            if len(segments) != 3 or "<" in segments[1]:
+                continue
+            for method in rule.methods or []:
+                candidates[method, segments[1]].append(rule)
+        directRules = {}
+        for key, rules in candidates.items():
+            if len(rules) == 1 and len(rules[0].arguments) == 1:
+                directRules[key] = rules[0]
+        return directRules
+
+    def getDirectRule(self, method, pathInfo):
+        """
+        Returns the only rule that can match the specified method and
+        path, or None if there is no such rule.
+        """
+        segments = pathInfo.split("/")
+        if len(segments) != 3:
+            return None
+        directRules = self._directRules
+        if directRules is None:
+            directRules = self._directRules = self._getDirectRules()
+        return directRules.get((method, segments[1]))
+
+
+class DirectRouteMapAdapter(object):
+    """
+    Wraps the MapAdapter bound to a request, matching it against the
+    direct rule from its DirectRouteMap where there is one.
+    """
+    def __init__(self, adapter):
+        self._adapter = adapter
+
+    def __getattr__(self, name):
+        return getattr(self._adapter, name)
+
+    def match(self, path_info=None, method=None, return_rule=False,
+              query_args=None):
+        adapter = self._adapter
+        if path_info is None:
+            path_info = adapter.path_info
+        if method is None:
+            method = adapter.default_method
+        rule = adapter.map.getDirectRule(method.upper(), path_info)
+        if rule is not None:
+            values = rule.match("{}|{}".format(adapter.subdomain, path_info))
+            if values is not None:
+                if return_rule:
+                    return rule, values
+                return rule.endpoint, values
+        return adapter.match(path_info, method, return_rule, query_args)
+
+
 app = flask.Flask(__name__)
+app.url_map = DirectRouteMap(
+    [rule.empty() for rule in app.url_map.iter_rules()])
 assert not hasattr(app, 'urls')
 app.urls = []
 
@@ -64,6 +180,67 @@ class NoConverter(werkzeug.routing.BaseConverter):
 app.url_map.converters['no'] = NoConverter
 
 
+class SessionInterface(flask.sessions.SecureCookieSessionInterface):
+    """
+    The signed cookie sessions holding the state of OIDC logins. No
+    session is opened when OIDC is not configured, sparing every request
+    the cost of setting up the signer for the cookie.
+    """
+    def open_session(self, app, request):
+        if getattr(app, "oidcClient", None) is None:
+            return None
+        return super(SessionInterface, self).open_session(app, request)
+
+
+app.session_interface = SessionInterface()
+
+
+requestsCounter = metrics.registry.register(metrics.Counter(
+    "ga4gh_http_requests_total", "Number of HTTP requests handled",
+    ["endpoint", "method", "status"]))
+requestLatencyHistogram = metrics.registry.register(metrics.Histogram(
+    "ga4gh_http_request_duration_seconds",
+    "Time taken to generate HTTP responses", ["endpoint"]))
+responseBytesCounter = metrics.registry.register(metrics.Counter(
+    "ga4gh_http_response_bytes_total",
+    "Number of bytes sent in HTTP response bodies", ["endpoint"]))
+
+
+def _getFileHandleCacheCount(getCountMethodName):
+    count = getattr(datamodel.fileHandleCache, getCountMethodName)()
+    return [((), count)]
+
+
+def _getResponseCacheCount(attributeName):
+    theBackend = getattr(app, "backend", None)
+    if theBackend is None or theBackend.getResponseCache() is None:
+        return []
+    statistics = theBackend.getResponseCache().getStatistics()
+    return [((), getattr(statistics, attributeName))]
+
+
+for _name, _help, _methodName in [
+        ("hits", "Number of file handles served from the cache",
+         "getNumHits"),
+        ("misses", "Number of files opened on a cache miss",
+         "getNumMisses"),
+        ("evictions", "Number of file handles evicted from the cache",
+         "getNumEvictions")]:
+    metrics.registry.register(metrics.CallbackMetric(
+        "ga4gh_file_handle_cache_{}_total".format(_name), _help, "counter",
+        functools.partial(_getFileHandleCacheCount, _methodName)))
+for _name, _help, _attributeName in [
+        ("hits", "Number of search responses served from the cache",
+         "hits"),
+        ("misses", "Number of search responses not found in the cache",
+         "misses"),
+        ("saved_bytes", "Number of bytes of responses served from the cache",
+         "bytesSaved")]:
+    metrics.registry.register(metrics.CallbackMetric(
+        "ga4gh_response_cache_{}_total".format(_name), _help, "counter",
+        functools.partial(_getResponseCacheCount, _attributeName)))
+
+
 class ServerStatus(object):
     """
     Generates information about the status of the server for display
@@ -82,10 +259,20 @@ class ServerStatus(object):
         # TODO what other config keys are appropriate to export here?
         keys = [
             'DEBUG', 'REQUEST_VALIDATION', 'RESPONSE_VALIDATION',
-            'DEFAULT_PAGE_SIZE', 'MAX_RESPONSE_LENGTH',
+            'DEFAULT_PAGE_SIZE', 'MAX_RESPONSE_LENGTH', 'RESPONSE_CACHE',
         ]
         return [(k, app.config[k]) for k in keys]
 
+    def getResponseCacheStatistics(self):
+        """
+        Returns the CacheStatistics for the search response cache, or
+        None if responses are not being cached.
+        """
+        responseCache = app.backend.getResponseCache()
+        if responseCache is None:
+            return None
+        return responseCache.getStatistics()
+
     def getPreciseUptime(self):
         """
         Returns the server precisely.
@@ -152,26 +339,87 @@ def reset():
     app.config.from_object(configStr)
 
 
-def configure(configFile=None, baseConfig="ProductionConfig",
-              port=8000, extraConfig={}):
+def getCache(configKey, keyPrefix="ga4gh:"):
     """
-    TODO Document this critical function! What does it do? What does
-    it assume?
+    Returns the cache described by the configuration values whose names
+    start with the specified key, or None if the type of the cache is
+    None. Keys in a memcached cache start with the specified prefix.
+    """
+    cacheType = app.config[configKey]
+    maxBytes = app.config[configKey + "_MAX_BYTES"]
+    ttl = app.config[configKey + "_TTL"]
+    if cacheType is None:
+        theCache = None
+    elif cacheType == "memory":
+        theCache = cache.LruCache(maxBytes, ttl)
+    elif cacheType == "filesystem":
+        directory = app.config[configKey + "_DIRECTORY"]
+        if directory is None:
+            raise exceptions.ConfigurationException(
+                "{0}_DIRECTORY must be set to use a filesystem "
+                "{0}".format(configKey))
+        theCache = cache.FileSystemCache(directory, maxBytes, ttl)
+    elif cacheType == "memcached":
+        try:
+            import memcache
+        except ImportError:
+            raise exceptions.ConfigurationException(
+                "The python-memcached package is required to use a "
+                "memcached {}".format(configKey))
+        client = memcache.Client(app.config[configKey + "_MEMCACHED_SERVERS"])
+        theCache = cache.MemcachedCache(client, ttl, keyPrefix)
+    else:
+        raise exceptions.ConfigurationException(
+            "Unknown {} type '{}'".format(configKey, cacheType))
+    return theCache
+
+
+def getResponseCache():
+    """
+    Returns the cache for search responses described by the RESPONSE_CACHE
+    configuration value, or None if responses should not be cached.
+    """
+    return getCache("RESPONSE_CACHE")
+
+
+def getTokenStore():
+    """
+    Returns the TokenStore for the OIDC tokens issued by the server,
+    held in the cache described by the TOKEN_STORE configuration value.
+    """
+    tokenCache = getCache("TOKEN_STORE", "ga4gh-token:")
+    if tokenCache is None:
+        raise exceptions.ConfigurationException(
+            "TOKEN_STORE must be set when OIDC is configured")
+    return cache.TokenStore(tokenCache)
+
+
+def getSlowQueryProfiler():
+    """
+    Returns the SlowQueryProfiler described by the SLOW_QUERY_PROFILE
+    configuration values, or None if requests should not be profiled.
+    """
+    directory = app.config["SLOW_QUERY_PROFILE_DIRECTORY"]
+    sampleRate = app.config["SLOW_QUERY_PROFILE_SAMPLE_RATE"]
+    latencyThreshold = app.config["SLOW_QUERY_PROFILE_LATENCY_THRESHOLD"]
+    if directory is None:
+        return None
+    if not sampleRate and latencyThreshold is None:
+        raise exceptions.ConfigurationException(
+            "SLOW_QUERY_PROFILE_SAMPLE_RATE or "
+            "SLOW_QUERY_PROFILE_LATENCY_THRESHOLD must be set to profile "
+            "requests")
+    return profiling.SlowQueryProfiler(
+        directory, sampleRate, latencyThreshold,
+        app.config["SLOW_QUERY_PROFILE_MAX_DUMPS"])
+
+
+def getBackend():
+    """
+    Returns a new backend serving the data described by the DATA_SOURCE
+    configuration value, set up according to the other configuration
+    values.
     """
-    configStr = 'ga4gh.serverconfig:{0}'.format(baseConfig)
-    app.config.from_object(configStr)
-    if os.environ.get('GA4GH_CONFIGURATION') is not None:
-        app.config.from_envvar('GA4GH_CONFIGURATION')
-    if configFile is not None:
-        app.config.from_pyfile(configFile)
-    app.config.update(extraConfig.items())
-    # Setup file handle cache max size
-    datamodel.fileHandleCache.setMaxCacheSize(
-        app.config["FILE_HANDLE_CACHE_MAX_SIZE"])
-    # Setup CORS
-    cors.CORS(app, allow_headers='Content-Type')
-    app.serverStatus = ServerStatus()
-    # Allocate the backend
     # TODO is this a good way to determine what type of backend we should
     # instantiate? We should think carefully about this. The approach of
     # using the special strings __SIMULATED__ and __EMPTY__ seems OK for
@@ -188,12 +436,13 @@ def configure(configFile=None, baseConfig="ProductionConfig",
             "SIMULATED_BACKEND_NUM_REFERENCES_PER_REFERENCE_SET"]
         numAlignments = app.config[
             "SIMULATED_BACKEND_NUM_ALIGNMENTS_PER_READ_GROUP"]
+        readLength = app.config["SIMULATED_BACKEND_READ_LENGTH"]
         theBackend = backend.SimulatedBackend(
             randomSeed=randomSeed, numCalls=numCalls,
             variantDensity=variantDensity, numVariantSets=numVariantSets,
             numReferenceSets=numReferenceSets,
             numReferencesPerReferenceSet=numReferencesPerReferenceSet,
-            numAlignments=numAlignments)
+            numAlignments=numAlignments, readLength=readLength)
     elif dataSource == "__EMPTY__":
         theBackend = backend.EmptyBackend()
     else:
@@ -202,17 +451,59 @@ def configure(configFile=None, baseConfig="ProductionConfig",
     theBackend.setResponseValidation(app.config["RESPONSE_VALIDATION"])
     theBackend.setDefaultPageSize(app.config["DEFAULT_PAGE_SIZE"])
     theBackend.setMaxResponseLength(app.config["MAX_RESPONSE_LENGTH"])
-    app.backend = theBackend
+    theBackend.setReferenceBasesPageLength(
+        app.config["REFERENCE_BASES_PAGE_LENGTH"])
+    theBackend.setReferenceSequenceChunkSize(
+        app.config["REFERENCE_SEQUENCE_CHUNK_SIZE"])
+    theBackend.setResponseCache(getResponseCache())
+    return theBackend
+
+
+def reloadBackend():
+    """
+    Replaces the backend with a new one built from the current
+    configuration, so that any changes to the data are served. Open
+    file handles are discarded first, as the files may have changed,
+    along with the shared local IDs of the objects being replaced.
+    """
+    datamodel.fileHandleCache.clear()
+    datamodel.clearInternedLocalIds()
+    app.backend = getBackend()
+    app.entityTagSeed = getEntityTagSeed()
+
+
+def configure(configFile=None, baseConfig="ProductionConfig",
+              port=8000, extraConfig={}):
+    """
+    TODO Document this critical function! What does it do? What does
+    it assume?
+    """
+    configStr = 'ga4gh.serverconfig:{0}'.format(baseConfig)
+    app.config.from_object(configStr)
+    if os.environ.get('GA4GH_CONFIGURATION') is not None:
+        app.config.from_envvar('GA4GH_CONFIGURATION')
+    if configFile is not None:
+        app.config.from_pyfile(configFile)
+    app.config.update(extraConfig.items())
+    # Setup file handle cache max size
+    datamodel.fileHandleCache.setMaxCacheSize(
+        app.config["FILE_HANDLE_CACHE_MAX_SIZE"])
+    app.corsOptions = cors.core.get_cors_options(
+        app, {"allow_headers": "Content-Type"})
+    app.serverStatus = ServerStatus()
+    app.backend = getBackend()
+    app.slowQueryProfiler = getSlowQueryProfiler()
+    app.entityTagSeed = getEntityTagSeed()
     app.secret_key = os.urandom(SECRET_KEY_LENGTH)
     app.oidcClient = None
-    app.tokenMap = None
+    app.tokenStore = None
     app.myPort = port
     if "OIDC_PROVIDER" in app.config:
         # The oic client. If we're testing, we don't want to verify
         # SSL certificates
         app.oidcClient = oic.oic.Client(
             verify_ssl=('TESTING' not in app.config))
-        app.tokenMap = {}
+        app.tokenStore = getTokenStore()
         try:
             app.oidcClient.provider_config(app.config['OIDC_PROVIDER'])
         except requests.exceptions.ConnectionError:
@@ -251,6 +542,232 @@ def configure(configFile=None, baseConfig="ProductionConfig",
             app.oidcClient.store_registration_info(response)
 
 
+def getEntityTagSeed():
+    """
+    Returns a digest of everything other than the request that determines
+    the content of a response: the server version, the version of the
+    data served by the backend and the configuration values that affect
+    paging.
+    """
+    keys = [
+        'DEFAULT_PAGE_SIZE', 'MAX_RESPONSE_LENGTH',
+        'REFERENCE_BASES_PAGE_LENGTH',
+    ]
+    values = [ga4gh.__version__, app.backend.getDataVersion()]
+    values.extend(str(app.config[key]) for key in keys)
+    return hashlib.md5("\n".join(values).encode("utf8")).hexdigest()
+
+
+def getEntityTag(flaskRequest):
+    """
+    Returns the strong entity tag for the response to the specified
+    request. Responses are determined by the request path, query
+    string, body and accepted content types, together with the state
+    summarised in app.entityTagSeed.
+    """
+    digest = hashlib.md5(app.entityTagSeed.encode("utf8"))
+    digest.update(b"\0".join((
+        flaskRequest.path.encode("utf8"), flaskRequest.query_string,
+        flaskRequest.headers.get("Accept", "").encode("utf8"),
+        (getContentEncoding(flaskRequest) or "").encode("utf8"),
+        flaskRequest.get_data(), b"")))
+    return digest.hexdigest()
+
+
+def handleConditionalRequest(flaskRequest, handler, *args):
+    """
+    Runs the specified handler with the specified arguments, tagging
+    the response with an ETag and Cache-Control headers. If the request
+    has an If-None-Match header matching the ETag, a 304 response is
+    returned without running the handler.
+    """
+    if not app.config["CONDITIONAL_REQUESTS"]:
+        return handler(*args)
+    entityTag = getEntityTag(flaskRequest)
+    if flaskRequest.if_none_match.contains(entityTag):
+        response = flask.Response(status=304)
+    else:
+        response = handler(*args)
+    response.set_etag(entityTag)
+    visibility = "public"
+    if app.oidcClient is not None:
+        visibility = "private"
+    response.headers["Cache-Control"] = "{}, max-age={}".format(
+        visibility, app.config["CACHE_CONTROL_MAX_AGE"])
+    return response
+
+
+stageTimingLogger = logging.getLogger(__name__ + ".timing")
+
+
+@app.before_request
+def startRequestTimer():
+    """
+    Records the time at which handling of the request started, and
+    starts timing the stages of handling it if STAGE_TIMING is set.
+    """
+    flask.g.requestStartTime = time.time()
+    if app.config["STAGE_TIMING"]:
+        metrics.startStageTimer()
+
+
+@app.before_request
+def startProfile():
+    """
+    Starts profiling the request if it may be captured by the slow
+    query profiler.
+    """
+    profiler = getattr(app, "slowQueryProfiler", None)
+    flask.g.profile = None
+    if profiler is not None:
+        flask.g.profile = profiler.startRequest()
+
+
+@app.after_request
+def captureProfile(response):
+    """
+    Passes the profile of the current request, if any, to the slow
+    query profiler along with a description of the request.
+    """
+    profile = getattr(flask.g, "profile", None)
+    if profile is None:
+        return response
+    flask.g.profile = None
+    app.slowQueryProfiler.finishRequest(
+        profile, time.time() - flask.g.requestStartTime, {
+            "method": flask.request.method,
+            "path": flask.request.path,
+            "status": response.status_code,
+            "request": flask.request.get_data(as_text=True)})
+    return response
+
+
+@app.after_request
+def reportStageTimings(response):
+    """
+    Reports the time spent in each stage of handling the current
+    request, if stages were timed, in a Server-Timing header and as a
+    JSON log message.
+    """
+    timer = metrics.stopStageTimer()
+    if timer is None:
+        return response
+    response.headers["Server-Timing"] = timer.getServerTimingHeader()
+    stages = collections.OrderedDict(
+        (stage, round(duration * 1000, 3))
+        for stage, duration in timer.getDurations().items())
+    stageTimingLogger.info(json.dumps(collections.OrderedDict([
+        ("method", flask.request.method),
+        ("path", flask.request.path),
+        ("status", response.status_code),
+        ("totalMillis", round(timer.getTotalDuration() * 1000, 3)),
+        ("stageMillis", stages)])))
+    return response
+
+
+def countChunks(chunks, endpoint):
+    """
+    Generates the specified chunks of a streamed response body, counting
+    the bytes sent for the specified endpoint.
+    """
+    for chunk in chunks:
+        responseBytesCounter.inc(len(chunk), (endpoint,))
+        yield chunk
+
+
+# Flask runs after_request functions in the reverse order of their
+# registration, so this must be defined before compressResponse to
+# count the bytes actually sent.
+@app.after_request
+def recordRequestMetrics(response):
+    """
+    Updates the request count, latency and response size metrics for
+    the endpoint handling the current request. The latency of a streamed
+    response covers the time taken to start the stream.
+    """
+    endpoint = flask.request.endpoint or "none"
+    requestsCounter.inc(
+        1, (endpoint, flask.request.method, response.status_code))
+    startTime = getattr(flask.g, "requestStartTime", None)
+    if startTime is not None:
+        requestLatencyHistogram.observe(time.time() - startTime, (endpoint,))
+    if response.is_streamed:
+        response.response = countChunks(response.response, endpoint)
+    else:
+        responseBytesCounter.inc(len(response.get_data()), (endpoint,))
+    return response
+
+
+def getContentEncoding(flaskRequest):
+    """
+    Returns the content coding negotiated for the response to the
+    specified request, or None if the response is not to be compressed.
+    """
+    if not app.config["RESPONSE_COMPRESSION"]:
+        return None
+    return flaskRequest.accept_encodings.best_match(COMPRESSION_CODINGS)
+
+
+def compressChunks(chunks, compressor):
+    """
+    Generates the compressed form of the specified iterable of chunks
+    of data using the specified zlib compressor.
+    """
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if len(compressed) > 0:
+            yield compressed
+    yield compressor.flush()
+
+
+@app.after_request
+def compressResponse(response):
+    """
+    Compresses the body of the specified response using the content
+    coding negotiated with the client. Bodies shorter than
+    RESPONSE_COMPRESSION_MIN_LENGTH are sent uncompressed; streamed
+    bodies are compressed chunk by chunk as they are sent.
+    """
+    if (not app.config["RESPONSE_COMPRESSION"] or
+            response.status_code not in (200, 304)):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = getContentEncoding(flask.request)
+    if (encoding is None or response.status_code != 200 or
+            "Content-Encoding" in response.headers):
+        return response
+    if response.is_streamed:
+        length = response.headers.get("Content-Length", type=int)
+    else:
+        length = len(response.get_data())
+    if length is not None and length < app.config[
+            "RESPONSE_COMPRESSION_MIN_LENGTH"]:
+        return response
+    compressor = zlib.compressobj(
+        app.config["RESPONSE_COMPRESSION_LEVEL"], zlib.DEFLATED,
+        COMPRESSION_WINDOW_BITS[encoding])
+    if response.is_streamed:
+        response.response = compressChunks(response.response, compressor)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(
+            compressor.compress(response.get_data()) + compressor.flush())
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+@app.after_request
+def addCorsHeaders(response):
+    """
+    Adds the CORS headers to the response to a cross-origin request.
+    Requests without an Origin header are not cross-origin, and need no
+    further evaluation.
+    """
+    if "Origin" in flask.request.headers:
+        cors.core.set_cors_headers(response, app.corsOptions)
+    return response
+
+
 def getFlaskResponse(responseString, httpStatus=200):
     """
     Returns a Flask response object for the specified data and HTTP status.
@@ -261,10 +778,16 @@ def getFlaskResponse(responseString, httpStatus=200):
 def handleHttpPost(request, endpoint):
     """
     Handles the specified HTTP POST request, which maps to the specified
-    protocol handler endpoint and protocol request class.
+    protocol handler endpoint and protocol request class. Responses are
+    encoded as JSON unless the client prefers AVRO_BINARY_MIMETYPE.
     """
     if request.mimetype != MIMETYPE:
         raise exceptions.UnsupportedMediaTypeException()
+    mimetype = request.accept_mimetypes.best_match(
+        [MIMETYPE, AVRO_BINARY_MIMETYPE])
+    if mimetype == AVRO_BINARY_MIMETYPE:
+        responseStr = endpoint(request.get_data(), avroBinary=True)
+        return flask.Response(responseStr, mimetype=AVRO_BINARY_MIMETYPE)
     responseStr = endpoint(request.get_data())
     return getFlaskResponse(responseStr)
 
@@ -286,6 +809,42 @@ def handleHttpGet(id_, endpoint):
     return getFlaskResponse(responseStr)
 
 
+def handleReferenceSequence(id_, request):
+    """
+    Handles the specified HTTP GET request for the raw sequence of a
+    reference. The bases are streamed as plain text unless the client
+    accepts SEQUENCE_TWO_BIT_MIMETYPE, in which case they are packed
+    four to a byte. A single HTTP byte range is honoured; requests for
+    multiple ranges receive the full representation.
+    """
+    mimetype = request.accept_mimetypes.best_match(
+        [SEQUENCE_TEXT_MIMETYPE, SEQUENCE_TWO_BIT_MIMETYPE])
+    twoBit = mimetype == SEQUENCE_TWO_BIT_MIMETYPE
+    if not twoBit:
+        mimetype = SEQUENCE_TEXT_MIMETYPE
+    stream = app.backend.runGetReferenceSequence(id_, request.args, twoBit)
+    length = stream.getLength()
+    firstByte, lastByte = 0, length
+    httpStatus = 200
+    headers = {"Accept-Ranges": "bytes"}
+    if request.range is not None and len(request.range.ranges) == 1:
+        byteRange = request.range.range_for_length(length)
+        if byteRange is None:
+            # The length is sent so that the client can correct its range
+            response = handleException(
+                exceptions.ByteRangeNotSatisfiableException(length))
+            response.headers["Content-Range"] = "bytes */{}".format(length)
+            return response
+        firstByte, lastByte = byteRange
+        httpStatus = 206
+        headers["Content-Range"] = "bytes {}-{}/{}".format(
+            firstByte, lastByte - 1, length)
+    headers["Content-Length"] = str(lastByte - firstByte)
+    return flask.Response(
+        stream.generate(firstByte, lastByte), status=httpStatus,
+        mimetype=mimetype, headers=headers, direct_passthrough=True)
+
+
 def handleHttpOptions():
     """
     Handles the specified HTTP OPTIONS request.
@@ -353,7 +912,7 @@ def checkAuthentication():
     if flask.request.endpoint == 'oidcCallback':
         return
     key = flask.session.get('key') or flask.request.args.get('key')
-    if app.tokenMap.get(key) is None:
+    if app.tokenStore.get(key) is None:
         if 'key' in flask.request.args:
             raise exceptions.NotAuthenticatedException()
         else:
@@ -366,7 +925,8 @@ def handleFlaskGetRequest(id_, flaskRequest, endpoint):
     Invokes the specified endpoint to generate a response.
     """
     if flaskRequest.method == "GET":
-        return handleHttpGet(id_, endpoint)
+        return handleConditionalRequest(
+            flaskRequest, handleHttpGet, id_, endpoint)
     else:
         raise exceptions.MethodNotAllowedException()
 
@@ -377,7 +937,8 @@ def handleFlaskListRequest(id_, flaskRequest, endpoint):
     Invokes the specified endpoint to generate a response.
     """
     if flaskRequest.method == "GET":
-        return handleList(id_, endpoint, flaskRequest)
+        return handleConditionalRequest(
+            flaskRequest, handleList, id_, endpoint, flaskRequest)
     else:
         raise exceptions.MethodNotAllowedException()
 
@@ -388,7 +949,8 @@ def handleFlaskPostRequest(flaskRequest, endpoint):
     Invokes the specified endpoint to generate a response.
     """
     if flaskRequest.method == "POST":
-        return handleHttpPost(flaskRequest, endpoint)
+        return handleConditionalRequest(
+            flaskRequest, handleHttpPost, flaskRequest, endpoint)
     elif flaskRequest.method == "OPTIONS":
         return handleHttpOptions()
     else:
@@ -431,6 +993,13 @@ def index():
     return flask.render_template('index.html', info=app.serverStatus)
 
 
+@app.route('/metrics')
+def getMetrics():
+    return flask.Response(
+        metrics.registry.getExpositionText(),
+        content_type=metrics.EXPOSITION_MIMETYPE)
+
+
 @DisplayedRoute('/references/<id>')
 def getReference(id):
     return handleFlaskGetRequest(
@@ -449,6 +1018,14 @@ def listReferenceBases(id):
         id, flask.request, app.backend.runListReferenceBases)
 
 
+@DisplayedRoute('/references/<id>/sequence')
+def getReferenceSequence(id):
+    if flask.request.method != "GET":
+        raise exceptions.MethodNotAllowedException()
+    return handleConditionalRequest(
+        flask.request, handleReferenceSequence, id, flask.request)
+
+
 @DisplayedRoute('/callsets/search', postMethod=True)
 def searchCallSets():
     return handleFlaskPostRequest(
@@ -582,7 +1159,7 @@ def oidcCallback():
         raise exceptions.NotAuthenticatedException()
     key = oic.oauth2.rndstr(SECRET_KEY_LENGTH)
     flask.session['key'] = key
-    app.tokenMap[key] = aresp["code"], respState, atrDict
+    app.tokenStore.add(key, (aresp["code"], respState, atrDict))
     # flask.url_for is broken. It relies on SERVER_NAME for both name
     # and port, and defaults to 'localhost' if not found. Therefore
     # we need to fix the returned url
@@ -0,0 +1,330 @@
+"""
+Lightweight instrumentation for the server. Metrics are registered with
+a Registry, and rendered in the Prometheus text exposition format.
+Updating a metric costs a dictionary lookup under a lock, so metrics
+can be updated on every request. The time spent in each stage of
+handling a request may also be recorded using a StageTimer.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import collections
+import contextlib
+import threading
+import time
+
+
+EXPOSITION_MIMETYPE = "text/plain; version=0.0.4"
+
+# Upper bounds, in seconds, of the default latency histogram buckets
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds of the default histogram buckets for counts of objects
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def _formatLabels(labelNames, labelValues, extraLabels=()):
+    """
+    Returns the exposition format representation of the specified labels.
+    """
+    pairs = list(zip(labelNames, labelValues)) + list(extraLabels)
+    if len(pairs) == 0:
+        return ""
+    return "{{{}}}".format(",".join(
+        '{}="{}"'.format(
+            name, '{}'.format(value).replace(
+                '\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs))
+
+
+def _formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry(object):
+    """
+    A collection of metrics that are exported together.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """
+        Adds the specified metric to this registry, and returns it.
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def getMetrics(self):
+        """
+        Returns the list of metrics in this registry.
+        """
+        return list(self._metrics)
+
+    def getExpositionText(self):
+        """
+        Returns the values of all metrics in this registry in the
+        Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            lines.extend(metric.getSampleLines())
+        return "\n".join(lines) + "\n"
+
+
+class AbstractMetric(object):
+    """
+    The superclass of metrics. Each metric has a name, a help string and
+    a tuple of label names; values are held for each distinct tuple of
+    label values.
+    """
+    type = None
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def getSampleLines(self):
+        """
+        Returns the exposition format lines for the samples of this
+        metric.
+        """
+        raise NotImplementedError()
+
+
+class Counter(AbstractMetric):
+    """
+    A value that only increases, such as a number of requests.
+    """
+    type = "counter"
+
+    def inc(self, amount=1, labelValues=()):
+        """
+        Increments the counter for the specified label values.
+        """
+        with self._lock:
+            self._values[labelValues] = self._values.get(
+                labelValues, 0) + amount
+
+    def getValue(self, labelValues=()):
+        """
+        Returns the value of the counter for the specified label values.
+        """
+        return self._values.get(labelValues, 0)
+
+    def getSampleLines(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            "{}{} {}".format(
+                self.name, _formatLabels(self.labelNames, labelValues),
+                _formatValue(value))
+            for labelValues, value in items]
+
+
+class Histogram(AbstractMetric):
+    """
+    Observations, such as request latencies, counted into buckets with
+    the specified upper bounds.
+    """
+    type = "histogram"
+
+    def __init__(self, name, help, labelNames=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labelValues=()):
+        """
+        Records an observation of the specified value for the specified
+        label values.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelValues)
+            if entry is None:
+                entry = [[0] * (len(self.buckets) + 1), 0, 0]
+                self._values[labelValues] = entry
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def getCount(self, labelValues=()):
+        """
+        Returns the number of observations for the specified label values.
+        """
+        entry = self._values.get(labelValues)
+        return 0 if entry is None else entry[2]
+
+    def getSampleLines(self):
+        with self._lock:
+            items = sorted(
+                (labelValues, (list(entry[0]), entry[1], entry[2]))
+                for labelValues, entry in self._values.items())
+        lines = []
+        for labelValues, (bucketCounts, total, count) in items:
+            cumulative = 0
+            bounds = self.buckets + (float("inf"),)
+            for bound, bucketCount in zip(bounds, bucketCounts):
+                cumulative += bucketCount
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _formatLabels(
+                        self.labelNames, labelValues,
+                        [("le", _formatValue(bound))]),
+                    cumulative))
+            labels = _formatLabels(self.labelNames, labelValues)
+            lines.append("{}_sum{} {}".format(
+                self.name, labels, _formatValue(total)))
+            lines.append("{}_count{} {}".format(self.name, labels, count))
+        return lines
+
+
+class CallbackMetric(AbstractMetric):
+    """
+    A metric whose values are obtained when the metrics are exported,
+    by calling a function returning a list of (labelValues, value)
+    pairs. This allows values that are already maintained elsewhere to
+    be exported without any per-request overhead.
+    """
+    def __init__(self, name, help, type, callback, labelNames=()):
+        super(CallbackMetric, self).__init__(name, help, labelNames)
+        self.type = type
+        self._callback = callback
+
+    def getSampleLines(self):
+        return [
+            "{}{} {}".format(
+                self.name, _formatLabels(self.labelNames, labelValues),
+                _formatValue(value))
+            for labelValues, value in self._callback()]
+
+
+# The registry holding all of the server's metrics.
+registry = Registry()
+
+
+class StageTimer(object):
+    """
+    Accumulates the time spent in each of a number of named stages while
+    handling a single request. Stages may nest, in which case the time
+    spent in the inner stage is also counted in the outer one.
+    """
+    def __init__(self):
+        self._startTime = time.time()
+        self._durations = collections.OrderedDict()
+
+    def add(self, stage, duration):
+        """
+        Adds the specified duration in seconds to the specified stage.
+        """
+        self._durations[stage] = self._durations.get(stage, 0) + duration
+
+    def timeCall(self, stage, function, *args):
+        """
+        Calls the specified function with the specified arguments,
+        adding the time taken to the specified stage, and returns the
+        result.
+        """
+        startTime = time.time()
+        try:
+            return function(*args)
+        finally:
+            self.add(stage, time.time() - startTime)
+
+    def timeIterator(self, stage, iterator):
+        """
+        Generates the values of the specified iterator, adding the time
+        taken to produce each one to the specified stage.
+        """
+        iterator = iter(iterator)
+        while True:
+            startTime = time.time()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                self.add(stage, time.time() - startTime)
+                return
+            self.add(stage, time.time() - startTime)
+            yield value
+
+    def getDurations(self):
+        """
+        Returns an ordered dictionary mapping the stages in the order they
+        were first recorded to the total time spent in them in seconds.
+        """
+        return self._durations
+
+    def getTotalDuration(self):
+        """
+        Returns the time in seconds since this timer was created.
+        """
+        return time.time() - self._startTime
+
+    def getServerTimingHeader(self):
+        """
+        Returns the value of a Server-Timing HTTP header describing the
+        stages recorded by this timer, followed by the total duration.
+        """
+        durations = list(self._durations.items())
+        durations.append(("total", self.getTotalDuration()))
+        return ", ".join(
+            "{};dur={:.3f}".format(stage, duration * 1000)
+            for stage, duration in durations)
+
+
+_stageTimerState = threading.local()
+
+
+def startStageTimer():
+    """
+    Creates a StageTimer for the request being handled by the current
+    thread, and returns it.
+    """
+    _stageTimerState.timer = StageTimer()
+    return _stageTimerState.timer
+
+
+def stopStageTimer():
+    """
+    Stops timing the request being handled by the current thread, and
+    returns its StageTimer, or None if stage timing was not started.
+    """
+    timer = getStageTimer()
+    _stageTimerState.timer = None
+    return timer
+
+
+def getStageTimer():
+    """
+    Returns the StageTimer for the request being handled by the current
+    thread, or None if stages are not being timed. Code recording
+    stages in a loop should call this once, outside the loop, so that
+    timing costs nothing when it is disabled.
+    """
+    return getattr(_stageTimerState, "timer", None)
+
+
+@contextlib.contextmanager
+def timeStage(stage):
+    """
+    Returns a context manager adding the time spent within it to the
+    specified stage of the current request, if stages are being timed.
+    """
+    timer = getStageTimer()
+    if timer is None:
+        yield
+    else:
+        startTime = time.time()
+        try:
+            yield
+        finally:
+            timer.add(stage, time.time() - startTime)
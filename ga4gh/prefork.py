@@ -0,0 +1,217 @@
+"""
+A pre-forking HTTP server for production use. The application, and in
+particular the catalog of data it serves, is set up once in a master
+process, which then forks a number of worker processes to handle
+requests on a shared listening socket. The workers share the memory
+holding the catalog with the master until they modify it.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import logging
+import os
+import signal
+import time
+
+import werkzeug.serving as serving
+
+
+class PreforkServer(object):
+    """
+    Serves the specified WSGI application from numWorkers processes
+    forked from the process calling serve().
+
+    The initWorker function is called in each worker after it has been
+    forked, so that it can discard state that must not be shared with
+    other processes, such as open files. On receipt of SIGHUP, or when
+    the dataChanged function (polled every checkInterval seconds)
+    returns True, the master calls the reload function to rebuild the
+    application's state and replaces the workers: new workers are
+    started, and the old ones are asked to exit once they have finished
+    the request they are handling. If the reload fails, the old workers
+    continue to serve. Workers exiting unexpectedly are restarted.
+    SIGTERM and SIGINT stop the server in the same graceful way.
+    """
+    pollInterval = 0.5
+
+    def __init__(
+            self, app, host, port, numWorkers, initWorker=None,
+            reload=None, dataChanged=None, checkInterval=None,
+            shutdownTimeout=30, sslContext=None):
+        if numWorkers < 1:
+            raise ValueError("At least one worker process is required")
+        self._app = app
+        self._host = host
+        self._port = port
+        self._numWorkers = numWorkers
+        self._initWorker = initWorker
+        self._reload = reload
+        self._dataChanged = dataChanged
+        self._checkInterval = checkInterval
+        self._shutdownTimeout = shutdownTimeout
+        self._sslContext = sslContext
+        self._server = None
+        # Maps the pids of the current workers to None, and of the workers
+        # that have been asked to exit to the time they were asked.
+        self._workers = {}
+        self._reloadRequested = False
+        self._stopRequested = False
+        self._isWorker = False
+        self._log = logging.getLogger(__name__)
+
+    def getNumWorkers(self):
+        """
+        Returns the number of workers currently serving requests.
+        """
+        return sum(
+            1 for stopTime in self._workers.values() if stopTime is None)
+
+    def requestReload(self, *args):
+        """
+        Asks the master to reload the application and replace the
+        workers. This is the master's SIGHUP handler.
+        """
+        self._reloadRequested = True
+
+    def requestStop(self, *args):
+        """
+        Asks the server to stop gracefully. This is the SIGTERM and SIGINT
+        handler in both the master and the workers.
+        """
+        self._stopRequested = True
+
+    def serve(self):
+        """
+        Listens on the host and port, forks the workers and supervises
+        them until the server is stopped.
+        """
+        self._server = serving.make_server(
+            self._host, self._port, self._app,
+            ssl_context=self._sslContext)
+        self._server.timeout = self.pollInterval
+        signal.signal(signal.SIGHUP, self.requestReload)
+        signal.signal(signal.SIGTERM, self.requestStop)
+        signal.signal(signal.SIGINT, self.requestStop)
+        self._log.info(
+            "Serving on %s:%d with %d workers", self._host,
+            self._server.server_port, self._numWorkers)
+        try:
+            self._startWorkers()
+            lastCheckTime = time.time()
+            while not self._stopRequested:
+                time.sleep(self.pollInterval)
+                self._reapWorkers()
+                if (self._checkInterval is not None and
+                        time.time() - lastCheckTime >= self._checkInterval):
+                    lastCheckTime = time.time()
+                    if self._dataChanged():
+                        self._log.info("Data changed; reloading")
+                        self._reloadRequested = True
+                if self._reloadRequested:
+                    self._reloadRequested = False
+                    self._replaceWorkers()
+                else:
+                    self._startWorkers()
+                self._killStragglers()
+        finally:
+            if not self._isWorker:
+                self._stopWorkers(list(self._workers.keys()))
+                self._waitForWorkers()
+                self._server.server_close()
+
+    def _replaceWorkers(self):
+        if self._reload is not None:
+            try:
+                self._reload()
+            except Exception:
+                self._log.exception(
+                    "Reload failed; continuing with the current workers")
+                return
+        oldWorkers = [
+            pid for pid, stopTime in self._workers.items()
+            if stopTime is None]
+        self._stopWorkers(oldWorkers)
+        self._startWorkers()
+
+    def _startWorkers(self):
+        while self.getNumWorkers() < self._numWorkers:
+            pid = os.fork()
+            if pid == 0:
+                self._isWorker = True
+                self._runWorker()
+            self._workers[pid] = None
+
+    def _runWorker(self):
+        """
+        Handles requests until asked to stop, and then exits without
+        returning to the caller.
+        """
+        exitStatus = 0
+        try:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, self.requestStop)
+            # Interrupting the terminal stops the master, which then stops
+            # the workers once they have finished their requests
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            self._stopRequested = False
+            if self._initWorker is not None:
+                self._initWorker()
+            while not self._stopRequested:
+                self._server.handle_request()
+        except Exception:
+            self._log.exception("Worker %d failed", os.getpid())
+            exitStatus = 1
+        finally:
+            os._exit(exitStatus)
+
+    def _stopWorkers(self, pids):
+        for pid in pids:
+            if self._workers.get(pid) is None:
+                self._workers[pid] = time.time()
+            self._signalWorker(pid, signal.SIGTERM)
+
+    def _signalWorker(self, pid, signalNumber):
+        try:
+            os.kill(pid, signalNumber)
+        except OSError as error:
+            if error.errno != errno.ESRCH:
+                raise
+
+    def _killStragglers(self):
+        now = time.time()
+        for pid, stopTime in self._workers.items():
+            if (stopTime is not None and
+                    now - stopTime > self._shutdownTimeout):
+                self._signalWorker(pid, signal.SIGKILL)
+
+    def _reapWorkers(self):
+        """
+        Forgets the workers that have exited, returning True if any have.
+        """
+        reaped = False
+        while len(self._workers) > 0:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as error:
+                if error.errno == errno.EINTR:
+                    continue
+                if error.errno != errno.ECHILD:
+                    raise
+                pid = 0
+            if pid == 0:
+                break
+            stopTime = self._workers.pop(pid, None)
+            if stopTime is None:
+                self._log.warning(
+                    "Worker %d exited unexpectedly with status %d",
+                    pid, status)
+            reaped = True
+        return reaped
+
+    def _waitForWorkers(self):
+        while len(self._workers) > 0:
+            if not self._reapWorkers():
+                time.sleep(self.pollInterval / 10)
+            self._killStragglers()
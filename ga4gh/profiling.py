@@ -0,0 +1,176 @@
+"""
+Capture of CPU profiles for slow or sampled requests in production.
+Each captured request is stored in a directory as a pair of files: a
+pstats dump of the profile and a JSON description of the request. The
+directory is rotated so that it holds at most a fixed number of
+captures, and the captures may later be aggregated into a report of
+the functions in which the most time was spent.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cProfile
+import glob
+import io
+import itertools
+import json
+import os
+import pstats
+import random
+import StringIO
+import tempfile
+import threading
+import time
+
+
+PROFILE_SUFFIX = ".pstats"
+REQUEST_SUFFIX = ".json"
+
+
+class SlowQueryProfiler(object):
+    """
+    Decides which requests to profile, and stores the profiles of those
+    that are captured in the specified directory.
+
+    A fraction sampleRate of requests is captured at random. If a
+    latencyThreshold (in seconds) is given, every request must be
+    profiled, as we cannot tell in advance which will be slow; those
+    taking at least this long are also captured. The overhead of
+    cProfile is substantial, so the threshold should only be used on a
+    subset of servers when it is needed. At most maxDumps captures are
+    kept in the directory; the oldest are removed first.
+    """
+    def __init__(
+            self, directory, sampleRate=0, latencyThreshold=None,
+            maxDumps=100, randomSeed=None):
+        self._directory = directory
+        self._sampleRate = sampleRate
+        self._latencyThreshold = latencyThreshold
+        self._maxDumps = maxDumps
+        self._random = random.Random(randomSeed)
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def getDirectory(self):
+        """
+        Returns the directory in which captures are stored.
+        """
+        return self._directory
+
+    def startRequest(self):
+        """
+        Returns an enabled cProfile.Profile if the request about to be
+        handled by the current thread should be profiled, and None
+        otherwise. The sampling decision is stored on the profile so
+        that finishRequest knows whether to capture it.
+        """
+        sampled = self._random.random() < self._sampleRate
+        if not sampled and self._latencyThreshold is None:
+            return None
+        profile = cProfile.Profile()
+        profile.sampled = sampled
+        profile.enable()
+        return profile
+
+    def finishRequest(self, profile, latency, requestDescription):
+        """
+        Stops the specified profile returned by startRequest, and
+        captures it if the request was sampled or its latency in
+        seconds reached the threshold. The requestDescription is a
+        dictionary that is stored as JSON alongside the profile.
+        Returns the path of the stored profile, or None if the request
+        was not captured.
+        """
+        profile.disable()
+        slow = (
+            self._latencyThreshold is not None and
+            latency >= self._latencyThreshold)
+        if not (profile.sampled or slow):
+            return None
+        description = dict(requestDescription)
+        description["latency"] = latency
+        description["trigger"] = "latency" if slow else "sample"
+        description["time"] = time.time()
+        basePath = os.path.join(self._directory, "{}-{}-{}".format(
+            time.strftime("%Y%m%dT%H%M%S"), os.getpid(),
+            next(self._counter)))
+        self._writeAtomically(
+            basePath + REQUEST_SUFFIX,
+            lambda path: _writeJson(path, description))
+        self._writeAtomically(basePath + PROFILE_SUFFIX, profile.dump_stats)
+        self.rotate()
+        return basePath + PROFILE_SUFFIX
+
+    def _writeAtomically(self, path, writer):
+        fd, tempPath = tempfile.mkstemp(dir=self._directory, prefix=".")
+        os.close(fd)
+        writer(tempPath)
+        os.rename(tempPath, path)
+
+    def rotate(self):
+        """
+        Removes the oldest captures until at most maxDumps remain.
+        """
+        with self._lock:
+            profilePaths = findProfiles(self._directory)
+            for path in profilePaths[:-self._maxDumps or None]:
+                basePath = path[:-len(PROFILE_SUFFIX)]
+                for removePath in [path, basePath + REQUEST_SUFFIX]:
+                    try:
+                        os.unlink(removePath)
+                    except OSError:
+                        pass
+
+
+def _writeJson(path, value):
+    with io.open(path, "w", encoding="utf-8") as jsonFile:
+        jsonFile.write(json.dumps(value, ensure_ascii=False))
+
+
+def findProfiles(directory):
+    """
+    Returns the paths of the profiles captured in the specified
+    directory, oldest first.
+    """
+    paths = glob.glob(os.path.join(directory, "*" + PROFILE_SUFFIX))
+    return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def getRequestDescription(profilePath):
+    """
+    Returns the dictionary describing the request captured alongside
+    the specified profile.
+    """
+    requestPath = profilePath[:-len(PROFILE_SUFFIX)] + REQUEST_SUFFIX
+    with io.open(requestPath, encoding="utf-8") as jsonFile:
+        return json.load(jsonFile)
+
+
+def getHotspotReport(profilePaths, numEntries=20, sortKey="cumulative"):
+    """
+    Returns a text report of the numEntries functions with the highest
+    values of sortKey (any key accepted by pstats.Stats.sort_stats)
+    across all of the specified profiles, preceded by a summary of the
+    slowest requests captured.
+    """
+    output = StringIO.StringIO()
+    stats = pstats.Stats(*profilePaths, stream=output)
+    stats.sort_stats(sortKey).print_stats(numEntries)
+    descriptions = []
+    for path in profilePaths:
+        try:
+            descriptions.append(getRequestDescription(path))
+        except (IOError, ValueError):
+            pass
+    descriptions.sort(key=lambda d: d.get("latency", 0), reverse=True)
+    lines = ["{} requests profiled; slowest:".format(len(profilePaths))]
+    for description in descriptions[:numEntries]:
+        lines.append("  {:10.3f} ms  {} {} ({})".format(
+            description.get("latency", 0) * 1000,
+            description.get("method", ""), description.get("path", ""),
+            description.get("trigger", "")))
+    lines.append("")
+    return "\n".join(lines) + output.getvalue()
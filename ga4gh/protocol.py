@@ -15,6 +15,12 @@ from cStringIO import StringIO
 import avro.io
 
 
+# The key of the object of filter conditions that search variants and
+# search reads requests may include in addition to the schema's fields,
+# so that the server returns only the matching objects.
+SEARCH_FILTERS_KEY = "filters"
+
+
 def convertDatetime(t):
     """
     Converts the specified datetime object into its appropriate protocol
@@ -34,14 +40,17 @@ class SearchResponseBuilder(object):
     we are building responses, as we write the JSON representation
     of ProtocolElements directly to a buffer.
     """
-    def __init__(self, responseClass, pageSize, maxResponseLength):
+    def __init__(
+            self, responseClass, pageSize, maxResponseLength,
+            avroBinary=False):
         """
         Allocates a new SearchResponseBuilder for the specified
         subclass of SearchResponse, with the specified
         user-requested pageSize and the system mandated
         maxResponseLength (in bytes). The maxResponseLength is an
-        approximate limit on the overall length of the JSON
-        response.
+        approximate limit on the overall length of the serialised
+        response. If avroBinary is True, values are written to the
+        buffer using the Avro binary encoding rather than JSON.
         """
         self._responseClass = responseClass
         self._pageSize = pageSize
@@ -49,6 +58,13 @@ class SearchResponseBuilder(object):
         self._valueListBuffer = StringIO()
         self._numElements = 0
         self._nextPageToken = None
+        self._avroBinary = avroBinary
+        if avroBinary:
+            valueListField = responseClass.schema.fields_dict[
+                responseClass.getValueListName()]
+            self._valueSchema = valueListField.type.items
+            self._encoder = avro.io.BinaryEncoder(self._valueListBuffer)
+            self._datumWriter = avro.io.DatumWriter()
 
     def getPageSize(self):
         """
@@ -67,6 +83,12 @@ class SearchResponseBuilder(object):
         """
         return self._maxResponseLength
 
+    def getNumElements(self):
+        """
+        Returns the number of elements added to the value list.
+        """
+        return self._numElements
+
     def getNextPageToken(self):
         """
         Returns the value of the nextPageToken for this
@@ -83,13 +105,41 @@ class SearchResponseBuilder(object):
     def addValue(self, protocolElement):
         """
         Appends the specified protocolElement to the value list for this
-        response.
+        response. Any object with the toJsonString and toJsonDict methods
+        of a ProtocolElement, such as a DatamodelObject, may be added.
         """
+        if self._avroBinary:
+            self._numElements += 1
+            self._datumWriter.write_data(
+                self._valueSchema, protocolElement.toJsonDict(),
+                self._encoder)
+            return
         if self._numElements > 0:
             self._valueListBuffer.write(", ")
         self._numElements += 1
         self._valueListBuffer.write(protocolElement.toJsonString())
 
+    def addJsonStrings(self, jsonStrings):
+        """
+        Appends the values whose JSON representations are in the
+        specified list to the value list for this response. The strings
+        are joined and written at once, and the buffer is only checked
+        for being full afterwards, so the list should be short enough
+        not to overshoot the maxResponseLength by much.
+        """
+        if len(jsonStrings) == 0:
+            return
+        self._numElements += len(jsonStrings)
+        if self._avroBinary:
+            for jsonString in jsonStrings:
+                self._datumWriter.write_data(
+                    self._valueSchema, json.loads(jsonString), self._encoder)
+            return
+        if self._valueListBuffer.tell() > 0:
+            self._valueListBuffer.write(", ")
+        # The JSON strings are bytes; a unicode separator would decode them
+        self._valueListBuffer.write(b", ".join(jsonStrings))
+
     def isFull(self):
         """
         Returns True if the response buffer is full, and False otherwise.
@@ -113,6 +163,30 @@ class SearchResponseBuilder(object):
             json.dumps(self._nextPageToken),
             self._responseClass.getValueListName(), pageListString)
 
+    def getAvroBinary(self):
+        """
+        Returns the Avro binary encoding of the SearchResponse that has
+        been built by this SearchResponseBuilder, which must have been
+        created with avroBinary set to True. The values already encoded
+        in the buffer are written as a single block of the value list.
+        """
+        output = StringIO()
+        encoder = avro.io.BinaryEncoder(output)
+        valueListName = self._responseClass.getValueListName()
+        for field in self._responseClass.schema.fields:
+            if field.name == valueListName:
+                if self._numElements > 0:
+                    encoder.write_long(self._numElements)
+                    output.write(self._valueListBuffer.getvalue())
+                encoder.write_long(0)
+            elif field.name == "nextPageToken":
+                self._datumWriter.write_data(
+                    field.type, self._nextPageToken, encoder)
+            else:
+                self._datumWriter.write_data(
+                    field.type, field.default, encoder)
+        return output.getvalue()
+
 
 class ProtocolElementEncoder(json.JSONEncoder):
     """
@@ -175,6 +249,25 @@ class ProtocolElement(object):
                 out[field.name] = val
         return out
 
+    def toAvroBinary(self):
+        """
+        Returns the Avro binary encoding of this ProtocolElement.
+        """
+        output = StringIO()
+        encoder = avro.io.BinaryEncoder(output)
+        avro.io.DatumWriter(self.schema).write(self.toJsonDict(), encoder)
+        return output.getvalue()
+
+    @classmethod
+    def fromAvroBinary(cls, data):
+        """
+        Returns a decoded ProtocolElement from the specified Avro binary
+        encoded string.
+        """
+        decoder = avro.io.BinaryDecoder(StringIO(data))
+        jsonDict = avro.io.DatumReader(cls.schema).read(decoder)
+        return cls.fromJsonDict(jsonDict)
+
     @classmethod
     def validate(cls, jsonDict):
         """
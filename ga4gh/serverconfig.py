@@ -20,6 +20,28 @@ class BaseConfig(object):
     REQUEST_VALIDATION = False
     RESPONSE_VALIDATION = False
     DEFAULT_PAGE_SIZE = 100
+    REFERENCE_BASES_PAGE_LENGTH = None
+    REFERENCE_SEQUENCE_CHUNK_SIZE = 64 * 1024  # 64KiB
+    CONDITIONAL_REQUESTS = True
+    CACHE_CONTROL_MAX_AGE = 0
+    RESPONSE_COMPRESSION = True
+    RESPONSE_COMPRESSION_MIN_LENGTH = 1024
+    RESPONSE_COMPRESSION_LEVEL = 6
+    STAGE_TIMING = False
+    RESPONSE_CACHE = None
+    RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MiB
+    RESPONSE_CACHE_TTL = None
+    RESPONSE_CACHE_DIRECTORY = None
+    RESPONSE_CACHE_MEMCACHED_SERVERS = ["127.0.0.1:11211"]
+    TOKEN_STORE = "memory"
+    TOKEN_STORE_MAX_BYTES = 16 * 1024 * 1024  # 16MiB
+    TOKEN_STORE_TTL = 24 * 60 * 60  # 1 day
+    TOKEN_STORE_DIRECTORY = None
+    TOKEN_STORE_MEMCACHED_SERVERS = ["127.0.0.1:11211"]
+    SLOW_QUERY_PROFILE_DIRECTORY = None
+    SLOW_QUERY_PROFILE_SAMPLE_RATE = 0
+    SLOW_QUERY_PROFILE_LATENCY_THRESHOLD = None
+    SLOW_QUERY_PROFILE_MAX_DUMPS = 100
     DATA_SOURCE = "__EMPTY__"
 
     # Options for the simulated backend.
@@ -30,6 +52,7 @@ class BaseConfig(object):
     SIMULATED_BACKEND_NUM_REFERENCE_SETS = 1
     SIMULATED_BACKEND_NUM_REFERENCES_PER_REFERENCE_SET = 1
     SIMULATED_BACKEND_NUM_ALIGNMENTS_PER_READ_GROUP = 2
+    SIMULATED_BACKEND_READ_LENGTH = 100
 
     FILE_HANDLE_CACHE_MAX_SIZE = 50
 
@@ -0,0 +1,468 @@
+"""
+Generate a large synthetic data directory for the FileSystemBackend,
+for use in scaling benchmarks. The directory contains a reference set
+of random references, a dataset holding a variant set of indexed VCF
+(or BCF) files and a number of indexed BAM files, and all the required
+JSON metadata. Records are written as they are generated, so the
+size of the output is limited only by disk space.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import array
+import hashlib
+import heapq
+import json
+import os
+import random
+
+import pysam
+
+import utils
+
+
+BASES = "ACGT"
+
+# The INFO and FORMAT fields that may be written, in the order they are
+# added as the number of fields requested increases. GT is always
+# written as the first FORMAT field.
+INFO_FIELDS = [
+    ("NS", "1", "Integer", "Number of samples with data"),
+    ("AF", "A", "Float", "Allele frequency"),
+    ("AC", "A", "Integer", "Allele count in genotypes"),
+    ("AN", "1", "Integer", "Total number of alleles in called genotypes"),
+    ("DP", "1", "Integer", "Combined depth across samples"),
+    ("MQ", "1", "Float", "RMS mapping quality"),
+    ("DB", "0", "Flag", "dbSNP membership"),
+]
+FORMAT_FIELDS = [
+    ("GQ", "1", "Integer", "Genotype quality"),
+    ("DP", "1", "Integer", "Read depth"),
+    ("AD", "R", "Integer", "Allelic depths"),
+    ("PL", "G", "Integer", "Phred-scaled genotype likelihoods"),
+]
+
+
+def writeJson(path, value):
+    with open(path, "w") as jsonFile:
+        json.dump(value, jsonFile, indent=4)
+
+
+class DatasetGenerator(object):
+    """
+    Generates the data directory described by the command line arguments.
+    """
+    def __init__(self, args):
+        self.outputDir = args.output_dir
+        self.referenceSetName = args.reference_set_name
+        self.datasetName = args.dataset_name
+        self.numReferences = args.num_references
+        self.referenceLength = args.reference_length
+        self.numVariantSets = args.num_variant_sets
+        self.numSamples = args.num_samples
+        self.numVariants = args.num_variants
+        self.numInfoFields = args.num_info_fields
+        self.numFormatFields = args.num_format_fields
+        self.phasedFraction = args.phased_fraction
+        self.variantFormat = args.variant_format
+        self.numReadGroupSets = args.num_read_group_sets
+        self.numReadGroups = args.num_read_groups
+        self.coverage = args.coverage
+        self.readLength = args.read_length
+        self.insertSize = args.insert_size
+        self.random = random.Random(args.seed)
+        self.referenceNames = [
+            "{}".format(i + 1) for i in range(self.numReferences)]
+        self.referenceChecksums = {}
+
+    def _makeDirectory(self, *components):
+        path = os.path.join(self.outputDir, *components)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+    def _getBases(self, referenceName):
+        """
+        Returns the bases of the specified reference, read back from the
+        FASTA file so that only one reference is held in memory at once.
+        """
+        fastaFile = pysam.FastaFile(os.path.join(
+            self.outputDir, "referenceSets", self.referenceSetName,
+            "{}.fa.gz".format(referenceName)))
+        bases = fastaFile.fetch(referenceName)
+        fastaFile.close()
+        return bases
+
+    def writeReferenceSet(self):
+        """
+        Writes a bgzipped, indexed FASTA file and JSON metadata for each
+        reference, and the metadata for the reference set.
+        """
+        referenceSetDir = self._makeDirectory(
+            "referenceSets", self.referenceSetName)
+        writeJson(referenceSetDir + ".json", {
+            "assemblyId": self.referenceSetName,
+            "description": "Generated by generate_dataset.py",
+            "isDerived": False,
+            "ncbiTaxonId": 9606,
+            "sourceAccessions": [],
+            "sourceUri": "http://example.com/random_url",
+        })
+        basesPerLine = 70
+        for referenceName in self.referenceNames:
+            fastaPath = os.path.join(
+                referenceSetDir, "{}.fa".format(referenceName))
+            utils.log("writing {} bases to {} ...".format(
+                self.referenceLength, fastaPath))
+            digester = hashlib.md5()
+            with open(fastaPath, "w") as fastaFile:
+                print(">{}".format(referenceName), file=fastaFile)
+                basesRemaining = self.referenceLength
+                while basesRemaining > 0:
+                    line = "".join(
+                        self.random.choice(BASES)
+                        for _ in range(min(basesPerLine, basesRemaining)))
+                    digester.update(line)
+                    print(line, file=fastaFile)
+                    basesRemaining -= len(line)
+            self.referenceChecksums[referenceName] = digester.hexdigest()
+            pysam.tabix_compress(fastaPath, fastaPath + ".gz", force=True)
+            os.unlink(fastaPath)
+            pysam.faidx((fastaPath + ".gz").encode("utf-8"))
+            writeJson(os.path.join(
+                referenceSetDir, "{}.json".format(referenceName)), {
+                "md5checksum": self.referenceChecksums[referenceName],
+                "sourceUri": "http://example.com/random_url",
+                "ncbiTaxonId": 9606,
+                "isDerived": False,
+                "sourceDivergence": None,
+                "sourceAccessions": [],
+            })
+
+    def _getVcfHeader(self, sampleNames):
+        lines = ["##fileformat=VCFv4.1", "##source=generate_dataset.py"]
+        lines.append("##reference={}".format(self.referenceSetName))
+        for referenceName in self.referenceNames:
+            lines.append("##contig=<ID={},length={},assembly={}>".format(
+                referenceName, self.referenceLength, self.referenceSetName))
+        lines.append('##FILTER=<ID=LowQual,Description="Low quality">')
+        for fieldType, fields in [
+                ("INFO", INFO_FIELDS[:self.numInfoFields]),
+                ("FORMAT", [("GT", "1", "String", "Genotype")] +
+                 FORMAT_FIELDS[:self.numFormatFields])]:
+            for name, number, valueType, description in fields:
+                lines.append(
+                    '##{}=<ID={},Number={},Type={},Description="{}">'.format(
+                        fieldType, name, number, valueType, description))
+        lines.append("\t".join(
+            ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+             "FORMAT"] + sampleNames))
+        return "\n".join(lines)
+
+    def _getSampleColumns(self, alleleFrequency):
+        """
+        Returns the list of sample columns for a biallelic variant with
+        the specified alternate allele frequency, and the number of
+        alternate alleles called.
+        """
+        formatFields = FORMAT_FIELDS[:self.numFormatFields]
+        columns = []
+        alternateCount = 0
+        randomValue = self.random.random
+        for _ in range(self.numSamples):
+            alleles = (
+                int(randomValue() < alleleFrequency),
+                int(randomValue() < alleleFrequency))
+            alternateCount += alleles[0] + alleles[1]
+            separator = "|" if randomValue() < self.phasedFraction else "/"
+            values = ["{}{}{}".format(alleles[0], separator, alleles[1])]
+            depth = self.random.randint(5, 60)
+            for name, _, _, _ in formatFields:
+                if name == "GQ":
+                    values.append(str(self.random.randint(1, 99)))
+                elif name == "DP":
+                    values.append(str(depth))
+                elif name == "AD":
+                    alternateDepth = depth * (alleles[0] + alleles[1]) // 2
+                    values.append("{},{}".format(
+                        depth - alternateDepth, alternateDepth))
+                elif name == "PL":
+                    likelihoods = [
+                        self.random.randint(10, 255) for _ in range(3)]
+                    likelihoods[alleles[0] + alleles[1]] = 0
+                    values.append(",".join(map(str, likelihoods)))
+            columns.append(":".join(values))
+        return columns, alternateCount
+
+    def _getInfoColumn(self, alleleFrequency, alternateCount):
+        values = []
+        for name, _, _, _ in INFO_FIELDS[:self.numInfoFields]:
+            if name == "NS":
+                values.append("NS={}".format(self.numSamples))
+            elif name == "AF":
+                values.append("AF={:.4f}".format(alleleFrequency))
+            elif name == "AC":
+                values.append("AC={}".format(alternateCount))
+            elif name == "AN":
+                values.append("AN={}".format(2 * self.numSamples))
+            elif name == "DP":
+                values.append("DP={}".format(
+                    self.random.randint(10, 60) * self.numSamples))
+            elif name == "MQ":
+                values.append("MQ={:.2f}".format(
+                    self.random.uniform(20, 60)))
+            elif name == "DB" and self.random.random() < 0.5:
+                values.append("DB")
+        if len(values) == 0:
+            return "."
+        return ";".join(values)
+
+    def _writeVcf(self, path, referenceName, sampleNames):
+        """
+        Writes numVariants biallelic SNPs on the specified reference,
+        at positions spread evenly on average along it, and compresses
+        and indexes the file.
+        """
+        bases = self._getBases(referenceName)
+        formatColumn = ":".join(
+            ["GT"] + [field[0] for field in
+                      FORMAT_FIELDS[:self.numFormatFields]])
+        meanSpacing = self.referenceLength / self.numVariants
+        utils.log("writing {} variants for {} samples to {} ...".format(
+            self.numVariants, self.numSamples, path))
+        with open(path, "w") as vcfFile:
+            print(self._getVcfHeader(sampleNames), file=vcfFile)
+            position = 0
+            for _ in range(self.numVariants):
+                position += 1 + int(self.random.expovariate(
+                    1 / max(meanSpacing - 1, 1e-9)))
+                if position > self.referenceLength:
+                    break
+                referenceBase = bases[position - 1]
+                alternateBase = self.random.choice(
+                    BASES.replace(referenceBase, ""))
+                alleleFrequency = self.random.betavariate(0.5, 5)
+                sampleColumns, alternateCount = self._getSampleColumns(
+                    alleleFrequency)
+                quality = self.random.uniform(1, 1000)
+                print("\t".join([
+                    referenceName, str(position), ".", referenceBase,
+                    alternateBase, "{:.1f}".format(quality),
+                    "PASS" if quality >= 20 else "LowQual",
+                    self._getInfoColumn(alleleFrequency, alternateCount),
+                    formatColumn] + sampleColumns), file=vcfFile)
+        pysam.tabix_index(path, preset="vcf", force=True)
+        if self.variantFormat == "bcf":
+            self._convertToBcf(path + ".gz")
+
+    def _convertToBcf(self, vcfPath):
+        bcfPath = vcfPath[:-len(".vcf.gz")] + ".bcf"
+        utils.log("converting {} to {} ...".format(vcfPath, bcfPath))
+        inputFile = pysam.VariantFile(vcfPath)
+        outputFile = pysam.VariantFile(bcfPath, "wb", header=inputFile.header)
+        for record in inputFile:
+            outputFile.write(record)
+        outputFile.close()
+        inputFile.close()
+        os.unlink(vcfPath)
+        os.unlink(vcfPath + ".tbi")
+        # pysam cannot build indexes for BCF files.
+        utils.runCommand("bcftools index {}".format(bcfPath))
+
+    def writeVariantSets(self):
+        sampleNames = [
+            "SAMPLE{:06d}".format(i) for i in range(self.numSamples)]
+        for i in range(self.numVariantSets):
+            variantSetDir = self._makeDirectory(
+                "datasets", self.datasetName, "variants",
+                "variantSet{}".format(i))
+            for referenceName in self.referenceNames:
+                self._writeVcf(
+                    os.path.join(variantSetDir, "{}.vcf".format(
+                        referenceName)),
+                    referenceName, sampleNames)
+
+    def _getReadGroupHeaders(self, readGroupSetName):
+        return [{
+            "ID": "{}.RG{}".format(readGroupSetName, i),
+            "SM": readGroupSetName,
+            "LB": "{}.LB{}".format(readGroupSetName, i),
+            "PL": "ILLUMINA",
+            "PI": self.insertSize,
+            "DS": "Generated by generate_dataset.py",
+            "CN": "synthetic",
+        } for i in range(self.numReadGroups)]
+
+    def _makeRead(
+            self, bases, referenceIndex, name, start, mateStart, flag,
+            readGroupId):
+        read = pysam.AlignedSegment()
+        sequence = list(bases[start:start + self.readLength])
+        numMismatches = 0
+        for _ in range(self.random.randint(0, 2)):
+            offset = self.random.randrange(len(sequence))
+            sequence[offset] = self.random.choice(
+                BASES.replace(sequence[offset], ""))
+            numMismatches += 1
+        # pysam requires byte strings for the fields of reads
+        read.query_name = name.encode("utf-8")
+        read.query_sequence = "".join(sequence).encode("utf-8")
+        read.flag = flag
+        read.reference_id = referenceIndex
+        read.reference_start = start
+        read.mapping_quality = self.random.choice([0, 20, 40, 60, 60, 60])
+        read.cigartuples = [(0, len(sequence))]
+        read.next_reference_id = referenceIndex
+        read.next_reference_start = mateStart
+        templateLength = abs(mateStart - start) + self.readLength
+        read.template_length = (
+            templateLength if start <= mateStart else -templateLength)
+        read.query_qualities = array.array(b"B", [
+            self.random.randint(10, 40) for _ in range(len(sequence))])
+        read.tags = [
+            (b"RG", readGroupId.encode("utf-8")), (b"NM", numMismatches)]
+        return read
+
+    def _writeBam(self, path, readGroupSetName):
+        """
+        Writes paired reads giving the requested mean coverage of each
+        reference, spread between the read groups. Mates are held in a
+        heap until the reads before them have been written, so the file
+        is sorted by coordinate with a window of memory no larger than
+        the insert size.
+        """
+        readGroupHeaders = self._getReadGroupHeaders(readGroupSetName)
+        header = {
+            "HD": {"VN": "1.3", "SO": "coordinate"},
+            "SQ": [{
+                "SN": referenceName, "LN": self.referenceLength,
+                "AS": self.referenceSetName,
+                "M5": self.referenceChecksums[referenceName],
+            } for referenceName in self.referenceNames],
+            "RG": readGroupHeaders,
+            "PG": [{"ID": "generate_dataset", "PN": "generate_dataset.py"}],
+        }
+        maxStart = self.referenceLength - self.insertSize
+        numPairs = int(
+            self.coverage * self.referenceLength / (2 * self.readLength))
+        utils.log("writing {} reads per reference to {} ...".format(
+            2 * numPairs, path))
+        bamFile = pysam.AlignmentFile(path, "wb", header=header)
+        for referenceIndex, referenceName in enumerate(self.referenceNames):
+            bases = self._getBases(referenceName)
+            mates = []
+            start = 0
+            for i in range(numPairs):
+                start += int(self.random.expovariate(numPairs / maxStart))
+                if start >= maxStart:
+                    break
+                while len(mates) > 0 and mates[0][0] <= start:
+                    bamFile.write(heapq.heappop(mates)[-1])
+                name = "{}:{}:{}".format(readGroupSetName, referenceName, i)
+                readGroupId = self.random.choice(readGroupHeaders)["ID"]
+                mateStart = start + self.insertSize - self.readLength
+                read = self._makeRead(
+                    bases, referenceIndex, name, start, mateStart, 99,
+                    readGroupId)
+                mate = self._makeRead(
+                    bases, referenceIndex, name, mateStart, start, 147,
+                    readGroupId)
+                bamFile.write(read)
+                heapq.heappush(mates, (mateStart, i, mate))
+            while len(mates) > 0:
+                bamFile.write(heapq.heappop(mates)[-1])
+        bamFile.close()
+        pysam.index(path.encode("utf-8"))
+
+    def writeReadGroupSets(self):
+        readsDir = self._makeDirectory("datasets", self.datasetName, "reads")
+        for i in range(self.numReadGroupSets):
+            readGroupSetName = "readGroupSet{}".format(i)
+            self._writeBam(
+                os.path.join(readsDir, "{}.bam".format(readGroupSetName)),
+                readGroupSetName)
+
+    @utils.Timed()
+    def generate(self):
+        self.writeReferenceSet()
+        self.writeVariantSets()
+        self.writeReadGroupSets()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic data directory for benchmarking")
+    parser.add_argument(
+        "output_dir", help="The data directory to write")
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="The random seed; default %(default)s")
+    parser.add_argument(
+        "--reference-set-name", default="synthetic",
+        help="The name of the reference set; default %(default)s")
+    parser.add_argument(
+        "--dataset-name", default="synthetic",
+        help="The name of the dataset; default %(default)s")
+    parser.add_argument(
+        "--num-references", type=int, default=2,
+        help="The number of references; default %(default)s")
+    parser.add_argument(
+        "--reference-length", type=int, default=1000000,
+        help="The number of bases in each reference; default %(default)s")
+    parser.add_argument(
+        "--num-variant-sets", type=int, default=1,
+        help="The number of variant sets; default %(default)s")
+    parser.add_argument(
+        "--num-samples", type=int, default=100,
+        help="The number of samples in each variant set; "
+             "default %(default)s")
+    parser.add_argument(
+        "--num-variants", type=int, default=10000,
+        help="The number of variants on each reference; "
+             "default %(default)s")
+    parser.add_argument(
+        "--num-info-fields", type=int, default=4,
+        choices=range(len(INFO_FIELDS) + 1),
+        help="The number of INFO fields; default %(default)s")
+    parser.add_argument(
+        "--num-format-fields", type=int, default=2,
+        choices=range(len(FORMAT_FIELDS) + 1),
+        help="The number of FORMAT fields in addition to GT; "
+             "default %(default)s")
+    parser.add_argument(
+        "--phased-fraction", type=float, default=0.5,
+        help="The fraction of genotypes that are phased; "
+             "default %(default)s")
+    parser.add_argument(
+        "--variant-format", default="vcf", choices=["vcf", "bcf"],
+        help="The format of the variant files; bcf requires bcftools; "
+             "default %(default)s")
+    parser.add_argument(
+        "--num-read-group-sets", type=int, default=2,
+        help="The number of BAM files; default %(default)s")
+    parser.add_argument(
+        "--num-read-groups", type=int, default=2,
+        help="The number of read groups in each BAM file; "
+             "default %(default)s")
+    parser.add_argument(
+        "--coverage", type=float, default=1,
+        help="The mean coverage of each reference by each BAM file; "
+             "default %(default)s")
+    parser.add_argument(
+        "--read-length", type=int, default=100,
+        help="The length of each read; default %(default)s")
+    parser.add_argument(
+        "--insert-size", type=int, default=300,
+        help="The distance between the outer ends of paired reads; "
+             "default %(default)s")
+    args = parser.parse_args()
+    if args.insert_size < args.read_length:
+        parser.error("The insert size must be at least the read length")
+    datasetGenerator = DatasetGenerator(args)
+    datasetGenerator.generate()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,167 +1,545 @@
 """
 Stand-alone benchmark for the GA4GH reference implementation.
+
+Runs a suite of requests covering every kind of endpoint directly against
+a backend, for each of the specified data sources: the simulated backend
+(__SIMULATED__) or a data directory such as tests/data or a large
+synthetic dataset made by scripts/generate_dataset.py. The timings are
+written as JSON, and may be compared against those of an earlier run to
+find regressions. With --frontend, the get requests are also made through
+the Flask application over WSGI, measuring the overhead the framework adds
+to each request. The startup result also records how much the resident
+memory of the process grew while the backend's catalog was built.
 """
 from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-import re
-import time
-import pstats
 import argparse
 import cProfile
+import datetime
+import json
+import platform
+import pstats
+import resource
+import sys
+import time
+import urllib
+
+import werkzeug.test
 
+import ga4gh
 import ga4gh.backend
+import ga4gh.frontend as frontend
 import ga4gh.protocol as protocol
 
-import guppy
-
 
-class HeapProfilerBackend(ga4gh.backend.FileSystemBackend):
-    def __init__(self, dataDir):
-        super(HeapProfilerBackend, self).__init__(dataDir)
-        self.profiler = guppy.hpy()
+SIMULATED_DATA_SOURCE = "__SIMULATED__"
 
-    def startProfile(self):
-        self.profiler.setrelheap()
+# The end coordinate used for searches over a whole reference.
+# TODO this is the largest value pysam can handle; see ga4gh/cli.py
+MAX_END = 2**31 - 1
 
-    def endProfile(self):
-        print(self.profiler.heap())
+# Candidate reference names for variant searches, as variant sets do not
+# record which references they have data for.
+CANDIDATE_REFERENCE_NAMES = (
+    [str(i) for i in range(1, 23)] + ["X", "Y", "MT"] +
+    ["chr{}".format(i) for i in range(1, 23)] + ["chrX", "chrY", "chrM"])
 
 
-class CpuProfilerBackend(ga4gh.backend.FileSystemBackend):
-    def __init__(self, dataDir):
-        super(CpuProfilerBackend, self).__init__(dataDir)
-        self.profiler = cProfile.Profile()
+def createBackend(dataSource, numCalls):
+    """
+    Returns a backend serving the specified data source.
+    """
+    if dataSource == SIMULATED_DATA_SOURCE:
+        return ga4gh.backend.SimulatedBackend(
+            randomSeed=0, numCalls=numCalls, variantDensity=0.5,
+            numReadGroupsPerReadGroupSet=2, numAlignments=100)
+    return ga4gh.backend.FileSystemBackend(dataSource)
 
-    def startProfile(self):
-        self.profiler.enable()
 
-    def endProfile(self):
-        self.profiler.disable()
+def _getResidentMemory():
+    """
+    Returns the resident memory of this process in bytes, or None if it
+    cannot be determined on this platform.
+    """
+    try:
+        with open("/proc/self/statm") as statmFile:
+            numPages = int(statmFile.read().split()[1])
+    except (IOError, ValueError, IndexError):
+        return None
+    return numPages * resource.getpagesize()
 
 
-def _heavyQuery(variantSetId, callSetIds):
+def _countObjects(response):
     """
-    Very heavy query: calls for the specified list of callSetIds
-    on chromosome 2 (11 pages, 90 seconds to fetch the entire thing
-    on a high-end desktop machine)
+    Returns the number of objects in the specified search response
+    dictionary.
     """
-    request = protocol.GASearchVariantsRequest()
-    request.referenceName = '2'
-    request.variantSetIds = [variantSetId]
-    request.callSetIds = callSetIds
-    request.pageSize = 100
-    request.end = 100000
-    return request
+    return sum(
+        len(value) for value in response.values() if isinstance(value, list))
 
 
-def timeOneSearch(queryString):
+class Benchmark(object):
     """
-    Returns (search result as JSON string, time elapsed during search)
+    A named request that is timed over a number of repeats. Each repeat
+    calls the run function, which returns a (numObjects, numBytes) pair
+    describing the responses it received.
     """
-    startTime = time.clock()
-    resultString = backend.searchVariants(queryString)
-    endTime = time.clock()
-    elapsedTime = endTime - startTime
-    return resultString, elapsedTime
+    def __init__(self, name, run):
+        self.name = name
+        self.run = run
 
 
-def extractNextPageToken(resultString):
+class BenchmarkRunner(object):
     """
-    Calling GASearchVariantsResponse.fromJsonString() can be slower
-    than doing the variant search in the first place; instead we use
-    a regexp to extract the next page token.
+    Builds and times the suite of benchmarks for a single data source.
     """
-    m = re.search('(?<=nextPageToken": )(?:")?([0-9]*?:[0-9]*)|null',
-                  resultString)
-    if m is not None:
-        return m.group(1)
-    return None
+    def __init__(self, dataSource, args):
+        self._dataSource = dataSource
+        self._repeatLimit = args.repeatLimit
+        self._pageLimit = args.pageLimit
+        self._pageSize = args.pageSize
+        self._resumeDepth = args.resumeDepth
+        self._numCalls = args.numCalls
+        self._numGets = args.numGets
+        self._frontend = args.frontend
+        self._profiler = None
+        if args.profile == "cpu":
+            self._profiler = cProfile.Profile()
+        self._backend = None
+        self._app = None
+        self._elapsed = 0
+        self._numRequests = 0
+        self._startupMemory = None
+
+    def getProfiler(self):
+        return self._profiler
+
+    def _timeCall(self, function, *args):
+        if self._profiler is not None:
+            self._profiler.enable()
+        startTime = time.time()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.time() - startTime
+            if self._profiler is not None:
+                self._profiler.disable()
+            self._elapsed += elapsed
+            self._numRequests += 1
+
+    def _runSearch(self, method, request, pageLimit=None):
+        """
+        Runs the specified search request through the specified backend
+        method, following page tokens for at most pageLimit pages.
+        Returns (numObjects, numBytes).
+        """
+        if pageLimit is None:
+            pageLimit = self._pageLimit
+        numObjects = 0
+        numBytes = 0
+        request.pageToken = None
+        for _ in range(pageLimit):
+            responseString = self._timeCall(method, request.toJsonString())
+            response = json.loads(responseString)
+            numBytes += len(responseString)
+            numObjects += _countObjects(response)
+            request.pageToken = response["nextPageToken"]
+            if request.pageToken is None:
+                break
+        return numObjects, numBytes
+
+    def _runGet(self, method, id_):
+        for _ in range(self._numGets):
+            responseString = self._timeCall(method, id_)
+        return self._numGets, len(responseString)
+
+    def _getFrontendApp(self):
+        """
+        Returns the Flask application configured for production and
+        serving the runner's backend.
+        """
+        if self._app is None:
+            frontend.reset()
+            frontend.configure(
+                baseConfig="ProductionConfig",
+                extraConfig={"DATA_SOURCE": "__EMPTY__"})
+            frontend.app.backend = self._backend
+            frontend.app.entityTagSeed = frontend.getEntityTagSeed()
+            self._app = frontend.app
+        return self._app
+
+    def _callApp(self, environ):
+        """
+        Calls the application for a copy of the specified WSGI environment,
+        returning the body of the response.
+        """
+        status = []
+
+        def startResponse(statusLine, headers, excInfo=None):
+            status.append(statusLine)
+
+        chunks = self._app(dict(environ), startResponse)
+        try:
+            body = b"".join(chunks)
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+        if not status[0].startswith("200"):
+            raise Exception("{} returned {}".format(
+                environ["PATH_INFO"], status[0]))
+        return body
+
+    def _runFrontendGet(self, environ):
+        for _ in range(self._numGets):
+            responseString = self._timeCall(self._callApp, environ)
+        return self._numGets, len(responseString)
+
+    def _getPageToken(self, method, request, depth):
+        """
+        Returns the page token for the specified depth of pages into the
+        results of the specified request, or None if there are fewer
+        pages.
+        """
+        request.pageToken = None
+        for _ in range(depth):
+            response = json.loads(method(request.toJsonString()))
+            request.pageToken = response["nextPageToken"]
+            if request.pageToken is None:
+                break
+        return request.pageToken
+
+    def _runResume(self, method, request, pageToken):
+        request.pageToken = pageToken
+        responseString = self._timeCall(method, request.toJsonString())
+        return (
+            _countObjects(json.loads(responseString)), len(responseString))
+
+    def _runStartup(self):
+        self._backend = None
+        memoryBefore = _getResidentMemory()
+        self._backend = self._timeCall(
+            createBackend, self._dataSource, self._numCalls)
+        memoryAfter = _getResidentMemory()
+        if memoryBefore is not None and memoryAfter is not None:
+            # Memory freed by Python is mostly reused rather than returned
+            # to the system, so only the first startup shows the growth.
+            growth = memoryAfter - memoryBefore
+            if self._startupMemory is None or growth > self._startupMemory:
+                self._startupMemory = growth
+        return 0, 0
+
+    def _findVariantsReferenceName(self, variantSet):
+        for referenceName in CANDIDATE_REFERENCE_NAMES:
+            request = protocol.SearchVariantsRequest()
+            request.variantSetId = variantSet.getId()
+            request.referenceName = referenceName
+            request.start = 0
+            request.end = MAX_END
+            request.callSetIds = []
+            request.pageSize = 1
+            response = protocol.SearchVariantsResponse.fromJsonString(
+                self._backend.runSearchVariants(request.toJsonString()))
+            if len(response.variants) > 0:
+                return referenceName, response.variants[0].id
+        return None, None
+
+    def _findReadsReference(self, readGroupSet, readGroup):
+        for reference in readGroupSet.getReferenceSet().getReferences():
+            request = protocol.SearchReadsRequest()
+            request.readGroupIds = [readGroup.getId()]
+            request.referenceId = reference.getId()
+            request.pageSize = 1
+            response = protocol.SearchReadsResponse.fromJsonString(
+                self._backend.runSearchReads(request.toJsonString()))
+            if len(response.alignments) > 0:
+                return reference
+        return None
+
+    def getBenchmarks(self):
+        """
+        Returns the list of benchmarks for the data source. The backend
+        must have been created, as the requests are made for the largest
+        objects it holds.
+        """
+        backend = self._backend
+        benchmarks = []
+        dataset = backend.getDatasets()[0]
+        if self._frontend:
+            self._getFrontendApp()
 
+        def addSearch(name, method, request, pageLimit=None):
+            benchmarks.append(Benchmark(
+                name, lambda: self._runSearch(method, request, pageLimit)))
 
-def benchmarkOneQuery(request, repeatLimit=3, pageLimit=3):
+        def addGet(name, method, id_, collection):
+            benchmarks.append(Benchmark(
+                name, lambda: self._runGet(method, id_)))
+            if self._frontend:
+                path = "/{}/{}".format(collection, urllib.quote(id_))
+                environ = werkzeug.test.EnvironBuilder(
+                    path, method="GET").get_environ()
+                benchmarks.append(Benchmark(
+                    name + "-frontend",
+                    lambda: self._runFrontendGet(environ)))
+
+        def addResume(name, method, request):
+            pageToken = self._getPageToken(
+                method, request, self._resumeDepth)
+            if pageToken is not None:
+                benchmarks.append(Benchmark(
+                    name, lambda: self._runResume(
+                        method, request, pageToken)))
+
+        request = protocol.SearchDatasetsRequest()
+        addSearch("searchDatasets", backend.runSearchDatasets, request)
+        addGet(
+            "getDataset", backend.runGetDataset, dataset.getId(), "datasets")
+        request = protocol.SearchReferenceSetsRequest()
+        addSearch(
+            "searchReferenceSets", backend.runSearchReferenceSets, request)
+
+        referenceSet = backend.getReferenceSets()[0]
+        reference = max(
+            referenceSet.getReferences(), key=lambda ref: ref.getLength())
+        addGet(
+            "getReferenceSet", backend.runGetReferenceSet,
+            referenceSet.getId(), "referencesets")
+        request = protocol.SearchReferencesRequest()
+        request.referenceSetId = referenceSet.getId()
+        addSearch("searchReferences", backend.runSearchReferences, request)
+        addGet(
+            "getReference", backend.runGetReference, reference.getId(),
+            "references")
+        benchmarks.append(Benchmark(
+            "listReferenceBases", lambda: (1, len(self._timeCall(
+                backend.runListReferenceBases, reference.getId(), {})))))
+
+        request = protocol.SearchVariantSetsRequest()
+        request.datasetId = dataset.getId()
+        addSearch("searchVariantSets", backend.runSearchVariantSets, request)
+        variantSets = dataset.getVariantSets()
+        if len(variantSets) > 0:
+            variantSet = max(
+                variantSets, key=lambda vs: vs.getNumCallSets())
+            addGet(
+                "getVariantSet", backend.runGetVariantSet,
+                variantSet.getId(), "variantsets")
+            request = protocol.SearchCallSetsRequest()
+            request.variantSetId = variantSet.getId()
+            addSearch("searchCallSets", backend.runSearchCallSets, request)
+            callSetIds = [cs.getId() for cs in variantSet.getCallSets()]
+            if len(callSetIds) > 0:
+                addGet(
+                    "getCallSet", backend.runGetCallset, callSetIds[0],
+                    "callsets")
+            referenceName, variantId = self._findVariantsReferenceName(
+                variantSet)
+            if referenceName is not None:
+                addGet(
+                    "getVariant", backend.runGetVariant, variantId,
+                    "variants")
+                for name, ids in [
+                        ("0", []), ("1", callSetIds[:1]),
+                        ("all", callSetIds)]:
+                    request = protocol.SearchVariantsRequest()
+                    request.variantSetId = variantSet.getId()
+                    request.referenceName = referenceName
+                    request.start = 0
+                    request.end = MAX_END
+                    request.callSetIds = ids
+                    request.pageSize = self._pageSize
+                    addSearch(
+                        "searchVariants-{}CallSets".format(name),
+                        backend.runSearchVariants, request)
+                addResume(
+                    "searchVariants-resume", backend.runSearchVariants,
+                    request)
+
+        request = protocol.SearchReadGroupSetsRequest()
+        request.datasetId = dataset.getId()
+        addSearch(
+            "searchReadGroupSets", backend.runSearchReadGroupSets, request)
+        for readGroupSet in dataset.getReadGroupSets():
+            readGroup = readGroupSet.getReadGroups()[0]
+            readsReference = self._findReadsReference(
+                readGroupSet, readGroup)
+            if readsReference is None:
+                continue
+            addGet(
+                "getReadGroupSet", backend.runGetReadGroupSet,
+                readGroupSet.getId(), "readgroupsets")
+            addGet(
+                "getReadGroup", backend.runGetReadGroup, readGroup.getId(),
+                "readgroups")
+            request = protocol.SearchReadsRequest()
+            request.readGroupIds = [readGroup.getId()]
+            request.referenceId = readsReference.getId()
+            request.pageSize = self._pageSize
+            addSearch("searchReads", backend.runSearchReads, request)
+            addResume("searchReads-resume", backend.runSearchReads, request)
+            break
+        return benchmarks
+
+    def _timeBenchmark(self, benchmark):
+        times = []
+        for _ in range(self._repeatLimit):
+            self._elapsed = 0
+            self._numRequests = 0
+            numObjects, numBytes = benchmark.run()
+            times.append(self._elapsed)
+        times.sort()
+        requestsPerSecond = None
+        if times[0] > 0:
+            requestsPerSecond = self._numRequests / times[0]
+        return {
+            "name": benchmark.name,
+            "repeats": len(times),
+            "minSeconds": times[0],
+            "medianSeconds": times[len(times) // 2],
+            "meanSeconds": sum(times) / len(times),
+            "maxSeconds": times[-1],
+            "numObjects": numObjects,
+            "numBytes": numBytes,
+            "numRequests": self._numRequests,
+            "requestsPerSecond": requestsPerSecond,
+        }
+
+    def run(self):
+        """
+        Runs all of the benchmarks, and returns a list of their results.
+        """
+        startupResult = self._timeBenchmark(
+            Benchmark("startup", self._runStartup))
+        startupResult["residentBytes"] = self._startupMemory
+        results = [startupResult]
+        for benchmark in self.getBenchmarks():
+            results.append(self._timeBenchmark(benchmark))
+        return results
+
+
+def compareResults(results, baseline, threshold):
     """
-    Repeat the query several times; perhaps don't go through *all* the
-    pages.  Returns minimum time to run backend.searchVariants() to execute
-    the query (as far as pageLimit allows), *not* including JSON
-    processing to prepare queries or parse responses.
+    Prints the ratio of the minimum times in the specified results to
+    those in the baseline, flagging those exceeding the threshold.
+    Returns the number of regressions found.
     """
-    times = []
-    queryString = request.toJsonString()
-    for i in range(0, repeatLimit):
-        resultString, elapsedTime = timeOneSearch(queryString)
-        accruedTime = elapsedTime
-        pageCount = 1
-        token = extractNextPageToken(resultString)
-        # Iterate to go beyond the first page of results.
-        while token is not None and pageCount < pageLimit:
-            pageRequest = request
-            pageRequest.pageToken = token
-            pageRequestString = pageRequest.toJsonString()
-            resultString, elapsedTime = timeOneSearch(pageRequestString)
-            accruedTime += elapsedTime
-            pageCount = pageCount + 1
-            token = extractNextPageToken(resultString)
-        times.append(accruedTime)
-
-    # TODO: more sophisticated statistics. Sometimes we want min(),
-    # sometimes mean = sum() / len(), sometimes other measures,
-    # perhaps exclude outliers...
-
-    # If we compute average we should throw out at least the first one.
-    # return sum(times[2:])/len(times[2:])
-    return min(times)
-
-if __name__ == '__main__':
+    baselineTimes = {}
+    for run in baseline["runs"]:
+        for result in run["results"]:
+            baselineTimes[run["dataSource"], result["name"]] = result[
+                "minSeconds"]
+    numRegressions = 0
+    for run in results["runs"]:
+        for result in run["results"]:
+            key = run["dataSource"], result["name"]
+            if key not in baselineTimes or baselineTimes[key] == 0:
+                continue
+            ratio = result["minSeconds"] / baselineTimes[key]
+            flag = ""
+            if ratio > threshold:
+                flag = "REGRESSION"
+                numRegressions += 1
+            print("{:20} {:28} {:7.2f} {}".format(
+                key[0][-20:], key[1], ratio, flag), file=sys.stderr)
+    return numRegressions
+
+
+def main():
     parser = argparse.ArgumentParser(
         description="GA4GH reference server benchmark")
     parser.add_argument(
-        'variantSetId',
-        help="The variant set ID to run the query against")
+        "dataSources", nargs="*", default=[SIMULATED_DATA_SOURCE],
+        help="The data directories to benchmark, or {} for the simulated "
+             "backend (default: %(default)s)".format(SIMULATED_DATA_SOURCE))
     parser.add_argument(
-        '--profile', default='none',
-        choices=['none', 'heap', 'cpu'],
-        help='"heap" runs a heap profiler once inside the backend, '
-             '"cpu" runs a cpu profiler.')
+        "--profile", default="none", choices=["none", "heap", "cpu"],
+        help='"heap" prints the heap after running the benchmarks, '
+             '"cpu" runs a cpu profiler over the timed requests.')
     parser.add_argument(
-        '--repeatLimit', type=int, default=3, metavar='N',
-        help='how many times to run each test case (default: %(default)s)')
+        "--repeatLimit", type=int, default=3, metavar="N",
+        help="how many times to run each test case (default: %(default)s)")
     parser.add_argument(
-        '--pageLimit', type=int, default=3, metavar='N',
-        help='how many pages (max) to load '
-             'from each test case (default: %(default)s)')
+        "--pageLimit", type=int, default=3, metavar="N",
+        help="how many pages (max) to load "
+             "from each test case (default: %(default)s)")
     parser.add_argument(
-        "--callSetIds", "-c", default=[],
-        help="""Return variant calls which belong to call sets
-            with these IDs. Pass in IDs as a comma separated list (no spaces),
-            or '*' (with the single quotes!) to indicate 'all call sets'.
-            Omit this option to indicate 'no call sets'.
-            """)
-
+        "--pageSize", type=int, default=100, metavar="N",
+        help="the page size of variants and reads searches "
+             "(default: %(default)s)")
+    parser.add_argument(
+        "--resumeDepth", type=int, default=10, metavar="N",
+        help="how many pages into the results resumed searches start "
+             "(default: %(default)s)")
+    parser.add_argument(
+        "--numCalls", type=int, default=100, metavar="N",
+        help="the number of call sets in the simulated backend "
+             "(default: %(default)s)")
+    parser.add_argument(
+        "--numGets", type=int, default=1, metavar="N",
+        help="how many times each get request is made in each run of its "
+             "test case (default: %(default)s)")
+    parser.add_argument(
+        "--frontend", action="store_true", default=False,
+        help="also make the get requests through the Flask application, "
+             "to measure the overhead of the framework")
+    parser.add_argument(
+        "--output", "-o", default=None,
+        help="the file to write the JSON results to (default: stdout)")
+    parser.add_argument(
+        "--compare", default=None, metavar="BASELINE",
+        help="the JSON results of an earlier run to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=1.2,
+        help="the ratio to the baseline time above which a benchmark is "
+             "reported as a regression (default: %(default)s)")
     args = parser.parse_args()
 
-    backendClass = ga4gh.backend.FileSystemBackend
-    if args.profile == 'heap':
-        backendClass = HeapProfilerBackend
+    if args.profile == "heap":
+        import guppy
+        heapProfiler = guppy.hpy()
+        heapProfiler.setrelheap()
         args.repeatLimit = 1
         args.pageLimit = 1
-    elif args.profile == 'cpu':
-        backendClass = CpuProfilerBackend
-    # Get our list of callSetids
-    callSetIds = args.callSetIds
-    if callSetIds != []:
-        callSetIds = None
-        if args.callSetIds != "*":
-            callSetIds = args.callSetIds.split(",")
-
-    backend = backendClass("ga4gh-example-data")
-    minTime = benchmarkOneQuery(
-        _heavyQuery(args.variantSetId, callSetIds), args.repeatLimit,
-        args.pageLimit)
-    print(minTime)
-
-    if args.profile == 'cpu':
-        stats = pstats.Stats(backend.profiler)
-        stats.sort_stats('time')
+
+    results = {
+        "version": ga4gh.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": datetime.datetime.utcnow().isoformat(),
+        "runs": [],
+    }
+    profilers = []
+    for dataSource in args.dataSources:
+        runner = BenchmarkRunner(dataSource, args)
+        results["runs"].append({
+            "dataSource": dataSource,
+            "results": runner.run(),
+        })
+        if runner.getProfiler() is not None:
+            profilers.append(runner.getProfiler())
+
+    outputString = json.dumps(results, indent=2, sort_keys=True)
+    if args.output is None:
+        print(outputString)
+    else:
+        with open(args.output, "w") as outputFile:
+            outputFile.write(outputString)
+
+    if args.profile == "cpu":
+        stats = pstats.Stats(*profilers, stream=sys.stderr)
+        stats.sort_stats("time")
         stats.print_stats(.25)
+    elif args.profile == "heap":
+        print(heapProfiler.heap(), file=sys.stderr)
+
+    if args.compare is not None:
+        with open(args.compare) as baselineFile:
+            baseline = json.load(baselineFile)
+        if compareResults(results, baseline, args.threshold) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
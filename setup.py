@@ -53,6 +53,8 @@ setup(
             'ga4gh_server=ga4gh.cli:server_main',
             'ga2vcf=ga4gh.cli:ga2vcf_main',
             'ga2sam=ga4gh.cli:ga2sam_main',
+            'ga4gh_profile_report=ga4gh.cli:profilereport_main',
+            'ga4gh_stats=ga4gh.cli:stats_main',
         ]
     },
     classifiers=[
@@ -0,0 +1,11 @@
+"""
+Shim for running the statistics tool during development
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import ga4gh.cli
+
+if __name__ == "__main__":
+    ga4gh.cli.stats_main()
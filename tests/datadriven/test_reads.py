@@ -225,16 +225,23 @@ class ReadGroupSetTest(datadriven.DataDrivenTest):
         self.assertEqual(
             gaReadGroupSet.stats.unalignedReadCount,
             readGroupSetInfo.numUnalignedReads)
+        # Without a statistics file, only a default read group, which
+        # holds every read in the file, has known counts
+        numAlignedReads = numUnalignedReads = -1
+        if readGroupSet.isUsingDefaultReadGroup():
+            numAlignedReads = readGroupSetInfo.numAlignedReads
+            numUnalignedReads = readGroupSetInfo.numUnalignedReads
         for readGroup in readGroupSet.getReadGroups():
             gaReadGroup = readGroup.toProtocolElement()
             self.assertEqual(
-                readGroup.getNumAlignedReads(), -1)
+                readGroup.getNumAlignedReads(), numAlignedReads)
             self.assertEqual(
-                readGroup.getNumUnalignedReads(), -1)
+                readGroup.getNumUnalignedReads(), numUnalignedReads)
             self.assertEqual(
-                gaReadGroup.stats.alignedReadCount, -1)
+                gaReadGroup.stats.alignedReadCount, numAlignedReads)
             self.assertEqual(
-                gaReadGroup.stats.unalignedReadCount, -1)
+                gaReadGroup.stats.unalignedReadCount, numUnalignedReads)
+            self.assertIsNone(gaReadGroup.stats.baseCount)
 
     def testValidateObjects(self):
         # test that validation works on read groups and reads
@@ -0,0 +1,311 @@
+"""
+Tests for the event-driven server
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+import socket
+import threading
+import time
+import unittest
+
+import requests
+
+import ga4gh.asyncserver as asyncserver
+import ga4gh.frontend as frontend
+import ga4gh.protocol as protocol
+
+
+class AsyncServerMixin(object):
+    """
+    Runs an AsyncServer for the application returned by getApp on a
+    background thread.
+    """
+    serverArgs = {}
+    timeout = 10
+
+    def setUp(self):
+        self.server = asyncserver.AsyncServer(
+            self.getApp(), "127.0.0.1", 0, **self.serverArgs)
+        self.baseUrl = "http://127.0.0.1:{}".format(self.server.getPort())
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join()
+
+    def _waitFor(self, condition):
+        endTime = time.time() + self.timeout
+        while not condition():
+            self.assertLess(time.time(), endTime)
+            time.sleep(0.01)
+
+    def _connect(self):
+        sock = socket.create_connection(
+            ("127.0.0.1", self.server.getPort()), timeout=self.timeout)
+        return sock
+
+    def _receiveAll(self, sock):
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if len(chunk) == 0:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+
+class TestAsyncServer(AsyncServerMixin, unittest.TestCase):
+    """
+    Tests the HTTP handling of the AsyncServer with simple applications.
+    """
+    serverArgs = {
+        "numThreads": 2, "maxQueuedRequests": 1, "highWaterMark": 1000,
+        "keepAliveTimeout": 1, "maxRequestBytes": 100}
+    numChunks = 100
+    chunkSize = 100
+
+    def getApp(self):
+        self.numChunksGenerated = 0
+        self.numBlocked = 0
+        self.blockEvent = threading.Event()
+
+        def generateChunks():
+            for i in range(self.numChunks):
+                self.numChunksGenerated += 1
+                yield b"x" * self.chunkSize
+
+        def app(environ, start_response):
+            path = environ["PATH_INFO"]
+            headers = [(str("Content-Type"), str("text/plain"))]
+            if path == "/stream":
+                start_response(str("200 OK"), headers)
+                return generateChunks()
+            elif path == "/block":
+                self.numBlocked += 1
+                self.blockEvent.wait()
+            elif path == "/error":
+                raise Exception("application error")
+            body = b"{} {} {}".format(
+                environ["REQUEST_METHOD"], path,
+                environ["wsgi.input"].read())
+            headers.append(
+                (str("Content-Length"), str(len(body))))
+            start_response(str("200 OK"), headers)
+            return [body]
+
+        return app
+
+    def tearDown(self):
+        # release any blocked threads, so that the server can stop
+        self.blockEvent.set()
+        super(TestAsyncServer, self).tearDown()
+
+    def testRequests(self):
+        session = requests.Session()
+        for i in range(3):
+            response = session.post(
+                self.baseUrl + "/echo/{}".format(i), data="body")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                response.text, "POST /echo/{} body".format(i))
+        # the requests were made on a single connection
+        self.assertEqual(self.server.getNumConnections(), 1)
+        response = session.get(self.baseUrl + "/stream")
+        self.assertEqual(
+            response.content, b"x" * self.numChunks * self.chunkSize)
+        self.assertEqual(response.headers["Transfer-Encoding"], "chunked")
+        response = session.head(self.baseUrl + "/echo")
+        self.assertEqual(response.content, b"")
+
+    def testPipelining(self):
+        sock = self._connect()
+        sock.sendall(
+            b"GET /first HTTP/1.1\r\nHost: test\r\n\r\n"
+            b"GET /second HTTP/1.1\r\nHost: test\r\nConnection: close\r\n\r\n")
+        data = self._receiveAll(sock)
+        sock.close()
+        self.assertLess(data.index(b"GET /first"), data.index(b"GET /second"))
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 2)
+
+    def testBackpressure(self):
+        # a client that does not read holds back the application once the
+        # socket buffers and the high-water mark have been filled
+        self.numChunks = 100000
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(("127.0.0.1", self.server.getPort()))
+        sock.sendall(b"GET /stream HTTP/1.1\r\nConnection: close\r\n\r\n")
+        numChunksGenerated = [-1]
+
+        def isStalled():
+            stalled = numChunksGenerated[0] == self.numChunksGenerated
+            numChunksGenerated[0] = self.numChunksGenerated
+            time.sleep(0.2)
+            return stalled
+
+        self._waitFor(isStalled)
+        self.assertLess(numChunksGenerated[0], self.numChunks // 2)
+        data = self._receiveAll(sock)
+        sock.close()
+        self.assertEqual(self.numChunksGenerated, self.numChunks)
+        self.assertEqual(
+            data.count(b"x" * self.chunkSize), self.numChunks)
+
+    def testIdleConnectionsClosed(self):
+        sock = self._connect()
+        self._waitFor(lambda: self.server.getNumConnections() == 1)
+        self._waitFor(lambda: self.server.getNumConnections() == 0)
+        self.assertEqual(sock.recv(100), b"")
+        sock.close()
+
+    def testOverloaded(self):
+        # two requests occupy the threads, one is queued and the next is
+        # rejected
+        sockets = []
+        for i in range(3):
+            sock = self._connect()
+            sock.sendall(b"GET /block HTTP/1.1\r\n\r\n")
+            sockets.append(sock)
+            if i == 1:
+                self._waitFor(lambda: self.numBlocked == 2)
+        self._waitFor(lambda: self.server.getNumQueuedRequests() == 1)
+        response = requests.get(self.baseUrl + "/echo")
+        self.assertEqual(response.status_code, 503)
+        self.blockEvent.set()
+        for sock in sockets:
+            self.assertIn(b"200 OK", sock.recv(1000))
+            sock.close()
+
+    def testErrors(self):
+        response = requests.get(self.baseUrl + "/error")
+        self.assertEqual(response.status_code, 500)
+        response = requests.post(self.baseUrl + "/echo", data="x" * 101)
+        self.assertEqual(response.status_code, 413)
+        sock = self._connect()
+        sock.sendall(b"not http\r\n\r\n")
+        self.assertIn(b"400 Bad Request", self._receiveAll(sock))
+        sock.close()
+
+
+class TestAsyncServerFrontend(AsyncServerMixin, unittest.TestCase):
+    """
+    Tests serving the GA4GH frontend from the AsyncServer.
+    """
+    def getApp(self):
+        config = {
+            "DATA_SOURCE": "__SIMULATED__",
+            "SIMULATED_BACKEND_RANDOM_SEED": 1111,
+        }
+        frontend.reset()
+        frontend.configure(baseConfig="TestConfig", extraConfig=config)
+        logging.getLogger('ga4gh.frontend.cors').setLevel(logging.CRITICAL)
+        return frontend.app
+
+    def testSearch(self):
+        request = protocol.SearchDatasetsRequest()
+        response = requests.post(
+            self.baseUrl + "/datasets/search", data=request.toJsonString(),
+            headers={"Content-Type": "application/json"})
+        self.assertEqual(response.status_code, 200)
+        expected = frontend.app.test_client().post(
+            "/datasets/search", data=request.toJsonString(),
+            headers={"Content-Type": "application/json"})
+        self.assertEqual(response.content, expected.data)
+        datasets = protocol.SearchDatasetsResponse.fromJsonString(
+            response.text).datasets
+        self.assertEqual(
+            [dataset.id for dataset in datasets],
+            [dataset.getId()
+             for dataset in frontend.app.backend.getDatasets()])
+
+
+class TestAsyncServerConcurrentSearches(AsyncServerMixin, unittest.TestCase):
+    """
+    Tests that searches made at the same time on several of the server's
+    threads, which share the file handle and response caches, return
+    the same responses as when they are made one at a time.
+    """
+    serverArgs = {"numThreads": 8}
+    numClients = 8
+    numRounds = 3
+
+    def getApp(self):
+        config = {
+            "DATA_SOURCE": "tests/data",
+            "RESPONSE_CACHE": "memory",
+        }
+        frontend.reset()
+        frontend.configure(baseConfig="TestConfig", extraConfig=config)
+        logging.getLogger('ga4gh.frontend.cors').setLevel(logging.CRITICAL)
+        return frontend.app
+
+    def _getSearches(self):
+        searches = []
+        for dataset in frontend.app.backend.getDatasets():
+            for readGroupSet in dataset.getReadGroupSets():
+                referenceSet = readGroupSet.getReferenceSet()
+                for readGroup in readGroupSet.getReadGroups():
+                    for reference in referenceSet.getReferences():
+                        request = protocol.SearchReadsRequest()
+                        request.readGroupIds = [readGroup.getId()]
+                        request.referenceId = reference.getId()
+                        request.pageSize = 100
+                        searches.append(("/reads/search", request))
+            for variantSet in dataset.getVariantSets():
+                for referenceName in sorted(variantSet._chromFileMap):
+                    request = protocol.SearchVariantsRequest()
+                    request.variantSetId = variantSet.getId()
+                    request.referenceName = referenceName
+                    request.start = 0
+                    request.end = 2**30
+                    request.pageSize = 100
+                    searches.append(("/variants/search", request))
+        return searches
+
+    def _search(self, session, path, request):
+        response = session.post(
+            self.baseUrl + path, data=request.toJsonString(),
+            headers={"Content-Type": "application/json"})
+        return response.status_code, response.content
+
+    def testConcurrentSearches(self):
+        searches = self._getSearches()
+        self.assertGreater(len(searches), self.numClients)
+        testClient = frontend.app.test_client()
+        expected = []
+        for path, request in searches:
+            response = testClient.post(
+                path, data=request.toJsonString(),
+                headers={"Content-Type": "application/json"})
+            expected.append((200, response.data))
+        # Start from an empty response cache, so that the files are read
+        frontend.app.backend.setResponseCache(frontend.getResponseCache())
+        results = [None] * self.numClients
+
+        def runClient(clientIndex):
+            session = requests.Session()
+            # Each client makes the searches in a different order
+            offset = clientIndex * len(searches) // self.numClients
+            order = range(offset, len(searches)) + range(offset)
+            responses = [None] * len(searches)
+            for _ in range(self.numRounds):
+                for index in order:
+                    path, request = searches[index]
+                    responses[index] = self._search(session, path, request)
+                    if responses[index] != expected[index]:
+                        results[clientIndex] = responses
+                        return
+            results[clientIndex] = responses
+
+        threads = [
+            threading.Thread(target=runClient, args=(clientIndex,))
+            for clientIndex in range(self.numClients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for responses in results:
+            self.assertEqual(responses, expected)
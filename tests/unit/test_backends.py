@@ -7,11 +7,15 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import os
 import unittest
 
+import pysam
+
 import ga4gh.exceptions as exceptions
 import ga4gh.backend as backend
+import ga4gh.datamodel.reads as reads
 import ga4gh.protocol as protocol
 
 
@@ -88,7 +92,7 @@ class TestAbstractBackend(unittest.TestCase):
         variant set.
         """
         request = protocol.SearchCallSetsRequest()
-        request.variantSetIds = [variantSetId]
+        request.variantSetId = variantSetId
         return self.resultIterator(
             request, pageSize, self._backend.runSearchCallSets,
             protocol.SearchCallSetsResponse, "callSets")
@@ -163,6 +167,20 @@ class TestAbstractBackend(unittest.TestCase):
         for result in results[1:]:
             self.assertEqual(result, results[0])
 
+    def testCallSetPagination(self):
+        variantSet = self.getDataset().getVariantSets()[0]
+        expected = [
+            callSet.toProtocolElement() for callSet in
+            variantSet.getCallSets()]
+        for pageSize in [1, 7, 99, 100, 1000]:
+            callSets = list(self.getCallSets(variantSet.getId(), pageSize))
+            self.assertEqual(callSets, expected)
+        # Pages are cut short by the maximum response length
+        self._backend.setMaxResponseLength(1)
+        self._backend.jsonChunkSize = 3
+        callSets = list(self.getCallSets(variantSet.getId(), 10))
+        self.assertEqual(callSets, expected)
+
     def runListReferenceBases(self, id_):
         requestArgs = {"start": 3, "end": 5, "pageToken": "0"}
         responseStr = self._backend.runListReferenceBases(id_, requestArgs)
@@ -194,6 +212,189 @@ class TestFileSystemBackend(TestAbstractBackend):
         self._backend = backend.FileSystemBackend(self._dataDir)
 
 
+class TestVariantFilters(unittest.TestCase):
+    """
+    Tests that searches for variants with filters return exactly the
+    variants meeting them, in pages of any size.
+    """
+    def setUp(self):
+        self._backend = backend.FileSystemBackend(
+            os.path.join("tests", "data"))
+        self._dataset = self._backend.getDatasets()[0]
+
+    def _getVariantSet(self, name):
+        for variantSet in self._dataset.getVariantSets():
+            if variantSet.getLocalId() == name:
+                return variantSet
+        self.fail("No variant set named {}".format(name))
+
+    def _searchVariants(self, variantSet, referenceName, filters, pageSize):
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = variantSet.getId()
+        request.referenceName = referenceName
+        request.start = 0
+        request.end = 2**31
+        request.pageSize = pageSize
+        variantsFound = []
+        while True:
+            requestDict = request.toJsonDict()
+            requestDict[protocol.SEARCH_FILTERS_KEY] = filters
+            response = protocol.SearchVariantsResponse.fromJsonString(
+                self._backend.runSearchVariants(json.dumps(requestDict)))
+            self.assertLessEqual(len(response.variants), pageSize)
+            variantsFound.extend(
+                (variant.start, variant.referenceBases)
+                for variant in response.variants)
+            if response.nextPageToken is None:
+                return variantsFound
+            request.pageToken = response.nextPageToken
+
+    def _getRecords(self, variantSet, referenceName):
+        dataFile = variantSet._chromFileMap[referenceName]
+        return list(pysam.VariantFile(dataFile).fetch(referenceName))
+
+    def _getGenotype(self, record, sampleIndex):
+        return str(record).rstrip("\n").split("\t")[9 + sampleIndex].split(
+            ":")[0]
+
+    def _verifyFilters(self, variantSetName, filters, isMatch):
+        variantSet = self._getVariantSet(variantSetName)
+        numFound = 0
+        for referenceName in variantSet._chromFileMap:
+            expected = [
+                (record.start, record.ref)
+                for record in self._getRecords(variantSet, referenceName)
+                if isMatch(record)]
+            numFound += len(expected)
+            for pageSize in [1, 2, 7, 100]:
+                self.assertEqual(
+                    self._searchVariants(
+                        variantSet, referenceName, filters, pageSize),
+                    expected)
+        return numFound
+
+    def testFilters(self):
+        numFound = self._verifyFilters(
+            "example_2", {"minQuality": 30},
+            lambda record: record.qual is not None and record.qual >= 30)
+        self.assertGreater(numFound, 0)
+        self._verifyFilters(
+            "example_2", {"filterNames": ["PASS"]},
+            lambda record: "PASS" in record.filter.keys())
+        self._verifyFilters(
+            "example_1", {"filterNames": ["."]}, lambda record: True)
+        self._verifyFilters(
+            "example_2", {"info": [{"key": "DB"}]},
+            lambda record: "DB" in record.info)
+        self._verifyFilters(
+            "example_2",
+            {"info": [{"key": "DP", "operator": ">", "value": 10}],
+             "minQuality": 10},
+            lambda record: (
+                record.info.get("DP") > 10 and record.qual >= 10))
+
+    def testGenotypeFilters(self):
+        variantSet = self._getVariantSet("1kgPhase1")
+        callSets = variantSet.getCallSets()
+        for sampleIndex in [0, len(callSets) - 1]:
+            callSetId = callSets[sampleIndex].getId()
+            numFound = self._verifyFilters(
+                "1kgPhase1",
+                {"genotypes": [
+                    {"callSetId": callSetId, "zygosities": ["HET"]}]},
+                lambda record: (
+                    self._getGenotype(record, sampleIndex) in
+                    ("0|1", "1|0")))
+            self.assertGreater(numFound, 0)
+
+    def testInvalidFilters(self):
+        variantSet = self._getVariantSet("example_2")
+        with self.assertRaises(exceptions.InvalidSearchFilterException):
+            self._searchVariants(variantSet, "20", {"minQuality": "x"}, 1)
+        with self.assertRaises(exceptions.CallSetNotFoundException):
+            self._searchVariants(variantSet, "20", {"genotypes": [
+                {"callSetId": "unknown", "zygosities": ["HET"]}]}, 1)
+        request = protocol.SearchCallSetsRequest()
+        request.variantSetId = variantSet.getId()
+        requestDict = request.toJsonDict()
+        requestDict[protocol.SEARCH_FILTERS_KEY] = {}
+        with self.assertRaises(exceptions.InvalidSearchFilterException):
+            self._backend.runSearchCallSets(json.dumps(requestDict))
+
+
+class TestReadFilters(unittest.TestCase):
+    """
+    Tests that searches for reads with filters return exactly the reads
+    meeting them, in pages of any size.
+    """
+    def setUp(self):
+        self._backend = backend.FileSystemBackend(
+            os.path.join("tests", "data"))
+        dataset = self._backend.getDatasets()[0]
+        self._readGroupSet = dataset.getReadGroupSetByName(
+            "HG00533.mapped.ILLUMINA.bwa.CHS.low_coverage.20120522")
+        self._readGroup = self._readGroupSet.getReadGroups()[0]
+        self._reference = self._readGroupSet.getReferenceSet(
+            ).getReferenceByName("1")
+
+    def _searchReads(self, filters, pageSize):
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self._readGroup.getId()]
+        request.referenceId = self._reference.getId()
+        request.pageSize = pageSize
+        readsFound = []
+        while True:
+            requestDict = request.toJsonDict()
+            requestDict[protocol.SEARCH_FILTERS_KEY] = filters
+            response = protocol.SearchReadsResponse.fromJsonString(
+                self._backend.runSearchReads(json.dumps(requestDict)))
+            self.assertLessEqual(len(response.alignments), pageSize)
+            readsFound.extend(
+                (alignment.fragmentName, alignment.readNumber)
+                for alignment in response.alignments)
+            if response.nextPageToken is None:
+                return readsFound
+            request.pageToken = response.nextPageToken
+
+    def _verifyFilters(self, filters, isMatch):
+        samFile = pysam.AlignmentFile(self._readGroupSet.getSamFilePath())
+        samReads = list(samFile.fetch(str(self._reference.getLocalId())))
+        samFile.close()
+        expected = [
+            (read.query_name, self._readGroup.convertReadAlignment(
+                read).readNumber)
+            for read in samReads if isMatch(read)]
+        self.assertGreater(len(expected), 0)
+        self.assertLess(len(expected), len(samReads))
+        for pageSize in [1, 2, 3, 100]:
+            self.assertEqual(self._searchReads(filters, pageSize), expected)
+
+    def testFilters(self):
+        self._verifyFilters(
+            {"minMappingQuality": 10},
+            lambda read: read.mapping_quality >= 10)
+        self._verifyFilters(
+            {"excludedFlags": reads.SamFlags.DUPLICATE_FRAGMENT},
+            lambda read: not read.is_duplicate)
+        self._verifyFilters(
+            {"requiredFlags": reads.SamFlags.READ_NUMBER_ONE},
+            lambda read: read.is_read1)
+        self._verifyFilters(
+            {"requiredFlags": reads.SamFlags.PROPER_PLACEMENT,
+             "excludedFlags": reads.SamFlags.DUPLICATE_FRAGMENT,
+             "minMappingQuality": 1},
+            lambda read: (
+                read.is_proper_pair and not read.is_duplicate and
+                read.mapping_quality >= 1))
+
+    def testInvalidFilters(self):
+        for filters in [
+                [], {"unknown": 1}, {"minMappingQuality": -1},
+                {"requiredFlags": "0x4"}, {"excludedFlags": True}]:
+            with self.assertRaises(exceptions.InvalidSearchFilterException):
+                self._searchReads(filters, 10)
+
+
 class TestTopLevelObjectGenerator(unittest.TestCase):
     """
     Tests the generator used for top level objects
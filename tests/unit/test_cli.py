@@ -5,9 +5,13 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import argparse
+import tempfile
 import unittest
 
+import ga4gh.backend as backend
 import ga4gh.cli as cli
+import ga4gh.client as client
 
 
 class TestGa2VcfArguments(unittest.TestCase):
@@ -17,7 +21,7 @@ class TestGa2VcfArguments(unittest.TestCase):
     def testParseArguments(self):
         cliInput = """--key KEY -O vcf --outputFile /dev/null
         --referenceName REFERENCENAME --callSetIds CALL,SET,IDS --start 0
-        --end 1 --pageSize 2 BASEURL VARIANTSETID"""
+        --end 1 --pageSize 2 --workers 3 BASEURL VARIANTSETID"""
         parser = cli.getGa2VcfParser()
         args = parser.parse_args(cliInput.split())
         self.assertEqual(args.key, "KEY")
@@ -28,10 +32,52 @@ class TestGa2VcfArguments(unittest.TestCase):
         self.assertEqual(args.start, 0)
         self.assertEqual(args.end, 1)
         self.assertEqual(args.pageSize, 2)
+        self.assertEqual(args.workers, 3)
         self.assertEquals(args.baseUrl, "BASEURL")
         self.assertEquals(args.variantSetId, "VARIANTSETID")
 
 
+class TestGa2VcfShards(unittest.TestCase):
+    """
+    Tests the division of the range converted by ga2vcf between workers
+    """
+    def _getRunner(self, start, end, outputFile="/dev/null"):
+        cliInput = """--workers 3 --start {} --end {} --outputFile {}
+        --referenceName 1 BASEURL VARIANTSETID""".format(
+            start, end, outputFile)
+        args = cli.getGa2VcfParser().parse_args(cliInput.split())
+        return cli.Ga2VcfRunner(args)
+
+    def testShards(self):
+        self.assertEqual(len(self._getRunner(0, 100)._getShards(100)), 3)
+        self.assertEqual(len(self._getRunner(0, 2)._getShards(2)), 2)
+
+    def testEmptyRange(self):
+        self.assertEqual(self._getRunner(100, 100)._getShards(100), [])
+        self.assertEqual(self._getRunner(100, 50)._getShards(50), [])
+
+    def testUnknownReferenceLength(self):
+        # the variant set has no reference set, so the whole range is
+        # fetched with a single search rather than divided into shards
+        localClient = client.LocalClient(backend.SimulatedBackend())
+        dataset = next(localClient.searchDatasets())
+        variantSet = next(localClient.searchVariantSets(dataset.id))
+        expected = list(localClient.searchVariants(
+            variantSet.id, referenceName="1", start=0, end=1000))
+        self.assertGreater(len(expected), 0)
+        with tempfile.NamedTemporaryFile() as outputFile:
+            runner = self._getRunner(0, 1000, outputFile.name)
+            runner._httpClient = localClient
+            runner._variantSetId = variantSet.id
+            runner.run()
+            records = [
+                line for line in open(outputFile.name)
+                if not line.startswith("#")]
+        self.assertEqual(
+            [int(record.split("\t")[1]) - 1 for record in records],
+            [variant.start for variant in expected])
+
+
 class TestGa2SamArguments(unittest.TestCase):
     """
     Tests the ga2sam cli can parse all arguments it is supposed to
@@ -53,6 +99,33 @@ class TestGa2SamArguments(unittest.TestCase):
         self.assertEquals(args.readGroupId, "READGROUPID")
 
 
+class TestProfileReportArguments(unittest.TestCase):
+    """
+    Tests the profile report cli can parse all arguments it is supposed to
+    """
+    def testParseArguments(self):
+        cliInput = "--numEntries 5 --sortKey tottime DIRECTORY"
+        parser = cli.getProfileReportParser()
+        args = parser.parse_args(cliInput.split())
+        self.assertEqual(args.numEntries, 5)
+        self.assertEqual(args.sortKey, "tottime")
+        self.assertEqual(args.directory, "DIRECTORY")
+
+
+class TestStatsArguments(unittest.TestCase):
+    """
+    Tests the statistics cli can parse all arguments it is supposed to
+    """
+    def testParseArguments(self):
+        cliInput = "--force FILE DIRECTORY"
+        parser = cli.getStatsParser()
+        args = parser.parse_args(cliInput.split())
+        self.assertTrue(args.force)
+        self.assertEqual(args.paths, ["FILE", "DIRECTORY"])
+        args = parser.parse_args(["FILE"])
+        self.assertFalse(args.force)
+
+
 class TestClientArguments(unittest.TestCase):
     """
     Tests the client cli can parse all arguments it is supposed to
@@ -209,3 +282,25 @@ class TestClientArguments(unittest.TestCase):
         self.assertEqual(args.start, 1)
         self.assertEqual(args.end, 2)
         self.assertEquals(args.runner, cli.ListReferenceBasesRunner)
+
+
+class TestServerArguments(unittest.TestCase):
+    """
+    Tests the server cli can parse all arguments it is supposed to
+    """
+    def testParseArguments(self):
+        cliInput = """--port 1234 --host 0.0.0.0 --workers 4
+        --data-check-interval 2.5 --event-loop --threads 16"""
+        parser = argparse.ArgumentParser()
+        cli.addServerOptions(parser)
+        args = parser.parse_args(cliInput.split())
+        self.assertEqual(args.port, 1234)
+        self.assertEqual(args.host, "0.0.0.0")
+        self.assertEqual(args.workers, 4)
+        self.assertEqual(args.data_check_interval, 2.5)
+        self.assertTrue(args.event_loop)
+        self.assertEqual(args.threads, 16)
+        args = parser.parse_args([])
+        self.assertEqual(args.workers, 0)
+        self.assertIsNone(args.data_check_interval)
+        self.assertFalse(args.event_loop)
@@ -61,7 +61,7 @@ class TestSearchMethodsCallRunRequest(unittest.TestCase):
             self.variantSetId, start=self.start, end=self.end,
             referenceName=self.referenceName, callSetIds=self.callSetIds)
         self.httpClient._runSearchRequest.assert_called_once_with(
-            request, "variants", protocol.SearchVariantsResponse)
+            request, "variants", protocol.SearchVariantsResponse, None)
 
     def testSearchDatasets(self):
         request = protocol.SearchDatasetsRequest()
@@ -133,7 +133,7 @@ class TestSearchMethodsCallRunRequest(unittest.TestCase):
             self.readGroupIds, referenceId=self.referenceId,
             start=self.start, end=self.end)
         self.httpClient._runSearchRequest.assert_called_once_with(
-            request, "reads", protocol.SearchReadsResponse)
+            request, "reads", protocol.SearchReadsResponse, None)
 
     def testGetReferenceSet(self):
         self.httpClient.getReferenceSet(self.objectId)
@@ -196,6 +196,7 @@ class DummyResponse(object):
     """
     def __init__(self, text):
         self.text = text
+        self.content = text
         self.status_code = 200
 
 
@@ -264,7 +265,7 @@ class DummyRequestsSession(object):
             result = method(id_)
         return DummyResponse(result)
 
-    def post(self, url, params=None, data=None):
+    def post(self, url, params=None, data=None, headers={}):
         self.checkSessionParameters()
         assert url.startswith(self._urlPrefix)
         suffix = url[len(self._urlPrefix):]
@@ -274,7 +275,10 @@ class DummyRequestsSession(object):
         datatype = suffix[1:-len(searchSuffix)]
         assert datatype in self._searchMethodMap
         method = self._searchMethodMap[datatype]
-        result = method(data)
+        if headers.get("Accept") == "avro/binary":
+            result = method(data, avroBinary=True)
+        else:
+            result = method(data)
         return DummyResponse(result)
 
 
@@ -282,9 +286,10 @@ class DummyHttpClient(client.HttpClient):
     """
     Client in which we intercept calls to the underlying requests connection.
     """
-    def __init__(self, backend):
+    def __init__(self, backend, avroBinary=False):
         self._urlPrefix = "http://example.com"
-        super(DummyHttpClient, self).__init__(self._urlPrefix)
+        super(DummyHttpClient, self).__init__(
+            self._urlPrefix, avroBinary=avroBinary)
         self._session = DummyRequestsSession(backend, self._urlPrefix)
         self._setupHttpSession()
 
@@ -301,11 +306,18 @@ class ExhaustiveListingsMixin(object):
             numVariantSets=3, numCalls=3, variantDensity=0.5,
             numReferenceSets=3, numReferencesPerReferenceSet=3,
             numReadGroupSets=3, numReadGroupsPerReadGroupSet=3,
-            numAlignments=3)
+            numAlignments=10)
 
     def setUp(self):
         self.client = self.getClient()
 
+    def encode(self, gaObject):
+        """
+        Returns the specified protocol object as received through the
+        wire format used by the client.
+        """
+        return gaObject
+
     def verifyObjectList(self, gaObjects, datamodelObjects, getMethod):
         """
         Verifies that the specified list of protocol objects corresponds
@@ -313,9 +325,10 @@ class ExhaustiveListingsMixin(object):
         """
         for gaObject, datamodelObject in utils.zipLists(
                 gaObjects, datamodelObjects):
-            self.assertEqual(gaObject, datamodelObject.toProtocolElement())
+            self.assertEqual(
+                gaObject, self.encode(datamodelObject.toProtocolElement()))
             otherGaObject = getMethod(gaObject.id)
-            self.assertEqual(gaObject, otherGaObject)
+            self.assertEqual(gaObject, self.encode(otherGaObject))
 
     def testAllDatasets(self):
         datasets = list(self.client.searchDatasets())
@@ -390,15 +403,15 @@ class ExhaustiveListingsMixin(object):
                 dmReferenceSet = dmReadGroupSet.getReferenceSet()
                 for dmReadGroup in dmReadGroupSet.getReadGroups():
                     for dmReference in dmReferenceSet.getReferences():
-                        # TODO fix these coordinates.
                         start = 0
-                        end = 10
+                        end = dmReference.getLength()
                         dmReads = list(dmReadGroup.getReadAlignments(
                             dmReference, start, end))
                         reads = list(self.client.searchReads(
                             [dmReadGroup.getId()], dmReference.getId(),
                             start, end))
                         self.assertGreater(len(reads), 0)
+                        self.assertEqual(len(reads), len(dmReads))
                         for dmRead, read in utils.zipLists(dmReads, reads):
                             self.assertEqual(dmRead, read)
 
@@ -421,6 +434,38 @@ class TestExhaustiveListingsLocal(ExhaustiveListingsMixin, unittest.TestCase):
         return client.LocalClient(self.backend)
 
 
+class AvroBinaryMixin(object):
+    """
+    Compares protocol objects as received using the Avro binary encoding.
+    """
+    def encode(self, gaObject):
+        # Avro floats are single precision, so values such as
+        # sourceDivergence do not survive the round trip exactly.
+        return type(gaObject).fromAvroBinary(gaObject.toAvroBinary())
+
+
+class TestExhaustiveListingsHttpAvro(
+        AvroBinaryMixin, ExhaustiveListingsMixin, unittest.TestCase):
+    """
+    Tests the exhaustive listings using the HTTP client with Avro binary
+    encoded responses.
+    """
+
+    def getClient(self):
+        return DummyHttpClient(self.backend, avroBinary=True)
+
+
+class TestExhaustiveListingsLocalAvro(
+        AvroBinaryMixin, ExhaustiveListingsMixin, unittest.TestCase):
+    """
+    Tests the exhaustive listings using the local client with Avro binary
+    encoded responses.
+    """
+
+    def getClient(self):
+        return client.LocalClient(self.backend, avroBinary=True)
+
+
 class PagingMixin(object):
     """
     Tests the paging code using a simulated backend.
@@ -437,7 +482,7 @@ class PagingMixin(object):
         self.datamodelReferenceSet = self.backend.getReferenceSetByIndex(0)
         self.datamodelReferences = self.datamodelReferenceSet.getReferences()
         self.references = [
-            dmReference.toProtocolElement()
+            self.encode(dmReference.toProtocolElement())
             for dmReference in self.datamodelReferences]
         self.assertEqual(len(self.references), self.numReferences)
 
@@ -449,6 +494,9 @@ class PagingMixin(object):
             self.datamodelReferenceSet.getId()))
         self.assertEqual(references, self.references)
 
+    def encode(self, gaObject):
+        return gaObject
+
     def testDefaultPageSize(self):
         self.verifyAllReferences()
 
@@ -489,3 +537,13 @@ class TestPagingHttp(PagingMixin, unittest.TestCase):
 
     def getClient(self):
         return DummyHttpClient(self.backend)
+
+
+class TestPagingLocalAvro(AvroBinaryMixin, PagingMixin, unittest.TestCase):
+    """
+    Tests paging using the local client with Avro binary encoded
+    responses.
+    """
+
+    def getClient(self):
+        return client.LocalClient(self.backend, avroBinary=True)
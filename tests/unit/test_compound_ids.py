@@ -79,6 +79,45 @@ class TestCompoundIds(unittest.TestCase):
         self.assertEqual(compoundIdStr, obfuscated)
         self.assertEqual(compoundId.__class__, ExampleCompoundId)
 
+    def testCompactRepresentation(self):
+        # compound IDs and call sets have no per-instance dictionaries,
+        # and call sets in different variant sets share their local IDs
+        variantSet1 = self.getVariantSet()
+        variantSet2 = variants.AbstractVariantSet(
+            variantSet1.getParentContainer(), "variantSet2")
+        for variantSet in [variantSet1, variantSet2]:
+            variantSet.addCallSet("".join(["sample", "Name"]))
+        callSet1, callSet2 = [
+            variantSet.getCallSetByIndex(0)
+            for variantSet in [variantSet1, variantSet2]]
+        for obj in [callSet1, callSet1.getCompoundId()]:
+            self.assertFalse(hasattr(obj, "__dict__"))
+        self.assertIs(callSet1.getLocalId(), callSet2.getLocalId())
+        self.assertIs(
+            callSet1.getCompoundId().name, callSet2.getCompoundId().name)
+        self.assertEqual(
+            callSet1.getCompoundId().variantSetId, variantSet1.getId())
+        with self.assertRaises(AttributeError):
+            callSet1.getCompoundId().nonexistent
+
+    def testOnlyDataLocalIdsInterned(self):
+        # the local IDs of variants, reads and IDs parsed from requests
+        # are not kept in the intern table, which is never pruned
+        variantSet = self.getVariantSet()
+        numLocalIds = sum(
+            len(table) for table in datamodel._localIdTables.values())
+        for i in range(10):
+            datamodel.VariantCompoundId(
+                variantSet.getCompoundId(), "chr{}".format(i), str(i),
+                "md5{}".format(i))
+            idStr = "a;b;parsed{}".format(i)
+            ExampleCompoundId.parse(datamodel.CompoundId.obfuscate(idStr))
+        self.assertEqual(
+            sum(len(table) for table in datamodel._localIdTables.values()),
+            numLocalIds)
+        datamodel.clearInternedLocalIds()
+        self.assertEqual(len(datamodel._localIdTables), 0)
+
     def getDataset(self):
         return datasets.AbstractDataset("dataset")
 
@@ -10,6 +10,8 @@ import unittest
 
 import pysam
 
+import ga4gh.backend as backend
+import ga4gh.client as client
 import ga4gh.protocol as protocol
 import ga4gh.converters as converters
 
@@ -39,8 +41,11 @@ class TestSamConverterRoundTrip(TestSamConverter):
         with tempfile.NamedTemporaryFile() as fileHandle:
             # write SAM file
             filePath = fileHandle.name
+            reference = protocol.Reference()
+            reference.name = "22"
+            reference.length = 51304566
             samConverter = converters.SamConverter(
-                None, self.getReads(), filePath, binaryOutput)
+                None, self.getReads(), filePath, binaryOutput, [reference])
             samConverter.convert()
 
             # read SAM file
@@ -55,3 +60,182 @@ class TestSamConverterRoundTrip(TestSamConverter):
 
     def testBinary(self):
         self._testRoundTrip(True)
+
+    def testUndeclaredReference(self):
+        with tempfile.NamedTemporaryFile() as fileHandle:
+            samConverter = converters.SamConverter(
+                None, self.getReads(), fileHandle.name, False)
+            with self.assertRaises(converters.SamException):
+                samConverter.convert()
+
+
+class TestSamConverterBackend(unittest.TestCase):
+    """
+    Converts the reads of a BAM file in the test data, which has several
+    read groups, and compares the output with the original.
+    """
+    dataDir = "tests/data"
+    readGroupSetLocalId = (
+        "HG00096.mapped.ILLUMINA.bwa.GBR.low_coverage.20120522")
+    bamPath = "tests/data/datasets/dataset1/reads/{}.bam".format(
+        readGroupSetLocalId)
+
+    def setUp(self):
+        self.backend = backend.FileSystemBackend(self.dataDir)
+        self.client = client.LocalClient(self.backend)
+        dataset = self.backend.getDatasets()[0]
+        readGroupSet, = [
+            readGroupSet for readGroupSet in dataset.getReadGroupSets()
+            if readGroupSet.getLocalId() == self.readGroupSetLocalId]
+        self.readGroupSet = readGroupSet.toProtocolElement()
+        self.referenceSet = readGroupSet.getReferenceSet().toProtocolElement()
+        self.references = list(
+            self.client.searchReferences(self.referenceSet.id))
+
+    def _getReads(self):
+        for reference in self.references:
+            for readGroup in self.readGroupSet.readGroups:
+                for read in self.client.searchReads(
+                        [readGroup.id], reference.id):
+                    yield read
+
+    def _getKey(self, alignedSegment):
+        return (
+            alignedSegment.reference_start, alignedSegment.query_name,
+            alignedSegment.flag, alignedSegment.cigarstring,
+            alignedSegment.query_sequence, alignedSegment.mapping_quality,
+            alignedSegment.template_length,
+            dict(alignedSegment.tags)["RG"])
+
+    def testConvert(self):
+        with tempfile.NamedTemporaryFile() as fileHandle:
+            samConverter = converters.SamConverter(
+                self.readGroupSet, self._getReads(), fileHandle.name, True,
+                self.references, self.referenceSet, bufferSize=2)
+            numReads = samConverter.convert()
+            samFile = pysam.AlignmentFile(fileHandle.name, "rb")
+            header = samFile.header
+            keys = [self._getKey(read) for read in samFile.fetch(
+                until_eof=True)]
+            samFile.close()
+        self.assertEqual(numReads, len(keys))
+        self.assertEqual(
+            [line["SN"] for line in header["SQ"]],
+            [reference.name for reference in self.references])
+        for line, reference in zip(header["SQ"], self.references):
+            self.assertEqual(line["LN"], reference.length)
+            self.assertEqual(line["M5"], reference.md5checksum)
+            self.assertEqual(line["AS"], self.referenceSet.assemblyId)
+        self.assertEqual(
+            [line["ID"] for line in header["RG"]],
+            [readGroup.name for readGroup in self.readGroupSet.readGroups])
+        self.assertGreater(len(header["PG"]), 0)
+        originalFile = pysam.AlignmentFile(self.bamPath, "rb")
+        originalKeys = [self._getKey(read) for read in originalFile.fetch()]
+        originalFile.close()
+        self.assertEqual(sorted(keys), sorted(originalKeys))
+
+
+class TestVcfConverter(unittest.TestCase):
+    """
+    Converts the variants of the test data to VCF and BCF and reads the
+    output back with pysam.
+    """
+    dataDir = "tests/data"
+    variantSetLocalIds = ["1kgPhase1", "example_1"]
+
+    def setUp(self):
+        self.backend = backend.FileSystemBackend(self.dataDir)
+        self.client = client.LocalClient(self.backend)
+        self.dataset = self.backend.getDatasets()[0]
+
+    def _getVariantSet(self, localId):
+        for variantSet in self.dataset.getVariantSets():
+            if variantSet.getLocalId() == localId:
+                return variantSet
+
+    def _convert(self, variantSet, variants, binaryOutput, callSets):
+        with tempfile.NamedTemporaryFile() as fileHandle:
+            vcfConverter = converters.VcfConverter(
+                variantSet.toProtocolElement(), variants, fileHandle.name,
+                binaryOutput, callSets, [("1", 249250621)])
+            vcfConverter.convert()
+            variantFile = pysam.VariantFile(fileHandle.name, "r")
+            samples = list(variantFile.header.samples)
+            records = list(variantFile)
+            variantFile.close()
+        return samples, records
+
+    def _searchVariants(self, variantSet, start=0, end=2**31):
+        return self.client.searchVariants(
+            variantSet.getId(), start, end, "1", None)
+
+    def _testRoundTrip(self, binaryOutput):
+        for localId in self.variantSetLocalIds:
+            variantSet = self._getVariantSet(localId)
+            callSets = [
+                callSet.toProtocolElement()
+                for callSet in variantSet.getCallSets()]
+            variants = list(self._searchVariants(variantSet))
+            samples, records = self._convert(
+                variantSet, iter(variants), binaryOutput, callSets)
+            self.assertEqual(
+                samples, [callSet.name for callSet in callSets])
+            self.assertEqual(len(records), len(variants))
+            for variant, record in zip(variants, records):
+                self.assertEqual(record.pos, variant.start + 1)
+                self.assertEqual(record.ref, variant.referenceBases)
+                self.assertEqual(
+                    list(record.alts or []), variant.alternateBases)
+                alleles = [variant.referenceBases] + variant.alternateBases
+                calls = dict(
+                    (call.callSetName, call) for call in variant.calls)
+                for sample in samples:
+                    self.assertEqual(
+                        list(record.samples[sample]["GT"]),
+                        [alleles[allele]
+                         for allele in calls[sample].genotype])
+
+    def testPlainText(self):
+        self._testRoundTrip(False)
+
+    def testBinary(self):
+        self._testRoundTrip(True)
+
+    def testNoCallSets(self):
+        variantSet = self._getVariantSet(self.variantSetLocalIds[0])
+        samples, records = self._convert(
+            variantSet, self._searchVariants(variantSet), False, [])
+        self.assertEqual(samples, [])
+        self.assertEqual(
+            len(records), len(list(self._searchVariants(variantSet))))
+
+    def testUndeclaredReference(self):
+        variantSet = self._getVariantSet(self.variantSetLocalIds[0])
+        variant = next(self._searchVariants(variantSet))
+        variant.referenceName = "undeclared"
+        with self.assertRaises(converters.VcfException):
+            self._convert(variantSet, iter([variant]), False, [])
+
+    def testShards(self):
+        variantSet = self._getVariantSet(self.variantSetLocalIds[0])
+        variants = list(self._searchVariants(variantSet))
+        boundaries = [0] + [variant.start for variant in variants[::7]] + [
+            variants[-1].end]
+        # the backend's file handles cannot be shared between threads,
+        # so the searches are made before the shards are merged
+        shards = [
+            list(self._searchVariants(variantSet, start, end))
+            for start, end in zip(boundaries[:-1], boundaries[1:])]
+        merged = list(converters.iterateShards(shards, bufferSize=2))
+        self.assertEqual(
+            [variant.id for variant in merged],
+            [variant.id for variant in variants])
+
+    def testShardError(self):
+        def failingShard():
+            yield 1
+            raise ValueError("shard failed")
+
+        with self.assertRaises(ValueError):
+            list(converters.iterateShards([[0], failingShard(), [2]]))
@@ -8,6 +8,7 @@ from __future__ import unicode_literals
 import unittest
 
 import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.references as references
 
 
 class TestDatasets(unittest.TestCase):
@@ -19,3 +20,24 @@ class TestDatasets(unittest.TestCase):
         dataset = datasets.SimulatedDataset(datasetId, 1, 2, 3, 4, 5)
         gaDataset = dataset.toProtocolElement()
         self.assertEqual(dataset.getId(), gaDataset.id)
+
+    def testJsonStringMemoized(self):
+        referenceSet = references.SimulatedReferenceSet("srs1")
+        dataset = datasets.SimulatedDataset(
+            'ds1', referenceSet, numCalls=3, numReadGroupsPerReadGroupSet=2)
+        jsonString = dataset.toJsonString()
+        self.assertEqual(
+            jsonString, dataset.toProtocolElement().toJsonString())
+        self.assertIs(jsonString, dataset.toJsonString())
+        for variantSet in dataset.getVariantSets():
+            self.assertEqual(
+                variantSet.toJsonString(),
+                variantSet.toProtocolElement().toJsonString())
+            for callSet in variantSet.getCallSets():
+                self.assertEqual(
+                    callSet.toJsonString(),
+                    callSet.toProtocolElement().toJsonString())
+        for readGroupSet in dataset.getReadGroupSets():
+            self.assertEqual(
+                readGroupSet.toJsonString(),
+                readGroupSet.toProtocolElement().toJsonString())
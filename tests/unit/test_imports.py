@@ -161,9 +161,15 @@ class ImportGraphLayerChecker(object):
         'datamodel': ['ga4gh/datamodel/reads.py',
                       'ga4gh/datamodel/references.py',
                       'ga4gh/datamodel/variants.py',
-                      'ga4gh/datamodel/datasets.py'],
+                      'ga4gh/datamodel/datasets.py',
+                      'ga4gh/datamodel/stats.py'],
         'libraries': ['ga4gh/converters.py',
-                      'ga4gh/configtest.py'],
+                      'ga4gh/configtest.py',
+                      'ga4gh/cache.py',
+                      'ga4gh/profiling.py',
+                      'ga4gh/prefork.py',
+                      'ga4gh/asyncserver.py'],
+        'metrics': ['ga4gh/metrics.py'],
         'protocol': ['ga4gh/protocol.py',
                      'ga4gh/_protocol_definitions.py'],
         'config': ['ga4gh/serverconfig.py'],
@@ -178,6 +184,7 @@ class ImportGraphLayerChecker(object):
         ['backend'],
         ['libraries'],
         ['datamodel'],
+        ['metrics'],
         ['exceptions'],
         ['avrotools'],
         ['config'],
@@ -0,0 +1,91 @@
+"""
+Tests for the metrics exported by the server
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import ga4gh.metrics as metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Tests the metric types and their exposition format.
+    """
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def testCounter(self):
+        counter = self.registry.register(metrics.Counter(
+            "requests_total", "Requests", ["method"]))
+        counter.inc(1, ("GET",))
+        counter.inc(2, ("GET",))
+        counter.inc(1, ("POST",))
+        self.assertEqual(counter.getValue(("GET",)), 3)
+        self.assertEqual(counter.getValue(("PUT",)), 0)
+        self.assertEqual(self.registry.getExpositionText(), (
+            '# HELP requests_total Requests\n'
+            '# TYPE requests_total counter\n'
+            'requests_total{method="GET"} 3\n'
+            'requests_total{method="POST"} 1\n'))
+
+    def testHistogram(self):
+        histogram = self.registry.register(metrics.Histogram(
+            "latency_seconds", "Latency", buckets=[0.1, 1]))
+        for value in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(value)
+        self.assertEqual(histogram.getCount(), 4)
+        self.assertEqual(self.registry.getExpositionText(), (
+            '# HELP latency_seconds Latency\n'
+            '# TYPE latency_seconds histogram\n'
+            'latency_seconds_bucket{le="0.1"} 2\n'
+            'latency_seconds_bucket{le="1"} 3\n'
+            'latency_seconds_bucket{le="+Inf"} 4\n'
+            'latency_seconds_sum 2.65\n'
+            'latency_seconds_count 4\n'))
+
+    def testCallbackMetric(self):
+        values = []
+        self.registry.register(metrics.CallbackMetric(
+            "open_files", "Open files", "gauge", lambda: values, ["kind"]))
+        self.assertEqual(
+            self.registry.getExpositionText(),
+            '# HELP open_files Open files\n# TYPE open_files gauge\n')
+        values.append((('a "b"',), 2))
+        self.assertIn(
+            'open_files{kind="a \\"b\\""} 2\n',
+            self.registry.getExpositionText())
+
+
+class TestStageTimer(unittest.TestCase):
+    """
+    Tests the recording of the time spent in the stages of a request.
+    """
+    def tearDown(self):
+        metrics.stopStageTimer()
+
+    def testTimeStageDisabled(self):
+        self.assertIsNone(metrics.getStageTimer())
+        with metrics.timeStage("stage"):
+            pass
+        self.assertIsNone(metrics.stopStageTimer())
+
+    def testStages(self):
+        timer = metrics.startStageTimer()
+        self.assertIs(metrics.getStageTimer(), timer)
+        with metrics.timeStage("parse"):
+            pass
+        self.assertEqual(timer.timeCall("convert", len, "abc"), 3)
+        self.assertEqual(
+            list(timer.timeIterator("fetch", range(3))), [0, 1, 2])
+        with metrics.timeStage("parse"):
+            pass
+        self.assertIs(metrics.stopStageTimer(), timer)
+        self.assertIsNone(metrics.getStageTimer())
+        self.assertEqual(
+            list(timer.getDurations().keys()), ["parse", "convert", "fetch"])
+        header = timer.getServerTimingHeader()
+        stages = [metric.split(";")[0] for metric in header.split(", ")]
+        self.assertEqual(stages, ["parse", "convert", "fetch", "total"])
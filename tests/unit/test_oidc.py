@@ -170,6 +170,8 @@ class TestFrontendOidc(unittest.TestCase):
         self.assertEqual(result.status_code, 302)
         self.assertEqual(result.location, 'http://{0}:8001/'.format(
             socket.gethostname()))
+        authorization = frontend.app.tokenStore.get(RANDSTR)
+        self.assertEqual(authorization[1], RANDSTR)
 
     def testSessionKeyAllowsIndex(self):
         """
@@ -179,7 +181,7 @@ class TestFrontendOidc(unittest.TestCase):
         with self.app as app:
             with app.session_transaction() as sess:
                 sess['key'] = 'xxx'
-            app.application.tokenMap['xxx'] = RANDSTR
+            app.application.tokenStore.add('xxx', RANDSTR)
             result = app.get('/')
             self.assertEqual(result.status_code, 200)
             self.assertEqual("text/html", result.mimetype)
@@ -191,7 +193,7 @@ class TestFrontendOidc(unittest.TestCase):
         page
         """
         with self.app as app:
-            app.application.tokenMap['xxx'] = RANDSTR
+            app.application.tokenStore.add('xxx', RANDSTR)
             result = app.get('/?key=xxx')
             self.assertEqual(result.status_code, 200)
             self.assertEqual("text/html", result.mimetype)
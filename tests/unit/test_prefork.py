@@ -0,0 +1,121 @@
+"""
+Tests for the pre-forking server
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import unittest
+
+import requests
+
+import ga4gh.prefork as prefork
+
+
+class TestPreforkServer(unittest.TestCase):
+    """
+    Runs a PreforkServer in a child process, serving an application
+    that responds with the pid of the worker and the number of times
+    the master has reloaded.
+    """
+    numWorkers = 2
+    timeout = 10
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp(prefix="ga4gh_prefork_test")
+        self.dataChangedPath = os.path.join(self.tempDir, "changed")
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+        self.masterPid = os.fork()
+        if self.masterPid == 0:
+            self._runMaster()
+        self._waitFor(lambda: self._getResponse() is not None)
+
+    def tearDown(self):
+        os.kill(self.masterPid, signal.SIGTERM)
+        pid, status = os.waitpid(self.masterPid, 0)
+        shutil.rmtree(self.tempDir)
+        self.assertEqual(status, 0)
+
+    def _runMaster(self):
+        reloads = [0]
+
+        def app(environ, start_response):
+            start_response(
+                str("200 OK"), [(str("Content-Type"), str("text/plain"))])
+            return ["{} {}".format(os.getpid(), reloads[0]).encode()]
+
+        def reload():
+            reloads[0] += 1
+
+        def dataChanged():
+            if os.path.exists(self.dataChangedPath):
+                os.unlink(self.dataChangedPath)
+                return True
+            return False
+
+        exitStatus = 0
+        try:
+            server = prefork.PreforkServer(
+                app, "127.0.0.1", self.port, self.numWorkers,
+                reload=reload, dataChanged=dataChanged, checkInterval=0.1)
+            server.pollInterval = 0.05
+            server.serve()
+        except:
+            exitStatus = 1
+        finally:
+            os._exit(exitStatus)
+
+    def _getResponse(self):
+        """
+        Returns the (workerPid, numReloads) reported by the server, or
+        None if it cannot be reached.
+        """
+        try:
+            response = requests.get(
+                "http://127.0.0.1:{}/".format(self.port), timeout=1)
+        except requests.exceptions.ConnectionError:
+            return None
+        return tuple(int(value) for value in response.text.split())
+
+    def _waitFor(self, condition):
+        endTime = time.time() + self.timeout
+        while not condition():
+            self.assertLess(time.time(), endTime)
+            time.sleep(0.05)
+
+    def _getWorkerPids(self):
+        return set(self._getResponse()[0] for _ in range(20))
+
+    def testWorkers(self):
+        workerPids = self._getWorkerPids()
+        self.assertNotIn(self.masterPid, workerPids)
+        self.assertLessEqual(len(workerPids), self.numWorkers)
+        self.assertEqual(self._getResponse()[1], 0)
+
+    def testReloadOnSignal(self):
+        oldWorkerPids = self._getWorkerPids()
+        os.kill(self.masterPid, signal.SIGHUP)
+        self._waitFor(lambda: self._getResponse()[1] == 1)
+        # the old workers exit once they have finished their requests
+        self._waitFor(
+            lambda: self._getWorkerPids().isdisjoint(oldWorkerPids))
+
+    def testReloadOnDataChange(self):
+        open(self.dataChangedPath, "w").close()
+        self._waitFor(lambda: self._getResponse()[1] == 1)
+        self.assertFalse(os.path.exists(self.dataChangedPath))
+
+    def testWorkerRestarted(self):
+        for workerPid in self._getWorkerPids():
+            os.kill(workerPid, signal.SIGKILL)
+        self._waitFor(lambda: self._getResponse() is not None)
+        self.assertEqual(self._getResponse()[1], 0)
@@ -0,0 +1,111 @@
+"""
+Tests the capture of profiles for slow requests
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import ga4gh.frontend as frontend
+import ga4gh.profiling as profiling
+
+
+def _busyFunction():
+    return sum(range(1000))
+
+
+class TestSlowQueryProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="ga4gh_profiles")
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _profileRequest(self, profiler, latency):
+        profile = profiler.startRequest()
+        if profile is None:
+            return None
+        _busyFunction()
+        return profiler.finishRequest(
+            profile, latency, {"method": "POST", "path": "/test"})
+
+    def testDisabled(self):
+        profiler = profiling.SlowQueryProfiler(self._directory)
+        self.assertIsNone(profiler.startRequest())
+
+    def testSampling(self):
+        profiler = profiling.SlowQueryProfiler(self._directory, sampleRate=1)
+        path = self._profileRequest(profiler, 0.5)
+        self.assertEqual(profiling.findProfiles(self._directory), [path])
+        description = profiling.getRequestDescription(path)
+        self.assertEqual(description["path"], "/test")
+        self.assertEqual(description["latency"], 0.5)
+        self.assertEqual(description["trigger"], "sample")
+
+    def testLatencyThreshold(self):
+        profiler = profiling.SlowQueryProfiler(
+            self._directory, latencyThreshold=1)
+        self.assertIsNone(self._profileRequest(profiler, 0.5))
+        path = self._profileRequest(profiler, 2)
+        self.assertEqual(profiling.findProfiles(self._directory), [path])
+        description = profiling.getRequestDescription(path)
+        self.assertEqual(description["trigger"], "latency")
+
+    def testRotation(self):
+        profiler = profiling.SlowQueryProfiler(
+            self._directory, sampleRate=1, maxDumps=2)
+        paths = []
+        for _ in range(4):
+            paths.append(self._profileRequest(profiler, 0))
+            time.sleep(0.01)
+        self.assertEqual(profiling.findProfiles(self._directory), paths[2:])
+        self.assertEqual(len(os.listdir(self._directory)), 4)
+
+    def testHotspotReport(self):
+        profiler = profiling.SlowQueryProfiler(self._directory, sampleRate=1)
+        for latency in [0.25, 0.75]:
+            self._profileRequest(profiler, latency)
+        report = profiling.getHotspotReport(
+            profiling.findProfiles(self._directory), 5)
+        self.assertIn("2 requests profiled", report)
+        self.assertIn("_busyFunction", report)
+        self.assertLess(report.index("750.000"), report.index("250.000"))
+
+
+class TestFrontendProfiling(unittest.TestCase):
+    """
+    Tests that requests to the server are captured by the profiler
+    """
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="ga4gh_profiles")
+        frontend.reset()
+        frontend.configure(
+            baseConfig="TestConfig", extraConfig={
+                "DATA_SOURCE": "__SIMULATED__",
+                "SLOW_QUERY_PROFILE_DIRECTORY": self._directory,
+                "SLOW_QUERY_PROFILE_SAMPLE_RATE": 1})
+        self.app = frontend.app.test_client()
+
+    def tearDown(self):
+        frontend.app.slowQueryProfiler = None
+        shutil.rmtree(self._directory)
+
+    def testCapture(self):
+        request = json.dumps({"pageSize": 1})
+        response = self.app.post(
+            "/datasets/search", data=request,
+            headers={"Content-type": "application/json"})
+        self.assertEqual(response.status_code, 200)
+        paths = profiling.findProfiles(self._directory)
+        self.assertEqual(len(paths), 1)
+        description = profiling.getRequestDescription(paths[0])
+        self.assertEqual(description["path"], "/datasets/search")
+        self.assertEqual(description["request"], request)
+        self.assertEqual(description["status"], 200)
@@ -0,0 +1,220 @@
+"""
+Tests the caches used to store search responses
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import ga4gh.backend as backend
+import ga4gh.cache as cache
+import ga4gh.protocol as protocol
+
+
+class LocalMemcachedClient(object):
+    """
+    A stand-in for a memcached client, storing values in a dict.
+    """
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, time=0):
+        self.values[key] = value
+
+
+class CacheTestMixin(object):
+    """
+    Tests common to all cache implementations.
+    """
+    def testGetSet(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", "value")
+        self.assertEqual(self.cache.get("a"), "value")
+        self.cache.set("a", "other")
+        self.assertEqual(self.cache.get("a"), "other")
+
+    def testStatistics(self):
+        self.cache.set("a", "value")
+        self.cache.get("a")
+        self.cache.get("b")
+        statistics = self.cache.getStatistics()
+        self.assertEqual(statistics.hits, 1)
+        self.assertEqual(statistics.misses, 1)
+        self.assertEqual(statistics.bytesSaved, len("value"))
+        self.assertEqual(statistics.getHitRatio(), 0.5)
+
+    def testConcurrentLookups(self):
+        numThreads = 8
+        numLookups = 1000
+        self.cache.set("a", "value")
+
+        def lookUp():
+            for _ in range(numLookups):
+                self.assertEqual(self.cache.get("a"), "value")
+                self.assertIsNone(self.cache.get("b"))
+
+        threads = [
+            threading.Thread(target=lookUp) for _ in range(numThreads)]
+        # switch threads as often as possible, to expose any races
+        checkInterval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(checkInterval)
+        statistics = self.cache.getStatistics()
+        self.assertEqual(statistics.hits, numThreads * numLookups)
+        self.assertEqual(statistics.misses, numThreads * numLookups)
+        self.assertEqual(
+            statistics.bytesSaved, numThreads * numLookups * len("value"))
+
+
+class TestLruCache(CacheTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.cache = cache.LruCache(10)
+
+    def testEviction(self):
+        self.cache.set("a", "aaaa")
+        self.cache.set("b", "bbbb")
+        self.cache.get("a")
+        self.cache.set("c", "cccc")
+        self.assertEqual(self.cache.getNumBytes(), 8)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), "aaaa")
+        self.assertEqual(self.cache.get("c"), "cccc")
+        self.cache.set("d", "d" * 11)
+        self.assertIsNone(self.cache.get("d"))
+
+    def testTimeToLive(self):
+        lruCache = cache.LruCache(10, ttl=-1)
+        lruCache.set("a", "aaaa")
+        self.assertIsNone(lruCache.get("a"))
+        self.assertEqual(lruCache.getNumBytes(), 0)
+
+
+class TestFileSystemCache(CacheTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="ga4gh_response_cache")
+        self.cache = cache.FileSystemCache(self._directory, 100)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def testSharedDirectory(self):
+        other = cache.FileSystemCache(self._directory, 100)
+        self.cache.set("a", "value")
+        self.assertEqual(other.get("a"), "value")
+
+    def testPrune(self):
+        fileSystemCache = cache.FileSystemCache(self._directory, 10)
+        fileSystemCache.set("a", "aaaaaa")
+        time.sleep(0.01)
+        fileSystemCache.set("b", "bbbbbb")
+        self.assertIsNone(fileSystemCache.get("a"))
+        self.assertEqual(fileSystemCache.get("b"), "bbbbbb")
+
+
+class TestMemcachedCache(CacheTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.client = LocalMemcachedClient()
+        self.cache = cache.MemcachedCache(self.client)
+
+    def testKeyPrefix(self):
+        self.cache.set("a", "value")
+        self.assertEqual(self.client.values.keys(), ["ga4gh:a"])
+
+
+class TestTokenStore(unittest.TestCase):
+    """
+    Tests the store of authentication tokens.
+    """
+    def setUp(self):
+        self.client = LocalMemcachedClient()
+        self.tokenStore = cache.TokenStore(cache.MemcachedCache(self.client))
+
+    def testAddGet(self):
+        authorization = ["code", "state", {"id_token": {"nonce": "n"}}]
+        self.assertIsNone(self.tokenStore.get("token"))
+        self.assertIsNone(self.tokenStore.get(None))
+        self.tokenStore.add("token", authorization)
+        self.assertEqual(self.tokenStore.get("token"), authorization)
+        self.assertIsNone(self.tokenStore.get("other"))
+
+    def testShared(self):
+        # a token issued by one process is accepted by another using the
+        # same memcached servers
+        otherStore = cache.TokenStore(cache.MemcachedCache(self.client))
+        self.tokenStore.add("token", "authorization")
+        self.assertEqual(otherStore.get("token"), "authorization")
+
+    def testTokensNotUsedAsPaths(self):
+        tempDir = tempfile.mkdtemp(prefix="ga4gh_token_test")
+        try:
+            tokenStore = cache.TokenStore(
+                cache.FileSystemCache(tempDir, 1000))
+            tokenStore.add("../token", "authorization")
+            self.assertEqual(tokenStore.get("../token"), "authorization")
+            self.assertIsNone(tokenStore.get("../" + os.path.basename(
+                tempDir) + "/" + os.listdir(tempDir)[0]))
+            self.assertEqual(len(os.listdir(tempDir)), 1)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def testBoundedAndExpiring(self):
+        tokenStore = cache.TokenStore(cache.LruCache(100, ttl=0.05))
+        for i in range(100):
+            tokenStore.add("token{}".format(i), "authorization")
+        self.assertLessEqual(tokenStore.getCache().getNumBytes(), 100)
+        self.assertIsNone(tokenStore.get("token0"))
+        self.assertIsNotNone(tokenStore.get("token99"))
+        time.sleep(0.1)
+        self.assertIsNone(tokenStore.get("token99"))
+
+
+class TestBackendResponseCache(unittest.TestCase):
+    """
+    Tests that search responses are served from the cache.
+    """
+    def setUp(self):
+        self.backend = backend.SimulatedBackend(numVariantSets=2)
+        self.responseCache = cache.LruCache(2**20)
+        self.backend.setResponseCache(self.responseCache)
+
+    def _searchDatasets(self, requestStr):
+        return self.backend.runSearchRequest(
+            requestStr, protocol.SearchDatasetsRequest,
+            protocol.SearchDatasetsResponse,
+            self.backend.datasetsGenerator)
+
+    def testCanonicalRequests(self):
+        first = self._searchDatasets('{"pageSize": 1, "pageToken": null}')
+        second = self._searchDatasets('{"pageToken": null, "pageSize": 1}')
+        self.assertEqual(first, second)
+        statistics = self.responseCache.getStatistics()
+        self.assertEqual(statistics.hits, 1)
+        self.assertEqual(statistics.misses, 1)
+        self.assertEqual(statistics.bytesSaved, len(first))
+        self._searchDatasets('{"pageSize": 2}')
+        self.assertEqual(statistics.misses, 2)
+
+    def testDataVersion(self):
+        self._searchDatasets('{}')
+        self.backend._dataVersion = "other"
+        self._searchDatasets('{}')
+        self.assertEqual(self.responseCache.getStatistics().hits, 0)
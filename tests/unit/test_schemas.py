@@ -308,6 +308,36 @@ class SearchResponseBuilderTest(SchemaTest):
                 otherInstance = class_.fromJsonString(builder.getJsonString())
                 self.assertEqual(instance,  otherInstance)
 
+    def testAddJsonStrings(self):
+        # Adding the JSON strings of values in chunks builds the same
+        # response as adding the values one by one
+        for class_ in protocol.getProtocolClasses(protocol.SearchResponse):
+            instance = self.getRandomInstance(class_)
+            valueList = getattr(instance, class_.getValueListName())
+            jsonStrings = [value.toJsonString() for value in valueList]
+            for avroBinary in [False, True]:
+                builders = [
+                    protocol.SearchResponseBuilder(
+                        class_, len(valueList), 2**32, avroBinary)
+                    for _ in range(2)]
+                for value in valueList:
+                    builders[0].addValue(value)
+                builders[1].addJsonStrings([])
+                builders[1].addJsonStrings(jsonStrings[:1])
+                builders[1].addJsonStrings(jsonStrings[1:])
+                self.assertEqual(
+                    builders[0].getNumElements(),
+                    builders[1].getNumElements())
+                if avroBinary:
+                    # the order of the entries in maps may differ
+                    self.assertEqual(
+                        class_.fromAvroBinary(builders[0].getAvroBinary()),
+                        class_.fromAvroBinary(builders[1].getAvroBinary()))
+                else:
+                    self.assertEqual(
+                        builders[0].getJsonString(),
+                        builders[1].getJsonString())
+
     def testPageSizeOverflow(self):
         # Verifies that the page size behaviour is correct when we keep
         # filling after full is True.
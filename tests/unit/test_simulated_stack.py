@@ -593,6 +593,68 @@ class TestSimulatedStack(unittest.TestCase):
                             offset: offset + len(response.sequence)])
                 self.assertEqual("".join(sequenceFragments), sequence)
 
+    def testGetReferenceSequence(self):
+        for referenceSet in self.backend.getReferenceSets():
+            for reference in referenceSet.getReferences():
+                path = '/references/{}/sequence'.format(reference.getId())
+                length = reference.getLength()
+                sequence = reference.getBases(0, length)
+                response = self.app.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.mimetype, "text/plain")
+                self.assertEqual(response.data, sequence)
+                ranges = [(0, length), (0, 1), (length - 1, length), (0, 0)]
+                for start, end in ranges:
+                    response = self.app.get(
+                        path, query_string={"start": start, "end": end})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.data, sequence[start:end])
+
+    def testGetReferenceSequenceTwoBit(self):
+        reference = self.backend.getReferenceSets()[0].getReferences()[0]
+        path = '/references/{}/sequence'.format(reference.getId())
+        length = reference.getLength()
+        sequence = reference.getBases(0, length)
+        headers = {"Accept": "application/octet-stream"}
+        for start, end in [(0, length), (3, 10), (5, 6), (0, 0)]:
+            response = self.app.get(
+                path, headers=headers,
+                query_string={"start": start, "end": end})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "application/octet-stream")
+            self.assertEqual(len(response.data), (end - start + 3) // 4)
+            self.assertEqual(
+                references.unpackTwoBit(response.data, end - start),
+                sequence[start:end])
+
+    def testGetReferenceSequenceRange(self):
+        reference = self.backend.getReferenceSets()[0].getReferences()[0]
+        path = '/references/{}/sequence'.format(reference.getId())
+        length = reference.getLength()
+        sequence = reference.getBases(0, length)
+        for first, last in [(0, 0), (10, 19), (length - 1, length - 1)]:
+            headers = {"Range": "bytes={}-{}".format(first, last)}
+            response = self.app.get(path, headers=headers)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.data, sequence[first:last + 1])
+            self.assertEqual(
+                response.headers["Content-Range"],
+                "bytes {}-{}/{}".format(first, last, length))
+        headers = {"Range": "bytes={}-".format(length)}
+        response = self.app.get(path, headers=headers)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(
+            response.headers["Content-Range"], "bytes */{}".format(length))
+        headers["Accept"] = "application/octet-stream"
+        response = self.app.get(path, headers=headers)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(
+            response.headers["Content-Range"],
+            "bytes */{}".format((length + 3) // 4))
+        args = {"start": 0, "end": length + 1}
+        response = self.app.get(path, query_string=args)
+        self.assertEqual(response.status_code, 416)
+
     def testReads(self):
         path = '/reads/search'
         for dataset in self.backend.getDatasets():
@@ -5,6 +5,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import hashlib
 import unittest
 
 import ga4gh.datamodel as datamodel
@@ -12,6 +13,7 @@ import ga4gh.datamodel.datasets as datasets
 import ga4gh.datamodel.reads as reads
 import ga4gh.datamodel.references as references
 import ga4gh.datamodel.variants as variants
+import ga4gh.protocol as protocol
 
 
 class TestSimulatedVariantSet(unittest.TestCase):
@@ -108,6 +110,37 @@ class TestSimulatedVariantSet(unittest.TestCase):
         variantListTwo = self._getSimulatedVariantsList()
         self.assertEqual(variantListOne, variantListTwo)
 
+    def _getVariantPositions(self, variantSet, start, end):
+        return [
+            variant.start for variant in variantSet.getVariants(
+                self.referenceName, start, end, self.callSetIds)]
+
+    def testPositionsIndependentOfRange(self):
+        # the variants at a position should not depend on the range
+        # searched, including ranges crossing the blocks in which
+        # positions are generated
+        self.variantDensity = 0.01
+        variantSet = self._getSimulatedVariantSet()
+        blockSize = variantSet._getBlockSize()
+        positions = self._getVariantPositions(variantSet, 0, 3 * blockSize)
+        for start, end in [
+                (1, 3 * blockSize), (blockSize - 5, 2 * blockSize + 5),
+                (positions[10], positions[20] + 1)]:
+            self.assertEqual(
+                self._getVariantPositions(variantSet, start, end),
+                [p for p in positions if start <= p < end])
+        self.assertEqual(len(set(positions)), len(positions))
+        self.assertEqual(positions, sorted(positions))
+
+    def testDensity(self):
+        self.variantDensity = 0.001
+        variantSet = self._getSimulatedVariantSet()
+        positions = self._getVariantPositions(variantSet, 0, 10**7)
+        self.assertAlmostEqual(len(positions) / 10**7, 0.001, delta=0.0001)
+        self.variantDensity = 0
+        variantSet = self._getSimulatedVariantSet()
+        self.assertEqual(self._getVariantPositions(variantSet, 0, 100), [])
+
     def _assertEqualVariantLists(self, variantListOne, variantListTwo):
         # need to make time-dependent fields equal before the comparison,
         # otherwise we're introducing a race condition
@@ -129,6 +162,165 @@ class TestSimulatedReadGroupSet(unittest.TestCase):
         referenceSet = references.SimulatedReferenceSet("srs1")
         simulatedReadGroupSet = reads.SimulatedReadGroupSet(
                 dataset, localId, referenceSet)
+        reference = referenceSet.getReferences()[0]
         for readGroup in simulatedReadGroupSet.getReadGroups():
-            alignments = list(readGroup.getReadAlignments())
+            alignments = list(readGroup.getReadAlignments(reference))
             self.assertGreater(len(alignments), 0)
+
+    def testNumAlignedReads(self):
+        dataset = datasets.AbstractDataset('dataset1')
+        referenceSet = references.SimulatedReferenceSet(
+            "srs1", numReferences=3)
+        readGroupSet = reads.SimulatedReadGroupSet(
+            dataset, "readGroupSetId", referenceSet, numReadGroups=2,
+            numAlignments=7, readLength=20)
+        for readGroup in readGroupSet.getReadGroups():
+            numAlignments = sum(
+                len(list(readGroup.getReadAlignments(reference)))
+                for reference in referenceSet.getReferences())
+            self.assertEqual(numAlignments, 3 * 7)
+            self.assertEqual(readGroup.getNumAlignedReads(), numAlignments)
+        self.assertEqual(readGroupSet.getNumAlignedReads(), 2 * 3 * 7)
+        self.assertEqual(
+            readGroupSet.toProtocolElement().stats.alignedReadCount,
+            2 * 3 * 7)
+
+
+class TestSimulatedReadGroup(unittest.TestCase):
+    """
+    Test the reads generated by the simulated ReadGroup
+    """
+    def setUp(self):
+        dataset = datasets.AbstractDataset('dataset1')
+        referenceSet = references.SimulatedReferenceSet("srs1")
+        self.reference = referenceSet.getReferences()[0]
+        self.readLength = 50
+        readGroupSet = reads.SimulatedReadGroupSet(
+            dataset, "readGroupSetId", referenceSet, numAlignments=100,
+            readLength=self.readLength)
+        self.readGroup = readGroupSet.getReadGroups()[0]
+
+    def _getReadAlignments(self, start=None, end=None):
+        return list(self.readGroup.getReadAlignments(
+            self.reference, start, end))
+
+    def _getInterval(self, alignment):
+        start = alignment.alignment.position.position
+        return start, start + self.readGroup._getReferenceSpan(alignment)
+
+    def testReads(self):
+        alignments = self._getReadAlignments()
+        self.assertEqual(len(alignments), 100)
+        starts = [self._getInterval(a)[0] for a in alignments]
+        self.assertEqual(starts, sorted(starts))
+        for alignment in alignments:
+            start, end = self._getInterval(alignment)
+            self.assertLessEqual(end, self.reference.getLength())
+            self.assertEqual(
+                len(alignment.alignedSequence), self.readLength)
+            self.assertEqual(
+                len(alignment.alignedQuality), self.readLength)
+            self.assertEqual(
+                sum(unit.operationLength for unit in alignment.alignment.cigar
+                    if unit.operation != protocol.CigarOperation.DELETE),
+                self.readLength)
+            self.assertEqual(alignment.info["RG"], ["rg0"])
+        self.assertEqual(len(set(a.id for a in alignments)), len(alignments))
+
+    def testMates(self):
+        # each fragment has two reads, each pointing at the other
+        fragments = {}
+        for alignment in self._getReadAlignments():
+            fragments.setdefault(alignment.fragmentName, []).append(alignment)
+        self.assertEqual(len(fragments), 50)
+        for first, second in fragments.values():
+            self.assertEqual(
+                set([first.readNumber, second.readNumber]), set([0, 1]))
+            self.assertEqual(first.fragmentId, second.fragmentId)
+            self.assertEqual(
+                datamodel.ReadAlignmentCompoundId.parse(
+                    first.fragmentId).readGroupId, self.readGroup.getId())
+            for alignment, mate in [(first, second), (second, first)]:
+                self.assertEqual(alignment.numberReads, 2)
+                self.assertTrue(alignment.properPlacement)
+                self.assertEqual(
+                    alignment.nextMatePosition.position,
+                    mate.alignment.position.position)
+                self.assertEqual(
+                    alignment.nextMatePosition.strand,
+                    mate.alignment.position.strand)
+            self.assertEqual(first.fragmentLength, -second.fragmentLength)
+
+    def testUnpairedRead(self):
+        # with an odd number of reads, the last one has no mate
+        dataset = datasets.AbstractDataset('dataset1')
+        readGroupSet = reads.SimulatedReadGroupSet(
+            dataset, "readGroupSetId", self.reference.getParentContainer(),
+            numAlignments=5, readLength=self.readLength)
+        readGroup = readGroupSet.getReadGroups()[0]
+        alignments = list(readGroup.getReadAlignments(self.reference))
+        self.assertEqual(len(alignments), 5)
+        unpaired = [a for a in alignments if a.numberReads == 1]
+        self.assertEqual(len(unpaired), 1)
+        self.assertIsNone(unpaired[0].nextMatePosition)
+        self.assertEqual(unpaired[0].readNumber, 0)
+
+    def testIntervals(self):
+        # searching an interval returns exactly the reads overlapping it,
+        # and the same reads as a search of the whole reference
+        alignments = self._getReadAlignments()
+        for start, end in [(0, 10), (60, 61), (75, 150), (190, 200)]:
+            expected = [
+                alignment for alignment in alignments
+                if self._getInterval(alignment)[0] < end and
+                self._getInterval(alignment)[1] > start]
+            self.assertEqual(self._getReadAlignments(start, end), expected)
+
+
+class TestSimulatedReferenceSet(unittest.TestCase):
+    """
+    Test properties of the SimulatedReferenceSet
+    """
+    def setUp(self):
+        self.referenceSet = references.SimulatedReferenceSet(
+            "referenceSet1", randomSeed=1, numReferences=3)
+
+    def _computeMd5Checksum(self):
+        checksums = sorted(
+            ref.getMd5Checksum() for ref in self.referenceSet.getReferences())
+        return hashlib.md5(''.join(checksums)).hexdigest()
+
+    def testMd5ChecksumInvalidatedByAddReference(self):
+        md5checksum = self.referenceSet.getMd5Checksum()
+        self.assertEqual(md5checksum, self._computeMd5Checksum())
+        reference = references.SimulatedReference(
+            self.referenceSet, "extra", randomSeed=5)
+        self.referenceSet.addReference(reference)
+        self.assertNotEqual(md5checksum, self.referenceSet.getMd5Checksum())
+        self.assertEqual(
+            self.referenceSet.getMd5Checksum(), self._computeMd5Checksum())
+
+    def testJsonStringInvalidatedByAddReference(self):
+        jsonString = self.referenceSet.toJsonString()
+        self.assertIs(jsonString, self.referenceSet.toJsonString())
+        reference = references.SimulatedReference(
+            self.referenceSet, "extra", randomSeed=5)
+        self.referenceSet.addReference(reference)
+        self.assertNotEqual(jsonString, self.referenceSet.toJsonString())
+        self.assertEqual(
+            self.referenceSet.toJsonString(),
+            self.referenceSet.toProtocolElement().toJsonString())
+
+    def testReferenceIndexes(self):
+        for reference in self.referenceSet.getReferences():
+            self.assertIn(
+                reference, self.referenceSet.getReferencesByMd5Checksum(
+                    reference.getMd5Checksum()))
+            for accession in reference.getSourceAccessions():
+                self.assertIn(
+                    reference,
+                    self.referenceSet.getReferencesByAccession(accession))
+        self.assertEqual(
+            self.referenceSet.getReferencesByMd5Checksum("nonexistent"), [])
+        self.assertEqual(
+            self.referenceSet.getReferencesByAccession("nonexistent"), [])
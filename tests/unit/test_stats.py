@@ -0,0 +1,203 @@
+"""
+Tests the statistics computed for variant and alignment files
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.cli as cli
+import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.references as references
+import ga4gh.datamodel.stats as stats
+import ga4gh.datamodel.variants as variants
+
+
+class TestVariantStats(unittest.TestCase):
+    """
+    Tests the variant and call counts of a variant set
+    """
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="ga4gh_stats")
+        self._dataset = datasets.AbstractDataset("ds")
+        # The index of example_4 records the number of variants on each
+        # chromosome, and that of example_1 does not.
+        self._dataFile = self._copyVariantSet("example_4")
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _copyVariantSet(self, name):
+        sourceDir = os.path.join(
+            "tests/data/datasets/dataset1/variants", name)
+        shutil.copytree(sourceDir, os.path.join(self._directory, name))
+        return os.path.join(self._directory, name, name + ".vcf.gz")
+
+    def _getVariantSet(self, dataFile):
+        return variants.HtslibVariantSet(
+            self._dataset, "vs", os.path.dirname(dataFile), None)
+
+    def _getExpectedCounts(self, variantSet):
+        variantCounts = collections.Counter()
+        callCounts = collections.Counter()
+        for referenceName in variantSet.getVariantCounts():
+            for variant in variantSet.getVariants(
+                    referenceName, 0, 2**31, None):
+                variantCounts[referenceName] += 1
+                for call in variant.calls:
+                    if call.genotype != [-1]:
+                        callCounts[call.callSetName] += 1
+        return variantCounts, callCounts
+
+    def testIndexRecordCounts(self):
+        indexCounts = stats.readIndexRecordCounts(
+            stats.getIndexFilePath(self._dataFile))
+        fileStats = stats.computeVariantFileStats(self._dataFile)
+        self.assertEqual(indexCounts, fileStats["variantCounts"])
+        self.assertEqual(
+            indexCounts, {"chrM": 25, "20": 15, "chr1": 29, "1": 19})
+
+    def testCountsFromIndex(self):
+        variantSet = self._getVariantSet(self._dataFile)
+        variantCounts, _ = self._getExpectedCounts(variantSet)
+        self.assertEqual(variantSet.getVariantCounts(), variantCounts)
+        self.assertEqual(
+            variantSet.getNumVariants(), sum(variantCounts.values()))
+        for callSet in variantSet.getCallSets():
+            self.assertEqual(variantSet.getNumCalls(callSet.getLocalId()), -1)
+
+    def testCountsFromStatsFile(self):
+        dataFile = self._copyVariantSet("example_1")
+        variantSet = self._getVariantSet(dataFile)
+        self.assertIsNone(variantSet.getVariantCounts())
+        self.assertEqual(variantSet.getNumVariants(), -1)
+        stats.writeStatsFile(dataFile, stats.computeStats(dataFile))
+        variantSet = self._getVariantSet(dataFile)
+        variantCounts, callCounts = self._getExpectedCounts(variantSet)
+        self.assertEqual(variantSet.getVariantCounts(), variantCounts)
+        self.assertEqual(
+            variantSet.getNumVariants(), sum(variantCounts.values()))
+        self.assertGreater(len(callCounts), 0)
+        for callSet in variantSet.getCallSets():
+            name = callSet.getLocalId()
+            self.assertEqual(variantSet.getNumCalls(name), callCounts[name])
+
+    def testStaleStatsFile(self):
+        stats.writeStatsFile(self._dataFile, {"variantCounts": {}})
+        self.assertIsNotNone(stats.readStatsFile(self._dataFile))
+        modificationTime = os.stat(self._dataFile).st_mtime
+        os.utime(self._dataFile, (modificationTime, modificationTime - 10))
+        self.assertIsNone(stats.readStatsFile(self._dataFile))
+        with open(stats.getStatsFilePath(self._dataFile), "w") as statsFile:
+            statsFile.write("{")
+        self.assertIsNone(stats.readStatsFile(self._dataFile))
+
+    def testFindDataFiles(self):
+        dataFile = self._copyVariantSet("example_1")
+        self.assertEqual(
+            cli.findDataFiles([self._directory]), [dataFile, self._dataFile])
+        self.assertEqual(
+            cli.findDataFiles([self._dataFile]), [self._dataFile])
+
+
+class TestReadStats(unittest.TestCase):
+    """
+    Tests the read and base counts of read groups
+    """
+    def setUp(self):
+        self._directory = tempfile.mkdtemp(prefix="ga4gh_stats")
+        sourceFile = "tests/data/datasets/dataset1/reads/chr17.1-250.bam"
+        for path in [sourceFile, sourceFile + ".bai"]:
+            shutil.copy(path, self._directory)
+        self._dataFile = os.path.join(self._directory, "chr17.1-250.bam")
+        self._dataset = datasets.AbstractDataset("ds")
+        self._backend = backend.AbstractBackend()
+        self._backend.addReferenceSet(
+            references.AbstractReferenceSet(
+                references.DEFAULT_REFERENCESET_NAME))
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _getReadGroupSet(self):
+        return reads.HtslibReadGroupSet(
+            self._dataset, "rgs", self._dataFile, self._backend)
+
+    def _getExpectedCounts(self):
+        counts = collections.defaultdict(collections.Counter)
+        samFile = pysam.AlignmentFile(self._dataFile)
+        for read in samFile.fetch(until_eof=True):
+            readGroupName = dict(read.tags).get("RG")
+            for name in set([readGroupName, None]):
+                if read.is_unmapped:
+                    counts[name]["unalignedReadCount"] += 1
+                else:
+                    counts[name]["alignedReadCount"] += 1
+                counts[name]["baseCount"] += len(read.query_sequence)
+        samFile.close()
+        return counts
+
+    def testCountsWithoutStatsFile(self):
+        readGroupSet = self._getReadGroupSet()
+        self.assertIsNone(readGroupSet.getBaseCount())
+        for readGroup in readGroupSet.getReadGroups():
+            readStats = readGroup.toProtocolElement().stats
+            self.assertEqual(readStats.alignedReadCount, -1)
+            self.assertEqual(readStats.unalignedReadCount, -1)
+            self.assertIsNone(readStats.baseCount)
+
+    def testCountsFromStatsFile(self):
+        stats.writeStatsFile(
+            self._dataFile, stats.computeStats(self._dataFile))
+        readGroupSet = self._getReadGroupSet()
+        expectedCounts = self._getExpectedCounts()
+        self.assertEqual(
+            readGroupSet.toProtocolElement().stats.baseCount,
+            expectedCounts[None]["baseCount"])
+        readGroups = readGroupSet.getReadGroups()
+        self.assertGreater(len(readGroups), 1)
+        for readGroup in readGroups:
+            readStats = readGroup.toProtocolElement().stats
+            expected = expectedCounts[readGroup.getLocalId()]
+            self.assertGreater(expected["alignedReadCount"], 0)
+            self.assertEqual(
+                readStats.alignedReadCount, expected["alignedReadCount"])
+            self.assertEqual(
+                readStats.unalignedReadCount, expected["unalignedReadCount"])
+            self.assertEqual(readStats.baseCount, expected["baseCount"])
+
+    def _getBaseCounts(self, objects):
+        return [
+            json.loads(obj.toJsonString())["stats"]["baseCount"]
+            for obj in objects]
+
+    def testStatsFileWrittenWhileServing(self):
+        readGroupSet = self._getReadGroupSet()
+        objects = [readGroupSet] + readGroupSet.getReadGroups()
+        self.assertEqual(self._getBaseCounts(objects), [None] * len(objects))
+        stats.writeStatsFile(
+            self._dataFile, stats.computeStats(self._dataFile))
+        # the statistics file is not looked at again until the check
+        # interval has passed
+        self.assertEqual(self._getBaseCounts(objects), [None] * len(objects))
+        readGroupSet.statsFileCheckInterval = 0
+        expectedCounts = self._getExpectedCounts()
+        self.assertEqual(
+            self._getBaseCounts(objects),
+            [expectedCounts[None]["baseCount"]] + [
+                expectedCounts[readGroup.getLocalId()]["baseCount"]
+                for readGroup in objects[1:]])
+        os.unlink(stats.getStatsFilePath(self._dataFile))
+        self.assertEqual(self._getBaseCounts(objects), [None] * len(objects))
+        for obj in objects:
+            self.assertIsNone(obj.toJsonDict()["stats"]["baseCount"])
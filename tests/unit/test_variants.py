@@ -9,6 +9,7 @@ from __future__ import unicode_literals
 import unittest
 
 import ga4gh.datamodel.variants as variants
+import ga4gh.exceptions as exceptions
 
 
 class TestGenotypes(unittest.TestCase):
@@ -70,3 +71,51 @@ class TestGenotypes(unittest.TestCase):
 
     def testGenotypeHaploid(self):
         self.verifyGenotypeConversion("1", "376", [1], None)
+
+
+class TestZygosity(unittest.TestCase):
+    """
+    Unit tests for the zygosity of VCF genotypes.
+    """
+    def testZygosity(self):
+        for vcfGenotype, zygosity in [
+                ("0/0", "HOM_REF"), ("0|0", "HOM_REF"), ("0", "HOM_REF"),
+                ("0/1", "HET"), ("1|0", "HET"), ("2/1", "HET"),
+                ("1/1", "HOM_ALT"), ("2|2", "HOM_ALT"), ("1", "HOM_ALT"),
+                ("./.", "NO_CALL"), ("0/.", "NO_CALL"), (".", "NO_CALL"),
+                ("", "NO_CALL")]:
+            self.assertEqual(variants.getZygosity(vcfGenotype), zygosity)
+
+
+class TestVariantFilter(unittest.TestCase):
+    """
+    Unit tests for parsing the filters of search variants requests.
+    """
+    def testParse(self):
+        variantFilter = variants.VariantFilter.fromJsonDict({
+            "minQuality": 30, "filterNames": ["PASS"],
+            "info": [{"key": "DB"}, {"key": "DP", "operator": ">=",
+                                     "value": 10}],
+            "genotypes": [{"callSetId": "cs", "zygosities": ["HET"]}]})
+        self.assertEqual(variantFilter.minQuality, 30)
+        self.assertEqual(variantFilter.filterNames, frozenset(["PASS"]))
+        self.assertEqual(variantFilter.info[0], ("DB", None))
+        self.assertEqual(variantFilter.info[1][0], "DP")
+        self.assertEqual(
+            variantFilter.genotypes, [("cs", frozenset(["HET"]))])
+        emptyFilter = variants.VariantFilter.fromJsonDict({})
+        self.assertIsNone(emptyFilter.minQuality)
+        self.assertIsNone(emptyFilter.filterNames)
+
+    def testInvalidFilters(self):
+        for filters in [
+                [], {"unknown": 1}, {"minQuality": "high"},
+                {"minQuality": True}, {"filterNames": "PASS"},
+                {"info": [{"operator": "=="}]},
+                {"info": [{"key": "DP", "operator": "~", "value": 1}]},
+                {"info": [{"key": "DP", "operator": ">", "value": None}]},
+                {"genotypes": [{"zygosities": ["HET"]}]},
+                {"genotypes": [{"callSetId": "cs", "zygosities": "HET"}]},
+                {"genotypes": [{"callSetId": "cs", "zygosities": ["X"]}]}]:
+            with self.assertRaises(exceptions.InvalidSearchFilterException):
+                variants.VariantFilter.fromJsonDict(filters)
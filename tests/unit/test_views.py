@@ -7,6 +7,9 @@ from __future__ import unicode_literals
 
 import unittest
 import logging
+import zlib
+
+import flask
 
 import ga4gh.datamodel as datamodel
 import ga4gh.frontend as frontend
@@ -54,7 +57,8 @@ class TestFrontend(unittest.TestCase):
         cls.readGroupSetId = cls.readGroupSet.getId()
         cls.readGroup = cls.readGroupSet.getReadGroups()[0]
         cls.readGroupId = cls.readGroup.getId()
-        cls.readAlignment = cls.readGroup.getReadAlignments().next()
+        cls.readAlignment = cls.readGroup.getReadAlignments(
+            cls.reference).next()
         cls.readAlignmentId = cls.readAlignment.id
 
     def sendPostRequest(self, path, request):
@@ -223,6 +227,41 @@ class TestFrontend(unittest.TestCase):
         assertHeaders(self.sendGetVariant())
         assertHeaders(self.sendGetDataset())
         # TODO: Test other methods as they are implemented
+        # Requests without an Origin are not cross-origin
+        response = self.app.get('/datasets/{}'.format(self.datasetId))
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('Access-Control-Allow-Origin', response.headers)
+
+    def testDirectRouting(self):
+        # requests matched directly against a single rule are routed in
+        # the same way as those matched against every rule
+        adapter = frontend.app.url_map.bind('localhost')
+        for method, path in [
+                ('GET', '/callsets/{}'.format(self.callSetId)),
+                ('HEAD', '/callsets/{}'.format(self.callSetId)),
+                ('OPTIONS', '/callsets/{}'.format(self.callSetId)),
+                ('GET', '/callsets/search'),
+                ('POST', '/callsets/search'),
+                ('OPTIONS', '/callsets/search'),
+                ('GET', '/references/{}'.format(self.referenceId)),
+                ('GET', '/references/{}/bases'.format(self.referenceId)),
+                ('GET', '/readgroups/search'),
+                ('GET', '/variants/'),
+                ('GET', '/variants/x/y'),
+                ('GET', '/metrics'),
+                ('GET', '/doesNotExist/x')]:
+            results = []
+            for matchAdapter in [adapter, adapter._adapter]:
+                try:
+                    results.append(matchAdapter.match(path, method))
+                except Exception as exception:
+                    results.append(type(exception))
+            self.assertEqual(results[0], results[1])
+
+    def testNoSessionWithoutOidc(self):
+        with frontend.app.test_request_context('/'):
+            self.assertIsNone(frontend.app.session_interface.open_session(
+                frontend.app, flask.request))
 
     def verifySearchRouting(self, path, getDefined=False):
         """
@@ -277,6 +316,146 @@ class TestFrontend(unittest.TestCase):
         self.verifySearchRouting('/variantsets/search', True)
         self.verifySearchRouting('/variants/search', False)
 
+    def testConditionalGet(self):
+        path = "/datasets/{}".format(self.datasetId)
+        response = self.sendGetRequest(path)
+        self.assertEqual(200, response.status_code)
+        entityTag, weak = response.get_etag()
+        self.assertIsNotNone(entityTag)
+        self.assertFalse(weak)
+        self.assertIn("Cache-Control", response.headers)
+        headers = {"If-None-Match": '"{}"'.format(entityTag)}
+        response = self.app.get(path, headers=headers)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(0, len(response.data))
+        self.assertEqual(entityTag, response.get_etag()[0])
+        otherPath = "/variantsets/{}".format(self.variantSetId)
+        response = self.app.get(otherPath, headers=headers)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(entityTag, response.get_etag()[0])
+
+    def testConditionalSearch(self):
+        response = self.sendVariantSetsSearch()
+        self.assertEqual(200, response.status_code)
+        entityTag = response.get_etag()[0]
+        request = protocol.SearchVariantSetsRequest()
+        request.datasetId = self.datasetId
+        headers = {
+            'Content-type': 'application/json',
+            'If-None-Match': '"{}"'.format(entityTag),
+        }
+        response = self.app.post(
+            '/variantsets/search', headers=headers,
+            data=request.toJsonString())
+        self.assertEqual(304, response.status_code)
+        request.pageSize = 1
+        response = self.app.post(
+            '/variantsets/search', headers=headers,
+            data=request.toJsonString())
+        self.assertEqual(200, response.status_code)
+
+    def testCompression(self):
+        minLength = frontend.app.config["RESPONSE_COMPRESSION_MIN_LENGTH"]
+        frontend.app.config["RESPONSE_COMPRESSION_MIN_LENGTH"] = 0
+        try:
+            uncompressed = self.sendVariantSetsSearch()
+            self.assertNotIn("Content-Encoding", uncompressed.headers)
+            request = protocol.SearchVariantSetsRequest()
+            request.datasetId = self.datasetId
+            for encoding, windowBits in [
+                    ("gzip", 16 + zlib.MAX_WBITS),
+                    ("deflate", zlib.MAX_WBITS)]:
+                headers = {
+                    'Content-type': 'application/json',
+                    'Accept-Encoding': encoding,
+                }
+                response = self.app.post(
+                    '/variantsets/search', headers=headers,
+                    data=request.toJsonString())
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(
+                    encoding, response.headers["Content-Encoding"])
+                self.assertIn("Accept-Encoding", response.vary)
+                self.assertEqual(
+                    uncompressed.data,
+                    zlib.decompress(response.data, windowBits))
+                self.assertNotEqual(
+                    uncompressed.get_etag(), response.get_etag())
+        finally:
+            frontend.app.config["RESPONSE_COMPRESSION_MIN_LENGTH"] = minLength
+
+    def testStreamedCompression(self):
+        path = "/references/{}/sequence".format(self.referenceId)
+        minLength = frontend.app.config["RESPONSE_COMPRESSION_MIN_LENGTH"]
+        frontend.app.config["RESPONSE_COMPRESSION_MIN_LENGTH"] = 0
+        try:
+            uncompressed = self.app.get(path)
+            response = self.app.get(
+                path, headers={"Accept-Encoding": "gzip"})
+            self.assertEqual("gzip", response.headers["Content-Encoding"])
+            self.assertNotIn("Content-Length", response.headers)
+            self.assertEqual(
+                uncompressed.data,
+                zlib.decompress(response.data, 16 + zlib.MAX_WBITS))
+            response = self.app.get(path, headers={
+                "Accept-Encoding": "gzip", "Range": "bytes=0-9"})
+            self.assertEqual(206, response.status_code)
+            self.assertNotIn("Content-Encoding", response.headers)
+        finally:
+            frontend.app.config["RESPONSE_COMPRESSION_MIN_LENGTH"] = minLength
+
+    def testAvroBinarySearch(self):
+        jsonResponse = self.sendVariantSetsSearch()
+        request = protocol.SearchVariantSetsRequest()
+        request.datasetId = self.datasetId
+        headers = {
+            'Content-type': 'application/json',
+            'Accept': 'avro/binary',
+        }
+        response = self.app.post(
+            '/variantsets/search', headers=headers,
+            data=request.toJsonString())
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("avro/binary", response.mimetype)
+        self.assertEqual(
+            protocol.SearchVariantSetsResponse.fromJsonString(
+                jsonResponse.data),
+            protocol.SearchVariantSetsResponse.fromAvroBinary(response.data))
+
+    def testMetrics(self):
+        self.sendVariantSetsSearch()
+        response = self.app.get('/metrics')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("text/plain", response.mimetype)
+        text = response.data
+        for name in [
+                "ga4gh_http_requests_total",
+                "ga4gh_http_request_duration_seconds_bucket",
+                "ga4gh_http_response_bytes_total",
+                "ga4gh_search_page_objects_count",
+                "ga4gh_file_handle_cache_hits_total"]:
+            self.assertIn(name, text)
+        self.assertIn(
+            'ga4gh_http_requests_total{endpoint="searchVariantSets",'
+            'method="POST",status="200"}', text)
+
+    def testStageTiming(self):
+        response = self.sendVariantsSearch()
+        self.assertNotIn("Server-Timing", response.headers)
+        frontend.app.config["STAGE_TIMING"] = True
+        try:
+            response = self.sendVariantsSearch()
+        finally:
+            frontend.app.config["STAGE_TIMING"] = False
+        self.assertEqual(200, response.status_code)
+        stages = [
+            metric.split(";")[0]
+            for metric in response.headers["Server-Timing"].split(", ")]
+        for stage in [
+                "json-parse", "request-validation", "id-parse", "serialize",
+                "total"]:
+            self.assertIn(stage, stages)
+
     def testRouteIndex(self):
         path = "/"
         response = self.app.get(path)
@@ -365,7 +544,9 @@ class TestFrontend(unittest.TestCase):
         self.assertEqual(200, response.status_code)
         responseData = protocol.SearchReadsResponse.fromJsonString(
             response.data)
-        self.assertEqual(len(responseData.alignments), 2)
+        self.assertEqual(
+            len(responseData.alignments),
+            len(list(self.readGroup.getReadAlignments(self.reference))))
         self.assertEqual(
             responseData.alignments[0].id,
             self.readAlignmentId)